@@ -1,47 +1,129 @@
 import os
+import asyncio
+import time
+from functools import wraps
+from aiohttp import web
 from dotenv import load_dotenv
-import telebot
-from substrateinterface import SubstrateInterface, Keypair
-from hashlib import blake2b
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import Update
+from chain import (
+    DEFAULT_CHAIN,
+    chain_pool,
+    chain_ss58_format,
+    decode_call,
+    get_balances,
+    MAX_SIGNATORIES,
+    MIN_THRESHOLD,
+    prepare_proposal,
+    run_chain,
+    submit_signed,
+)
+from substrateinterface.utils.ss58 import ss58_decode, ss58_encode
+from keys import KeyPool, Wallet
+from metrics import HANDLER_SECONDS, collector, render
+from store import (
+    UNSAVED_FIELDS,
+    GroupStore,
+    index_group,
+    other_signatories,
+    wallets_from_record,
+    wallets_to_record,
+)
+from inbox import Inbox
+from outbox import Outbox
+from timers import TimerWheel
 
 # Load environment variables
 load_dotenv()
 BOT_TOKEN = os.getenv("TELEGRAM_API_KEY")
-bot = telebot.TeleBot(BOT_TOKEN)
+# Point the bot at a local Bot API server, e.g. a fake one for load testing
+if os.getenv("TELEGRAM_API_URL"):
+    asyncio_helper.API_URL = os.getenv("TELEGRAM_API_URL") + "/bot{0}/{1}"
+bot = AsyncTeleBot(BOT_TOKEN)
+# chat_member updates are only sent when requested explicitly
+ALLOWED_UPDATES = ["message", "chat_member", "my_chat_member"]
+# Outgoing messages are rate limited and sent in the background
+outbox = Outbox(bot)
 
-# Connect to the default parachain
-DEFAULT_RPC_URL = "wss://westend-rpc.polkadot.io"
-substrate = SubstrateInterface(
-    url=DEFAULT_RPC_URL, ss58_format=42, type_registry_preset="westend"
-)
+# Keypairs are generated ahead of time so /hi never waits on key derivation
+key_pool = KeyPool()
+
+
+# Groups, wallets and chat state are persisted so a restart doesn't lose them
+store = GroupStore(os.getenv("BOT_STORE_PATH", "bot.db"))
+
+
+def save_group(group_id):
+    group = groups[group_id]
+    store.put(
+        "groups",
+        group_id,
+        {key: value for key, value in group.items() if key not in UNSAVED_FIELDS},
+    )
+
+
+def group_from_record(record, wallets):
+    chain = record.setdefault("chain", DEFAULT_CHAIN)
+    return index_group(
+        {**record, "wallets": wallets_from_record(wallets, chain["ss58_format"])}
+    )
 
 
+def load_groups():
+    wallets = store.load("wallets", secret=True)
+    return {
+        group_id: group_from_record(record, wallets[group_id])
+        for group_id, record in store.load("groups").items()
+    }
+
+
+# Sharded workers (see shard.py) load each chat and its group from the store
+# the first time they see it, instead of everything at startup
+LAZY_STATE = os.getenv("BOT_LAZY_STATE") == "1"
+
 # In-memory storage for group and wallet info
-groups = {}
+groups = {} if LAZY_STATE else load_groups()
+# Multisig calls prepared at proposal time, ready to sign, keyed by group_id
+prepared_calls = {}
 
 
-def init_group(group_id: str, usernames: list[str], threshold: int):
+def init_group(
+    group_id: str, usernames: list[str], threshold: int, chain: dict = DEFAULT_CHAIN
+):
     if group_id in groups:
         return {"error": "Group already exists"}
 
-    wallets = {
-        username: Keypair.create_from_mnemonic(Keypair.generate_mnemonic())
-        for username in usernames
-    }
+    if len(usernames) > MAX_SIGNATORIES:
+        return {"error": f"Groups can have at most {MAX_SIGNATORIES} members"}
 
-    sorted_addresses = sorted([wallet.ss58_address for wallet in wallets.values()])
-    multisig_account_id = substrate.generate_multisig_account(
-        signatories=sorted_addresses, threshold=threshold
-    )
+    if len(usernames) < MIN_THRESHOLD:
+        return {"error": f"Groups need at least {MIN_THRESHOLD} members"}
+
+    if not MIN_THRESHOLD <= threshold <= len(usernames):
+        return {
+            "error": f"Threshold must be between {MIN_THRESHOLD} and {len(usernames)}"
+        }
+
+    mnemonics, keys = key_pool.take(len(usernames), chain["ss58_format"])
+    group = index_group({"usernames": usernames, "wallets": dict(zip(usernames, keys))})
+    wallets = group["wallets"]
+
+    with chain_pool(chain).connection() as substrate:
+        multisig_account_id = substrate.generate_multisig_account(
+            signatories=group["signatories"], threshold=threshold
+        )
     multisig_address = multisig_account_id.ss58_address
 
     groups[group_id] = {
-        "usernames": usernames,
-        "wallets": wallets,
+        **group,
         "multisig_address": multisig_address,
         "threshold": threshold,
+        "chain": chain,
         "pending_tx": None,
     }
+    store.put("wallets", group_id, wallets_to_record(wallets, mnemonics), secret=True)
+    save_group(group_id)
 
     return {
         "message": f"Initialized group {group_id}",
@@ -60,15 +142,39 @@ def create_tx(group_id: str, proposer: str, destination: str, amount: int):
     if proposer not in group["usernames"]:
         return {"error": "Proposer not in group"}
 
-    call = substrate.compose_call(
-        call_module="Balances",
-        call_function="transfer_allow_death",
-        call_params={"dest": destination, "value": amount},
-    )
+    pending_tx = group["pending_tx"]
+    calls = pending_tx["calls"] if pending_tx else []
+    with chain_pool(group["chain"]).connection() as substrate:
+        call = substrate.compose_call(
+            call_module="Balances",
+            call_function="transfer_allow_death",
+            call_params={"dest": destination, "value": amount},
+        )
+        calls = calls + [call.value]
+        # Encode and hash the whole batch now rather than after the last vote
+        # The proposer submits the approval, so everyone else is the other side
+        call_data, call_hash, multisig_call = prepare_proposal(
+            substrate,
+            calls,
+            group["threshold"],
+            other_signatories(group, group["wallets"][proposer].ss58_address),
+        )
 
-    group["pending_tx"] = {"call": call, "signers": [proposer]}
+    # Proposals queue up and settle together in one batched multisig call.
+    # Adding one changes what is being approved, so signatures start over.
+    group["pending_tx"] = {
+        "calls": calls,
+        "call_data": call_data,
+        "call_hash": call_hash,
+        "multisig_call": multisig_call.data.to_hex(),
+        "proposer": proposer,
+        # One bit per member, by their index in the group
+        "signed": 1 << group["members"][proposer],
+    }
+    prepared_calls[group_id] = multisig_call
+    save_group(group_id)
 
-    return {"message": "Created transaction"}
+    return {"message": "Created transaction", "queued": len(calls)}
 
 
 def sign_tx(group_id: str, username: str):
@@ -76,75 +182,47 @@ def sign_tx(group_id: str, username: str):
     if not group:
         return {"error": "Group not found"}
 
-    if not group["pending_tx"]:
+    pending_tx = group["pending_tx"]
+    if not pending_tx:
         return {"error": "No pending transaction"}
 
-    if username not in group["usernames"]:
+    index = group["members"].get(username)
+    if index is None:
         return {"error": "User not in group"}
 
-    if username in group["pending_tx"]["signers"]:
+    if pending_tx["signed"] >> index & 1:
         return {"error": "User already signed"}
 
-    wallet = group["wallets"].get(username)
-    if not wallet:
-        return {"error": "Wallet not found for user"}
-
-    group["pending_tx"]["signers"].append(username)
+    pending_tx["signed"] |= 1 << index
+    save_group(group_id)
 
-    return {"message": "Signed transaction"}
+    return {"message": "Signed transaction", "signed": pending_tx["signed"].bit_count()}
 
 
-def confirm_tx(group_id: str):
+def confirm_tx(group_id: str, on_done=None):
     group = groups.get(group_id)
     if not group:
         return {"error": "Group not found"}
 
-    if not group["pending_tx"]:
+    pending_tx = group["pending_tx"]
+    if not pending_tx:
         return {"error": "No pending transaction"}
 
-    signers = len(group["pending_tx"]["signers"])
-    if signers < group["threshold"]:
+    if pending_tx["signed"].bit_count() < group["threshold"]:
         return {"error": "Not enough signatures"}
 
-    other_signatories = [
-        wallet.ss58_address
-        for user, wallet in group["wallets"].items()
-        if user in group["pending_tx"]["signers"][1:]
-    ]
-
-    call = group["pending_tx"]["call"]
-
-    call_data = substrate.compose_call(
-        call_module=call.call_module,
-        call_function=call.call_function,
-        call_params=call.call_args,
-    ).data
-
-    call_hash = blake2b(call_data, digest_size=32).digest()
-
-    multi_sig_call = substrate.compose_call(
-        call_module="Multisig",
-        call_function="approve_as_multi",
-        call_params={
-            "threshold": group["threshold"],
-            "other_signatories": other_signatories,
-            "maybe_timepoint": None,
-            "call_hash": call_hash,
-            "store_call": True,
-            "max_weight": {
-                "proof_size": 0,
-                "ref_time": 1000000000,
-            },
-        },
-    )
-
-    wallet = group["wallets"][group["pending_tx"]["signers"][0]]
-    extrinsic = substrate.create_signed_extrinsic(call=multi_sig_call, keypair=wallet)
-    receipt = substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True)
+    wallet = group["wallets"][pending_tx["proposer"]]
+    pool = chain_pool(group["chain"])
+    with pool.connection() as substrate:
+        multisig_call = prepared_calls.pop(group_id, None) or decode_call(
+            substrate, pending_tx["multisig_call"]
+        )
+        tx_id = submit_signed(pool, substrate, multisig_call, wallet.keypair, on_done)
 
     group["pending_tx"] = None
+    save_group(group_id)
 
-    return {"message": "Confirmed transaction", "receipt": receipt}
+    return {"message": "Submitted transaction", "tx_id": tx_id}
 
 
 def get_multisig_balance(group_id: str):
@@ -153,30 +231,268 @@ def get_multisig_balance(group_id: str):
         return {"error": "Group not found"}
 
     multisig_address = group["multisig_address"]
-    balance_info = substrate.query("System", "Account", [multisig_address])
+    pool = chain_pool(group["chain"])
+    balance_data = get_balances(pool, [multisig_address])[multisig_address]
+
+    return {"balance": balance_data, "address": multisig_address}
+
+
+# Telegram bot handlers
+# Per-chat bot state keyed by chat_id, so one process can serve many groups
+def save_chat(chat_id):
+    state = chats[chat_id]
+    store.put(
+        "chats",
+        chat_id,
+        {
+            "group_initialized": state["group_initialized"],
+            "user_ids": state["user_ids"],
+            "active": state["active"],
+            "members": sorted(state["members"]),
+            "chain": state["chain"],
+            "threshold": state["threshold"],
+            "expires_at": state["expires_at"],
+            "last_update_id": state["last_update_id"],
+        },
+    )
 
-    data = balance_info["data"]
 
-    balance_data = {
-        "free": int(data["free"].value),
-        "reserved": int(data["reserved"].value),
-        "frozen": int(data["frozen"].value),
-        "flags": int(data["flags"].value),
+def chat_from_record(record):
+    return {
+        "chain": DEFAULT_CHAIN,
+        "threshold": None,
+        "expires_at": None,
+        "last_update_id": 0,
+        **record,
+        "lock": asyncio.Lock(),
+        "members": set(record["members"]),
     }
 
-    return {"balance": balance_data, "address": multisig_address}
 
+def load_chats():
+    return {
+        chat_id: chat_from_record(record)
+        for chat_id, record in store.load("chats").items()
+    }
 
-# Telegram bot handlers
-process_state = {"active": False, "members": set()}
-user_ids = []
-bot_state = {"group_initialized": False}
 
+chats = {} if LAZY_STATE else load_chats()
 
-@bot.message_handler(commands=["start", "hello"])
-def send_welcome(message):
+# Open proposals and registration rounds expire, so abandoned ones don't hold
+# state forever. Each chat has at most one deadline, kept in its record as a
+# wall-clock time so it survives restarts, and one timer wheel drives them all.
+PROPOSAL_TTL = int(os.getenv("BOT_PROPOSAL_TTL", str(24 * 3600)))
+REGISTRATION_TTL = int(os.getenv("BOT_REGISTRATION_TTL", str(24 * 3600)))
+deadlines = TimerWheel()
+
+
+def set_deadline(chat_id, ttl):
+    state = chats[chat_id]
+    state["expires_at"] = None if ttl is None else time.time() + ttl
+    schedule_deadline(chat_id)
+
+
+def schedule_deadline(chat_id):
+    expires_at = chats[chat_id]["expires_at"]
+    if expires_at is None:
+        deadlines.cancel(chat_id)
+    else:
+        deadlines.schedule(chat_id, expires_at - time.time(), expire_chat)
+
+
+async def expire_chat(chat_id):
+    state = chats.get(chat_id)
+    if state is None and LAZY_STATE:
+        state = load_chat(chat_id)
+    if state is None:
+        return
+
+    async with state["lock"]:
+        # The deadline may have been cleared or moved while this waited, and
+        # one that isn't due yet is put back on the wheel
+        if state["expires_at"] is None:
+            return
+        if state["expires_at"] > time.time():
+            schedule_deadline(chat_id)
+            return
+
+        state["expires_at"] = None
+        schedule_deadline(chat_id)
+        if state["group_initialized"]:
+            if state["active"]:
+                clear_proposal(chat_id)
+                outbox.send(
+                    chat_id, "The pending transaction expired and was cancelled."
+                )
+        else:
+            state["user_ids"] = []
+            outbox.end_status(("registration", chat_id))
+            outbox.send(
+                chat_id,
+                "Registration expired before every member registered. "
+                "Send /hi to start again.",
+            )
+        save_chat(chat_id)
+
+
+def clear_proposal(chat_id):
+    state = chats[chat_id]
+    state["active"] = False
+    state["members"] = set()
+    groups[chat_id]["pending_tx"] = None
+    prepared_calls.pop(chat_id, None)
+    save_group(chat_id)
+    outbox.end_status(("tally", chat_id))
+
+
+def start_deadlines():
+    for chat_id in chats:
+        schedule_deadline(chat_id)
+    deadlines.start()
+
+
+def load_chat(chat_id):
+    record = store.get("chats", chat_id)
+    if record is None:
+        return None
+
+    group = store.get("groups", chat_id)
+    if group:
+        wallets = store.get("wallets", chat_id, secret=True)
+        groups[chat_id] = group_from_record(group, wallets)
+        watch_group(chat_id, asyncio.get_running_loop())
+    state = chats[chat_id] = chat_from_record(record)
+    schedule_deadline(chat_id)
+    return state
+
+
+def resume_chats(owns, loop):
+    # Lazily loaded processes only load a chat when an update arrives for it,
+    # so the deadlines and multisig watches of the chats they own are picked
+    # up from the store up front
+    for chat_id, record in store.load("chats").items():
+        if owns(chat_id) and chat_id not in chats and record.get("expires_at"):
+            deadlines.schedule(chat_id, record["expires_at"] - time.time(), expire_chat)
+    for chat_id, record in store.load("groups").items():
+        if owns(chat_id) and chat_id not in watched:
+            record.setdefault("chain", DEFAULT_CHAIN)
+            watch_group(chat_id, loop, record)
+
+
+def held_chats():
+    # Every chat this process has state, a deadline, a watch or queued
+    # updates for
+    return set(chats) | set(watched) | set(deadlines.timers) | set(inbox.queues)
+
+
+def drop_chat(chat_id):
+    # Forgets a chat this process no longer owns; whoever takes it over
+    # reloads it from the store
+    unwatch_group(chat_id)
+    groups.pop(chat_id, None)
+    chats.pop(chat_id, None)
+    deadlines.cancel(chat_id)
+    prepared_calls.pop(chat_id, None)
+    member_counts.pop(chat_id, None)
+
+
+def get_chat_state(chat_id):
+    state = chats.get(chat_id)
+    if state is None and LAZY_STATE:
+        state = load_chat(chat_id)
+    if state is None:
+        state = chats[chat_id] = {
+            "lock": asyncio.Lock(),
+            "group_initialized": False,
+            "user_ids": [],
+            "active": False,
+            "members": set(),
+            "chain": DEFAULT_CHAIN,
+            # Approvals needed to settle; None means every registered member
+            "threshold": None,
+            # When the open proposal or registration round expires
+            "expires_at": None,
+            # The newest update applied to this chat, saved with its state
+            "last_update_id": 0,
+        }
+    return state
+
+
+# Member counts are cached per chat and kept current from chat_member updates,
+# so threshold checks don't need a Telegram round trip on every vote.
+MEMBER_COUNT_TTL = 300
+member_counts = {}
+member_count_stats = {"hits": 0, "misses": 0}
+
+
+async def get_member_count(chat_id):
+    cached = member_counts.get(chat_id)
+    if cached and cached[1] > time.monotonic():
+        member_count_stats["hits"] += 1
+        return cached[0]
+
+    member_count_stats["misses"] += 1
+    count = await bot.get_chat_member_count(chat_id)
+    member_counts[chat_id] = (count, time.monotonic() + MEMBER_COUNT_TTL)
+    return count
+
+
+def is_chat_member(chat_member):
+    if chat_member.status == "restricted":
+        return chat_member.is_member
+    return chat_member.status in ("creator", "administrator", "member")
+
+
+# Updates from different chats are handled concurrently, but updates within a
+# chat are serialized so votes and registrations apply in the order received.
+def in_chat_order(handler):
+    @wraps(handler)
+    async def wrapper(message):
+        async with get_chat_state(message.chat.id)["lock"]:
+            await handler(message)
+
+    return wrapper
+
+
+# Commands are looked up by name in a dict, and one message handler
+# dispatches them. Messages that aren't commands are dropped before any
+# handler, lock or network call runs.
+commands = {}
+
+
+def command(*names):
+    def register(handler):
+        @wraps(handler)
+        async def timed(message):
+            with HANDLER_SECONDS.time(names[0]):
+                await handler(message)
+
+        dispatched = in_chat_order(timed)
+        for name in names:
+            commands[name] = dispatched
+        return dispatched
+
+    return register
+
+
+def command_name(text):
+    # "/yes@SomeBot extra words" -> "yes"
+    if not text or text[0] != "/":
+        return None
+    return text.split(maxsplit=1)[0][1:].split("@", 1)[0]
+
+
+def wanted_update(update):
+    # Checks a raw update before it is parsed, so webhook chatter costs one
+    # dict lookup; everything other than plain messages is kept
+    message = update.get("message")
+    return message is None or command_name(message.get("text")) in commands
+
+
+@command("start", "hello")
+async def send_welcome(message):
     if message.chat.type == "group":
-        bot.send_message(
+        outbox.send(
             message.chat.id,
             "Welcome to the MultiSig Wallet Bot! Here's how to use me:\n\n"
             "/hi - Register yourself with the bot\n"
@@ -184,214 +500,618 @@ def send_welcome(message):
             "/yes - Approve a pending transaction\n"
             "/no - Reject a pending transaction\n"
             "/balance - Check the multisig wallet balance and address\n"
+            "/threshold <n> - Set how many approvals settle a transaction\n"
             "/privatekey - Retrieve your private key (sent via DM)\n"
-            "/switch_chain <rpc_url> <preset> - Switch to a different parachain",
+            "/switch_chain <rpc_url> <preset> [ss58_format] - Switch to a different "
+            "parachain",
         )
 
 
-@bot.message_handler(commands=["hi"])
-def register_user(message):
+@command("hi")
+async def register_user(message):
     chat_id = message.chat.id
     user_id = str(message.from_user.id)
     username = message.from_user.username
+    state = get_chat_state(chat_id)
 
-    if bot_state["group_initialized"]:
-        bot.send_message(
+    if state["group_initialized"]:
+        outbox.send(
             chat_id, "The group is already initialized. No new registrations allowed."
         )
         return
 
-    if username in user_ids:
-        bot.send_message(chat_id, f"@{username} is already registered.")
+    if user_id in state["user_ids"]:
+        # Falls through so a complete registration that failed to initialize
+        # is retried
+        outbox.send(chat_id, f"@{username} is already registered.")
+    elif len(state["user_ids"]) >= MAX_SIGNATORIES:
+        outbox.send(
+            chat_id, f"A group can have at most {MAX_SIGNATORIES} registered members."
+        )
         return
+    else:
+        state["user_ids"].append(user_id)
+        if len(state["user_ids"]) == 1:
+            set_deadline(chat_id, REGISTRATION_TTL)
+        save_chat(chat_id)
+        outbox.send(chat_id, f"Hello, @{username}! You are now registered.")
+
+    chat_member_count = await get_registrable_count(chat_id)
+    if len(state["user_ids"]) >= chat_member_count:
+        await finish_registration(chat_id, chat_member_count)
+    else:
+        remaining = chat_member_count - len(state["user_ids"])
+        outbox.status(
+            chat_id,
+            ("registration", chat_id),
+            f"Waiting for {remaining} more members to register.",
+        )
+
+
+async def get_registrable_count(chat_id):
+    # Everyone in the chat but the bot, up to what the Multisig pallet allows
+    return min(await get_member_count(chat_id) - 1, MAX_SIGNATORIES)
 
-    user_ids.append(user_id)
-    bot.send_message(chat_id, f"Hello, @{username}! You are now registered.")
-
-    # Get chat members count
-    chat_member_count = bot.get_chat_member_count(chat_id) - 1
-    if len(user_ids) == chat_member_count:
-        response = init_group(chat_id, user_ids, chat_member_count)
-        print(user_ids)
-        bot_state["group_initialized"] = True
-        bot.send_message(
-            chat_id, "Group initialized! You may begin creating transactions."
+
+async def finish_registration(chat_id, chat_member_count):
+    # Registrations are kept if this fails, so a corrected /threshold or
+    # another /hi retries it without everyone registering again
+    state = chats[chat_id]
+    try:
+        response = await run_chain(
+            init_group,
+            chat_id,
+            state["user_ids"],
+            state["threshold"] or chat_member_count,
+            state["chain"],
+            timeout=None,
         )
-    else:
-        bot.send_message(
+    except Exception as e:
+        response = {"error": str(e) or type(e).__name__}
+    if "error" in response:
+        outbox.send(
             chat_id,
-            f"Waiting for {chat_member_count - len(user_ids)} more members to register.",
+            f"Could not initialize the group: {response['error']}. "
+            "Fix it with /threshold, or send /hi to try again.",
         )
+        return
+    watch_group(chat_id, asyncio.get_running_loop())
+    state["group_initialized"] = True
+    set_deadline(chat_id, None)
+    save_chat(chat_id)
+    outbox.end_status(("registration", chat_id))
+    outbox.send(chat_id, "Group initialized! You may begin creating transactions.")
 
 
-@bot.message_handler(commands=["create"])
-def create_tx_handler(message):
+@command("create")
+async def create_tx_handler(message):
     chat_id = message.chat.id
     user_id = str(message.from_user.id)
+    state = get_chat_state(chat_id)
     text = message.text.split()
-    if len(text) < 2:
-        bot.reply_to(message, "Usage: /create_tx <destination> <amount>")
+    if len(text) < 3:
+        outbox.reply(message, "Usage: /create_tx <destination> <amount>")
         return
 
-    if not bot_state["group_initialized"]:
-        bot.reply_to(
+    if not state["group_initialized"]:
+        outbox.reply(
             message, "Group not initialized. Please register all members first."
         )
         return
 
-    if process_state["active"]:
-        bot.reply_to(
-            message, "There is an active process. Please wait for it to finish."
+    destination = text[1]
+    try:
+        amount = int(text[2])
+    except ValueError:
+        outbox.reply(message, "Usage: /create_tx <destination> <amount>")
+        return
+
+    # Calls that change a group run to completion; only reads time out
+    try:
+        response = await run_chain(
+            create_tx, chat_id, user_id, destination, amount, timeout=None
         )
+    except Exception as e:
+        # e.g. an RPC error or a destination that isn't a valid address
+        response = {
+            "error": f"Could not create the transaction: {str(e) or type(e).__name__}"
+        }
+    if "error" in response:
+        outbox.reply(message, response["error"])
         return
 
-    destination = text[1]
-    amount = int(text[2])
+    # New proposals join the pending batch, and everyone votes on it again
+    state["active"] = True
+    state["members"] = set([user_id])
+    set_deadline(chat_id, PROPOSAL_TTL)
+    save_chat(chat_id)
+    outbox.end_status(("tally", chat_id))
+    if response["queued"] > 1:
+        outbox.reply(
+            message,
+            f"Transaction added to the batch ({response['queued']} pending). "
+            "Votes have been reset, please sign the whole batch with /yes or /no.",
+        )
+    else:
+        outbox.reply(
+            message,
+            "Transaction created. Waiting for members to sign with /yes or /no.",
+        )
 
-    print(user_id)
 
-    process_state["active"] = True
-    process_state["members"] = set([user_id])
-    response = create_tx(chat_id, user_id, destination, amount)
-    print(response)
-    bot.reply_to(
-        message,
-        "Transaction created. Waiting for all members to sign with /yes or /no.",
-    )
+def post_receipt(chat_id, loop):
+    # Called from the tracker thread once the transaction settles
+    def on_done(record):
+        if record["status"] == "dropped":
+            text = (
+                f"Transaction {record['extrinsic_hash']} was dropped before inclusion."
+            )
+        elif record["success"]:
+            text = f"Transaction finalized in block #{record['block_number']} ({record['block_hash']})."
+        else:
+            text = f"Transaction failed in block #{record['block_number']}: {record['error']}"
+        loop.call_soon_threadsafe(outbox.send, chat_id, text)
+
+    return on_done
+
+
+def describe_event(event):
+    attributes = event["attributes"]
+    call_hash = attributes.get("call_hash")
+    if event["module_id"] == "Balances":
+        text = f"Received {attributes['amount']} from {attributes['from']}."
+    elif event["event_id"] == "NewMultisig":
+        text = f"{attributes['approving']} started a multisig approval for {call_hash}."
+    elif event["event_id"] == "MultisigApproval":
+        text = f"{attributes['approving']} approved multisig call {call_hash}."
+    elif event["event_id"] == "MultisigExecuted":
+        result = attributes.get("result")
+        if isinstance(result, dict) and "Ok" in result:
+            text = f"Multisig call {call_hash} executed."
+        else:
+            text = f"Multisig call {call_hash} failed: {result}"
+    elif event["event_id"] == "MultisigCancelled":
+        text = f"{attributes['cancelling']} cancelled multisig call {call_hash}."
+    else:
+        text = f"Multisig event {event['event_id']}."
+    return f"Block #{event['block_number']}: {text}"
+
+
+# The chain and multisig address watched for each chat, which may be a group
+# that was never loaded
+watched = {}
+
+
+def watch_group(chat_id, loop, group=None):
+    # Deposits and multisig activity are pushed to the chat as they happen,
+    # from the chain's event watcher thread
+    group = group or groups[chat_id]
+
+    def notify(event):
+        loop.call_soon_threadsafe(outbox.send, chat_id, describe_event(event))
+
+    chain_pool(group["chain"]).events.watch(group["multisig_address"], chat_id, notify)
+    watched[chat_id] = (group["chain"], group["multisig_address"])
+
+
+def unwatch_group(chat_id):
+    if chat_id in watched:
+        chain, multisig_address = watched.pop(chat_id)
+        chain_pool(chain).events.unwatch(multisig_address, chat_id)
 
 
-@bot.message_handler(commands=["yes"])
-def confirm_yes(message):
+def watch_groups(loop):
+    for chat_id in groups:
+        watch_group(chat_id, loop)
+
+
+@command("yes")
+async def confirm_yes(message):
     chat_id = message.chat.id
     user_id = str(message.from_user.id)
+    state = get_chat_state(chat_id)
 
-    if not bot_state["group_initialized"]:
-        bot.reply_to(
+    if not state["group_initialized"]:
+        outbox.reply(
             message, "Group not initialized. Please register all members first."
         )
         return
 
-    if process_state["active"]:
-        if user_id in process_state["members"]:
-            bot.reply_to(message, "You have already responded.")
+    if state["active"]:
+        if user_id in state["members"]:
+            outbox.reply(message, "You have already responded.")
             return
 
-        process_state["members"].add(user_id)
-        chat_members = bot.get_chat_members_count(chat_id)
         signed_data = sign_tx(chat_id, user_id)
+        if "error" in signed_data:
+            outbox.reply(message, signed_data["error"])
+            return
 
-        print(signed_data)
+        state["members"].add(user_id)
+        save_chat(chat_id)
+        threshold = groups[chat_id]["threshold"]
 
-        if len(process_state["members"]) >= chat_members - 1:
-            process_state["active"] = False
-            process_state["members"] = set()
-            bot.send_message(
+        if signed_data["signed"] >= threshold:
+            calls = groups[chat_id]["pending_tx"]["calls"]
+            state["active"] = False
+            state["members"] = set()
+            set_deadline(chat_id, None)
+            outbox.end_status(("tally", chat_id))
+            try:
+                on_done = post_receipt(chat_id, asyncio.get_running_loop())
+                response = await run_chain(confirm_tx, chat_id, on_done, timeout=None)
+            except Exception as e:
+                response = {"error": str(e) or type(e).__name__}
+            if "error" in response:
+                # Nothing reached the chain; the batch is cancelled rather
+                # than left for the next /create to quietly add to
+                clear_proposal(chat_id)
+                save_chat(chat_id)
+                outbox.send(
+                    chat_id,
+                    "Threshold has been reached, but the transaction could not be "
+                    f"submitted: {response['error']}. It was cancelled; propose it "
+                    "again with /create.",
+                )
+                return
+            save_chat(chat_id)
+            outbox.send(
                 chat_id,
-                f"Threshold has been reached and the transaction has been confirmed. 🎉🎉🎉\nTransaction Data: {groups[chat_id]['pending_tx']}",
+                f"Threshold has been reached and the transaction has been confirmed. 🎉🎉🎉\nTransaction Data: {calls}",
             )
-            try:
-                confirm_data = confirm_tx(chat_id)
-            except:
-                pass
         else:
-            remaining = chat_members - 1 - len(process_state["members"])
-            bot.send_message(
-                chat_id, f"Waiting for {remaining} more members to respond."
+            remaining = threshold - signed_data["signed"]
+            outbox.status(
+                chat_id,
+                ("tally", chat_id),
+                f"Waiting for {remaining} more members to respond.",
+                pin=True,
             )
     else:
-        bot.reply_to(message, "No active process. Please start with /create.")
+        outbox.reply(message, "No active process. Please start with /create.")
 
 
-@bot.message_handler(commands=["no"])
-def confirm_no(message):
+@command("no")
+async def confirm_no(message):
     chat_id = message.chat.id
     user_id = str(message.from_user.id)
+    state = get_chat_state(chat_id)
 
-    if not bot_state["group_initialized"]:
-        bot.reply_to(
+    if not state["group_initialized"]:
+        outbox.reply(
             message, "Group not initialized. Please register all members first."
         )
         return
 
-    if process_state["active"]:
-        if user_id in process_state["members"]:
-            bot.reply_to(message, "You have already responded.")
+    if state["active"]:
+        if user_id in state["members"]:
+            outbox.reply(message, "You have already responded.")
             return
-        process_state["active"] = False
-        process_state["members"] = set()
-        bot.send_message(chat_id, "Process terminated due to a /no response.")
+        clear_proposal(chat_id)
+        set_deadline(chat_id, None)
+        save_chat(chat_id)
+        outbox.send(chat_id, "Process terminated due to a /no response.")
     else:
-        bot.reply_to(message, "No active process. Please start with /startprocess.")
+        outbox.reply(message, "No active process. Please start with /startprocess.")
 
 
-@bot.message_handler(commands=["balance"])
-def get_balance_handler(message):
+@command("balance")
+async def get_balance_handler(message):
     chat_id = message.chat.id
+    state = get_chat_state(chat_id)
 
-    if not bot_state["group_initialized"]:
-        bot.reply_to(
+    if not state["group_initialized"]:
+        outbox.reply(
             message, "Group not initialized. Please register all members first."
         )
         return
 
-    response = get_multisig_balance(chat_id)
-    bot.reply_to(message, response)
+    try:
+        response = await run_chain(get_multisig_balance, chat_id)
+    except asyncio.TimeoutError:
+        response = "The chain did not answer in time, please try again."
+    outbox.reply(message, response)
+
+
+def check_chain(chain):
+    with chain_pool(chain).connection():
+        pass
+
+
+def readdress_group(group, ss58_format):
+    # Addresses are the same keys encoded for the new chain
+    group["wallets"] = {
+        username: Wallet(wallet.seed, wallet.public_key, ss58_format)
+        for username, wallet in group["wallets"].items()
+    }
+    group["multisig_address"] = ss58_encode(
+        ss58_decode(group["multisig_address"]), ss58_format
+    )
+    index_group(group)
+
 
+@command("threshold")
+async def set_threshold(message):
+    chat_id = message.chat.id
+    state = get_chat_state(chat_id)
+    text = message.text.split()
+    if len(text) < 2 or not text[1].isdigit():
+        outbox.reply(message, "Usage: /threshold <number of approvals>")
+        return
 
-@bot.message_handler(commands=["switch_chain"])
-def switch_chain(message):
-    if len(message.text.split()) < 3:
-        bot.reply_to(
+    # The threshold is part of the multisig address, so it is fixed at setup
+    if state["group_initialized"]:
+        outbox.reply(
+            message, "The group is already initialized; its threshold can't change."
+        )
+        return
+
+    # A threshold above the member count would make the multisig unusable
+    chat_member_count = await get_registrable_count(chat_id)
+    threshold = int(text[1])
+    if chat_member_count < MIN_THRESHOLD:
+        outbox.reply(message, f"A multisig needs at least {MIN_THRESHOLD} members.")
+        return
+    if not MIN_THRESHOLD <= threshold <= chat_member_count:
+        outbox.reply(
             message,
-            "Please provide the RPC URL and preset of the parachain you want to switch to.",
+            f"Threshold must be between {MIN_THRESHOLD} and {chat_member_count}, "
+            "the number of members.",
         )
         return
 
-    rpc_url = message.text.split()[1]
-    preset = message.text.split()[2]
-    try:
-        global substrate
-        print(rpc_url, preset)
-        substrate = SubstrateInterface(
-            url=rpc_url, ss58_format=42, type_registry_preset=preset
+    state["threshold"] = threshold
+    save_chat(chat_id)
+    outbox.reply(message, f"Transactions will need {threshold} approvals.")
+
+    # Everyone registered already but setup failed, so try it again now
+    if state["user_ids"] and len(state["user_ids"]) >= chat_member_count:
+        await finish_registration(chat_id, chat_member_count)
+
+
+@command("switch_chain")
+async def switch_chain(message):
+    chat_id = message.chat.id
+    state = get_chat_state(chat_id)
+    text = message.text.split()
+    if len(text) < 3 or len(text) > 3 and not text[3].isdigit():
+        outbox.reply(
+            message,
+            "Please provide the RPC URL and preset of the parachain you want to "
+            "switch to, and optionally its SS58 address format.",
         )
-        bot.reply_to(
+        return
+
+    group = groups.get(chat_id)
+    if group and group["pending_tx"]:
+        outbox.reply(
             message,
-            f"Switched to the parachain with RPC: {rpc_url} and preset: {preset}",
+            "A transaction is pending on the current chain. Finish it or /no it first.",
         )
+        return
+
+    rpc_url, preset = text[1], text[2]
+    try:
+        # Without an explicit format, the one the chain advertises is used
+        if len(text) > 3:
+            ss58_format = int(text[3])
+        else:
+            ss58_format = await run_chain(chain_ss58_format, rpc_url, preset)
+        chain = {
+            "url": rpc_url,
+            "ss58_format": ss58_format,
+            "type_registry_preset": preset,
+        }
+        # Check out a connection once so a bad RPC URL is reported right away
+        await run_chain(check_chain, chain)
     except Exception as e:
-        bot.reply_to(message, f"Error switching to the parachain: {str(e)}")
+        outbox.reply(message, f"Error switching to the parachain: {str(e)}")
+        return
 
+    # Only this chat moves; other groups keep their own chains
+    state["chain"] = chain
+    save_chat(chat_id)
+    if group:
+        unwatch_group(chat_id)
+        if ss58_format != group["chain"]["ss58_format"]:
+            readdress_group(group, ss58_format)
+        group["chain"] = chain
+        save_group(chat_id)
+        watch_group(chat_id, asyncio.get_running_loop())
+    outbox.reply(
+        message,
+        f"Switched to the parachain with RPC: {rpc_url}, preset: {preset} "
+        f"and SS58 format: {ss58_format}",
+    )
 
-@bot.message_handler(commands=["privatekey"])
-def get_private_key(message):
-    if not bot_state["group_initialized"]:
-        bot.reply_to(
-            message, "Group not initialized. Please register all members first."
-        )
-        return
 
+@command("privatekey")
+async def get_private_key(message):
     chat_id = message.chat.id
     user_id = str(message.from_user.id)
+    state = get_chat_state(chat_id)
+
+    if not state["group_initialized"]:
+        outbox.reply(
+            message, "Group not initialized. Please register all members first."
+        )
+        return
 
     wallet = groups[chat_id]["wallets"].get(user_id)
     if not wallet:
-        bot.reply_to(message, "You are not registered in this group.")
+        outbox.reply(message, "You are not registered in this group.")
         return
 
-    private_key = wallet.mnemonic
-    bot.reply_to(
+    # Mnemonics are only kept in the encrypted store, not in memory
+    private_key = store.get("wallets", chat_id, secret=True)[user_id]["mnemonic"]
+    outbox.reply(
         message,
         f"Your private key is: ||{private_key}||\n\nPlease keep it safe and do not share it with anyone\!",
         parse_mode="MarkdownV2",
     )
 
 
-@bot.message_handler(func=lambda msg: True)
-def echo_all(message):
-    bot.reply_to(message, message.text)
+@bot.chat_member_handler()
+@bot.my_chat_member_handler()
+async def track_member_count(update):
+    cached = member_counts.get(update.chat.id)
+    if not cached:
+        return
+
+    was_member = is_chat_member(update.old_chat_member)
+    now_member = is_chat_member(update.new_chat_member)
+    if was_member != now_member:
+        count = cached[0] + (1 if now_member else -1)
+        member_counts[update.chat.id] = (count, cached[1])
+
+
+@bot.message_handler(func=lambda message: command_name(message.text) in commands)
+async def dispatch(message):
+    await commands[command_name(message.text)](message)
+
+
+# Long polling. Updates are queued per chat and applied in the background,
+# in order within a chat, and the next getUpdates is only sent once the
+# queued batch is committed to the store, so a crash loses nothing. Every
+# chat record carries the last update_id applied to it, which makes updates
+# delivered again after a crash no-ops.
+POLL_TIMEOUT = 30
+POLL_LIMIT = 100
+POLL_RETRY = 3
+# Prometheus metrics are served on this port when it is set
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+
+def update_chat_id(update):
+    for kind in ALLOWED_UPDATES:
+        if kind in update:
+            return update[kind]["chat"]["id"]
+
+
+async def apply_update(chat_id, data):
+    state = get_chat_state(chat_id)
+    if data["update_id"] <= state["last_update_id"]:
+        return
+    # Everything the update writes, including groups saved from the chain
+    # executor, is committed along with the chat's new last_update_id, so
+    # a crash can't keep an update's effects and still replay it
+    with store.batch():
+        state["last_update_id"] = data["update_id"]
+        await bot.process_new_updates([Update.de_json(data)])
+        save_chat(chat_id)
+
+
+inbox = Inbox(store, apply_update)
+
+
+async def queue_updates(updates):
+    # Chatter is dropped here, before it is parsed into objects
+    for data in updates:
+        if wanted_update(data):
+            inbox.put(update_chat_id(data), data)
+
+
+def queue_stored_updates(owns=lambda chat_id: True):
+    # Shard workers share the store, so each only picks up its own chats
+    for data in inbox.stored():
+        chat_id = update_chat_id(data)
+        if owns(chat_id):
+            inbox.put(chat_id, data, stored=True)
+
+
+polling_stats = {"requests": 0, "failures": 0, "rate_limited": 0}
+
+
+async def poll(handle=queue_updates):
+    offset = store.load("polling").get("offset")
+    while True:
+        await inbox.wait_for_room()
+        polling_stats["requests"] += 1
+        try:
+            updates = await asyncio_helper.get_updates(
+                BOT_TOKEN,
+                offset=offset,
+                limit=POLL_LIMIT,
+                timeout=POLL_TIMEOUT,
+                allowed_updates=ALLOWED_UPDATES,
+                request_timeout=POLL_TIMEOUT + 10,
+            )
+        except Exception as e:
+            polling_stats["failures"] += 1
+            if (
+                isinstance(e, asyncio_helper.ApiTelegramException)
+                and e.error_code == 429
+            ):
+                polling_stats["rate_limited"] += 1
+            print(f"Polling failed, retrying: {e}")
+            await asyncio.sleep(POLL_RETRY)
+            continue
+        if not updates:
+            continue
+
+        await handle(updates)
+        offset = inbox.offset = updates[-1]["update_id"] + 1
+        store.put("polling", "offset", inbox.first_outstanding())
+        # The next getUpdates confirms this batch, so commit it first
+        await asyncio.get_running_loop().run_in_executor(None, store.commit)
+
+
+@collector
+def bot_metrics():
+    # Telegram calls are counted where they are made rather than wrapped
+    requests = {
+        "sendMessage": outbox.stats["sent"],
+        "editMessageText": outbox.stats["edited"],
+        "pinChatMessage": outbox.stats["pins"],
+        "unpinChatMessage": outbox.stats["unpins"],
+        "getChatMemberCount": member_count_stats["misses"],
+        "getUpdates": polling_stats["requests"],
+    }
+    return {
+        **{
+            f'telegram_requests_total{{method="{method}"}}': count
+            for method, count in requests.items()
+        },
+        "telegram_rate_limited_total": outbox.stats["rate_limited"]
+        + polling_stats["rate_limited"],
+        "telegram_poll_failures_total": polling_stats["failures"],
+        **{
+            f'bot_outbox_{stat}{"" if stat == "depth" else "_total"}': value
+            for stat, value in outbox.stats.items()
+            if stat not in ("sent", "edited", "pins", "unpins", "rate_limited")
+        },
+        "bot_member_count_cache_hits_total": member_count_stats["hits"],
+        "bot_loaded_chats": len(chats),
+        "bot_inbox_depth": len(inbox),
+        **{f"bot_inbox_{stat}_total": count for stat, count in inbox.stats.items()},
+        "bot_deadlines": len(deadlines),
+        "bot_pending_proposals": sum(
+            1 for group in groups.values() if group["pending_tx"]
+        ),
+    }
+
+
+async def serve_metrics(port):
+    app = web.Application()
+    app.router.add_get(
+        "/metrics",
+        lambda request: web.Response(text=render(), content_type="text/plain"),
+    )
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, port=port).start()
+
+
+async def main():
+    if METRICS_PORT:
+        await serve_metrics(METRICS_PORT)
+    start_deadlines()
+    watch_groups(asyncio.get_running_loop())
+    queue_stored_updates()
+    await poll()
 
 
 if __name__ == "__main__":
-    bot.infinity_polling()
+    key_pool.start()
     print("Bot is running...\nYou can now interact with it on Telegram")
+    asyncio.run(main())
@@ -0,0 +1,17 @@
+# The wallet API app as the benchmarks run it, with the bot's Telegram rate
+# limits lifted the same way bench.bot does for webhook mode
+import os
+
+import bench.bot  # noqa: F401
+import wallet.main
+from wallet.main import app  # noqa: F401
+
+
+async def run_inline(func, *args, timeout=None):
+    # Chain work on the event loop itself, as the routes did before run_chain
+    return func(*args)
+
+
+# The "before" case of bench.wallet_api
+if os.getenv("BENCH_INLINE_CHAIN") == "1":
+    wallet.main.run_chain = run_inline
@@ -0,0 +1,138 @@
+"""Startup backlog drain benchmark.
+
+Queues a backlog of updates on the fake Telegram server before the bot
+starts, as after downtime, then starts the bot and times how long it takes
+to confirm every update and send or drop every reply:
+
+    python -m bench.backlog --updates 50000 --chats 1 100 1000
+
+Each chat's updates are applied in order, but chats drain in parallel, so
+the same backlog clears faster when it is spread over more chats. Every
+command must be answered exactly once; more or fewer replies is a failure.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from bench.fake_telegram import FakeTelegram
+from bench.harness import (
+    STARTUP_TIMEOUT,
+    bench_env,
+    bot_drained,
+    bot_replies,
+    free_port,
+    print_table,
+    start_process,
+    stop_processes,
+)
+
+CHATTER = ["gm", "did everyone see the proposal?", "what's the balance now"]
+
+
+async def run_case(chats, args):
+    state_dir = tempfile.mkdtemp(prefix="tg-multisig-backlog-")
+    telegram = FakeTelegram(member_count=4)
+    telegram_port, metrics_port = free_port(), free_port()
+    server = await telegram.start(telegram_port)
+    commands = 0
+    for number in range(args.updates):
+        chat_id = -5_000_000 - random.randrange(chats)
+        if random.random() < args.chatter:
+            telegram.push(chat_id, number % 50 + 1, random.choice(CHATTER))
+        else:
+            telegram.push(chat_id, number % 50 + 1, "/start")
+            commands += 1
+
+    log = os.path.join(state_dir, "bot.log")
+    env = bench_env(
+        state_dir, telegram_port=telegram_port, METRICS_PORT=str(metrics_port)
+    )
+    bot = await start_process(["-m", "bench.bot"], env, log)
+    session = aiohttp.ClientSession(base_url=f"http://127.0.0.1:{metrics_port}")
+    try:
+        # Timed from the bot's first getUpdates, leaving out its imports
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while not telegram.requests["getUpdates"]:
+            if bot.returncode is not None or time.monotonic() > deadline:
+                raise RuntimeError(f"The bot did not start, see {log}")
+            await asyncio.sleep(0.001)
+        start = time.perf_counter()
+        await bot_drained(telegram, session, commands)
+        elapsed = time.perf_counter() - start
+        # Anything delivered twice would show up shortly after
+        await asyncio.sleep(0.5)
+        sent, dropped = await bot_replies(telegram, session)
+    except RuntimeError as e:
+        raise RuntimeError(f"{chats} chats: {e}, see {log}") from e
+    finally:
+        await session.close()
+        await stop_processes([bot])
+        await server.cleanup()
+    return {
+        "updates": args.updates,
+        "commands": commands,
+        "sent": sent,
+        "dropped": int(dropped),
+        "seconds": elapsed,
+        "updates_per_s": args.updates / elapsed,
+    }
+
+
+async def bench(args):
+    cases = {}
+    for chats in args.chats:
+        cases[f"{chats} chats"] = await run_case(chats, args)
+    return {"config": vars(args), "cases": cases}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--updates", type=int, default=50000, help="updates in the backlog"
+    )
+    parser.add_argument(
+        "--chats",
+        type=int,
+        nargs="+",
+        default=[1, 100, 1000],
+        help="chats the backlog is spread over, one case each",
+    )
+    parser.add_argument(
+        "--chatter",
+        type=float,
+        default=0.0,
+        help="fraction of updates that are chatter",
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    try:
+        result = asyncio.run(bench(args))
+    except RuntimeError as e:
+        sys.exit(str(e))
+    print_table(
+        result["cases"],
+        ["updates", "commands", "sent", "dropped", "seconds", "updates_per_s"],
+    )
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(result, out, indent=2)
+    duplicated = [
+        label
+        for label, case in result["cases"].items()
+        if case["sent"] + case["dropped"] != case["commands"]
+    ]
+    if duplicated:
+        sys.exit(f"Replies do not match commands: {', '.join(duplicated)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Update throughput benchmark for chats that are mostly chatter.
+
+Runs the bot against the fake Telegram server and queues N updates spread
+over a number of chats, of which a given fraction is plain group chatter
+and the rest /start, which the bot answers. It measures how long the bot
+takes to confirm every update and answer every command:
+
+    python -m bench.chatter --updates 20000 --chatter 0 0.9 0.99
+
+Chatter is dropped before it is parsed, so the more of it there is, the
+more updates per second the bot gets through. Replies beyond the outbox's
+per-chat queue limit are dropped by design, and reported.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+import aiohttp
+
+from bench.fake_telegram import FakeTelegram
+from bench.harness import (
+    bench_env,
+    bot_drained,
+    bot_replies,
+    free_port,
+    print_table,
+    start_process,
+    stop_processes,
+    wait_until,
+)
+
+CHATTER = [
+    "gm",
+    "did everyone see the proposal?",
+    "I'll approve it tonight",
+    "what's the balance now",
+]
+
+
+async def run_case(telegram, session, chatter, args):
+    sent, dropped = await bot_replies(telegram, session)
+    commands = 0
+    start = time.perf_counter()
+    for number in range(args.updates):
+        chat_id = -4_000_000 - random.randrange(args.chats)
+        if random.random() < chatter:
+            telegram.push(chat_id, number % 50 + 1, random.choice(CHATTER))
+        else:
+            telegram.push(chat_id, number % 50 + 1, "/start")
+            commands += 1
+    await bot_drained(telegram, session, sent + dropped + commands)
+    elapsed = time.perf_counter() - start
+    return {
+        "updates": args.updates,
+        "commands": commands,
+        "dropped": int((await bot_replies(telegram, session))[1] - dropped),
+        "seconds": elapsed,
+        "updates_per_s": args.updates / elapsed,
+    }
+
+
+async def bench(args):
+    state_dir = tempfile.mkdtemp(prefix="tg-multisig-chatter-")
+    telegram = FakeTelegram(member_count=4)
+    telegram_port, metrics_port = free_port(), free_port()
+    server = await telegram.start(telegram_port)
+    log = os.path.join(state_dir, "bot.log")
+    env = bench_env(
+        state_dir, telegram_port=telegram_port, METRICS_PORT=str(metrics_port)
+    )
+    bot = await start_process(["-m", "bench.bot"], env, log)
+    session = aiohttp.ClientSession(base_url=f"http://127.0.0.1:{metrics_port}")
+    cases = {}
+    try:
+
+        async def polling():
+            return telegram.requests["getUpdates"] > 0
+
+        await wait_until(polling, "The bot", bot, log)
+        for chatter in args.chatter:
+            cases[f"{chatter:.0%} chatter"] = await run_case(
+                telegram, session, chatter, args
+            )
+    except RuntimeError as e:
+        raise RuntimeError(f"{e}, see {log}") from e
+    finally:
+        await session.close()
+        await stop_processes([bot])
+        await server.cleanup()
+    return {"config": vars(args), "cases": cases}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--updates", type=int, default=20000, help="updates per case")
+    parser.add_argument("--chats", type=int, default=100, help="chats posting")
+    parser.add_argument(
+        "--chatter",
+        type=float,
+        nargs="+",
+        default=[0.0, 0.9, 0.99],
+        help="fractions of updates that are chatter, one case each",
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(bench(args))
+    print_table(
+        result["cases"], ["updates", "commands", "dropped", "seconds", "updates_per_s"]
+    )
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(result, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Confirm latency microbenchmark: from the final /yes to the node.
+
+Times the work confirm_tx does once the last vote is in, until the signed
+extrinsic reaches the fake node's author_submitExtrinsic, in three ways:
+
+- recomposed: the transfer composed and hashed again and approve_as_multi
+  built, then signed and submitted, as before proposals were prepared
+- decoded: the stored approve_as_multi decoded from its call data, then
+  signed and submitted, as after a restart
+- prepared: the approve_as_multi built at proposal time signed and
+  submitted, as now
+
+    python -m bench.confirm --runs 200 --transfers 1
+"""
+
+import argparse
+import json
+import tempfile
+import time
+
+from substrateinterface import Keypair
+
+import chain
+from bench.fake_node import FakeNode
+from bench.harness import (
+    DESTINATION,
+    free_port,
+    latency_summary,
+    print_table,
+    serve_in_thread,
+)
+
+
+def bench(args):
+    chain.METADATA_CACHE_DIR = tempfile.mkdtemp(prefix="tg-multisig-confirm-")
+    node = FakeNode(block_time=args.block_time)
+    # Stamped in the node's thread as the extrinsic arrives, before decoding
+    arrivals = []
+    submit = node.submit
+
+    def received(data):
+        arrivals.append(time.perf_counter())
+        return submit(data)
+
+    node.submit = received
+    port = free_port()
+    serve_in_thread(node, port)
+    pool = chain.get_pool(f"ws://127.0.0.1:{port}", 42, "westend")
+
+    keypairs = [
+        Keypair.create_from_uri(f"//Member{member}") for member in range(args.members)
+    ]
+    proposer = keypairs[0]
+    other_signatories = sorted(keypair.ss58_address for keypair in keypairs[1:])
+    calls = [
+        {
+            "call_module": "Balances",
+            "call_function": "transfer_allow_death",
+            "call_args": {"dest": DESTINATION, "value": 1000 + number},
+        }
+        for number in range(args.transfers)
+    ]
+
+    with pool.connection() as substrate:
+        _, _, prepared = chain.prepare_proposal(
+            substrate, calls, args.members, other_signatories
+        )
+        stored = prepared.data.to_hex()
+        # The first submission fetches the proposer's nonce from the node
+        chain.submit_signed(pool, substrate, prepared, proposer)
+
+    modes = {
+        "recomposed": lambda substrate: chain.prepare_proposal(
+            substrate, calls, args.members, other_signatories
+        )[2],
+        "decoded": lambda substrate: chain.decode_call(substrate, stored),
+        "prepared": lambda substrate: prepared,
+    }
+    cases = {}
+    for mode, multisig_call in modes.items():
+        latencies = []
+        for _ in range(args.runs):
+            count = len(arrivals)
+            start = time.perf_counter()
+            with pool.connection() as substrate:
+                chain.submit_signed(pool, substrate, multisig_call(substrate), proposer)
+            while len(arrivals) == count:
+                time.sleep(0.0001)
+            latencies.append(arrivals[count] - start)
+        cases[mode] = latency_summary(latencies)
+    return {"config": vars(args), "cases": cases}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=200, help="confirms per case")
+    parser.add_argument(
+        "--transfers", type=int, default=1, help="transfers in the proposal"
+    )
+    parser.add_argument("--members", type=int, default=3, help="members per group")
+    parser.add_argument(
+        "--block-time",
+        type=float,
+        default=3600,
+        help="seconds between fake blocks; by default none, which would add noise",
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    result = bench(args)
+    print_table(result["cases"], ["count", "p50_ms", "p95_ms", "p99_ms", "max_ms"])
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(result, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1042 @@
+import asyncio
+import itertools
+import json
+from hashlib import blake2b
+
+import xxhash
+from aiohttp import WSMsgType, web
+from scalecodec.base import RuntimeConfigurationObject, ScaleBytes
+from scalecodec.type_registry import load_type_registry_preset
+
+SPEC_VERSION = 9430
+TRANSACTION_VERSION = 22
+SS58_PREFIX = 42
+# Blocks the finalized head trails the best block by, as under GRANDPA
+FINALITY_LAG = 2
+
+PALLETS = {"System": 0, "Utility": 16, "Balances": 4, "Multisig": 31}
+# Errors of the pallets whose calls can fail, in their on-chain order
+PALLET_ERRORS = {
+    "Multisig": [
+        "MinimumThreshold",
+        "AlreadyApproved",
+        "NoApprovalsNeeded",
+        "TooFewSignatories",
+        "TooManySignatories",
+        "SignatoriesOutOfOrder",
+        "SenderInSignatories",
+        "NotFound",
+        "NotOwner",
+        "NoTimepoint",
+        "WrongTimepoint",
+        "UnexpectedTimepoint",
+        "MaxWeightTooLow",
+        "AlreadyStored",
+    ]
+}
+# Calls, and argument types, in each filler pallet
+FILLER_CALLS = 10
+
+# Fees as pallet_transaction_payment charges them, in planck: a base fee per
+# extrinsic, plus fees per encoded byte and per unit of weight. The weights
+# are rough Westend benchmarks for the calls the bot makes.
+BASE_FEE = 1_000_000_000
+BYTE_FEE = 10_000_000
+WEIGHT_FEE = 10
+CALL_WEIGHTS = {
+    ("Balances", "transfer_allow_death"): 150_000_000,
+    ("Balances", "transfer_keep_alive"): 150_000_000,
+    ("Utility", "batch"): 10_000_000,
+    ("Utility", "batch_all"): 10_000_000,
+    ("Multisig", "approve_as_multi"): 250_000_000,
+    ("Multisig", "as_multi"): 300_000_000,
+}
+
+
+class TypeRegistry:
+    """Builds the portable type registry of a V14 metadata, one id per type."""
+
+    def __init__(self):
+        self.types = []
+        self.primitives = {}
+
+    def add(self, definition, path=(), params=()):
+        self.types.append(
+            {
+                "id": len(self.types),
+                "type": {
+                    "path": list(path),
+                    "params": [{"name": name, "type": ty} for name, ty in params],
+                    "def": definition,
+                    "docs": [],
+                },
+            }
+        )
+        return len(self.types) - 1
+
+    def reserve(self):
+        # Recursive types (a batch holds calls) need their id before their def
+        return self.add({"tuple": []})
+
+    def define(self, type_id, definition, path=(), params=()):
+        self.types[type_id]["type"].update(
+            path=list(path),
+            params=[{"name": name, "type": ty} for name, ty in params],
+            **{"def": definition},
+        )
+        return type_id
+
+    def primitive(self, name):
+        if name not in self.primitives:
+            self.primitives[name] = self.add({"primitive": name})
+        return self.primitives[name]
+
+    def array(self, length, ty):
+        return self.add({"array": {"len": length, "type": ty}})
+
+    def sequence(self, ty):
+        return self.add({"sequence": {"type": ty}})
+
+    def compact(self, ty):
+        return self.add({"compact": {"type": ty}})
+
+    def tuple(self, *types):
+        return self.add({"tuple": list(types)})
+
+    def composite(self, fields, path=(), params=()):
+        return self.add({"composite": {"fields": self.fields(fields)}}, path, params)
+
+    def variant(self, variants, path=(), params=()):
+        return self.add(
+            {
+                "variant": {
+                    "variants": [
+                        {
+                            "name": name,
+                            "fields": self.fields(fields),
+                            "index": index,
+                            "docs": [],
+                        }
+                        for index, (name, fields) in enumerate(variants)
+                        if name is not None
+                    ]
+                }
+            },
+            path,
+            params,
+        )
+
+    @staticmethod
+    def fields(fields):
+        return [
+            {"name": name, "type": ty, "typeName": type_name, "docs": []}
+            for name, ty, type_name in (
+                field + (None,) * (3 - len(field)) for field in fields
+            )
+        ]
+
+
+def build_metadata(filler_pallets=0):
+    """Encode a V14 metadata with the slice of Westend the bot uses.
+
+    It has System storage for accounts and events, Balances transfers,
+    Utility batches and the Multisig pallet, with the same paths, pallet
+    indices and signed extensions as Westend. substrate-interface can then
+    compose, sign and decode against it as it would against a real node.
+    Filler pallets with calls nothing uses bring its size closer to a real
+    runtime's, for measuring metadata loading.
+    """
+    registry = TypeRegistry()
+    u8 = registry.primitive("u8")
+    u16 = registry.primitive("u16")
+    u32 = registry.primitive("u32")
+    u64 = registry.primitive("u64")
+    u128 = registry.primitive("u128")
+    unit = registry.tuple()
+    bytes_ = registry.sequence(u8)
+    hash_ = registry.composite(
+        [(None, registry.array(32, u8))], ["primitive_types", "H256"]
+    )
+    account = registry.composite(
+        [(None, registry.array(32, u8))], ["sp_core", "crypto", "AccountId32"]
+    )
+    address = registry.variant(
+        [
+            ("Id", [(None, account)]),
+            ("Index", [(None, registry.compact(u32))]),
+            ("Raw", [(None, bytes_)]),
+            ("Address32", [(None, registry.array(32, u8))]),
+            ("Address20", [(None, registry.array(20, u8))]),
+        ],
+        ["sp_runtime", "multiaddress", "MultiAddress"],
+        [("AccountId", account), ("AccountIndex", unit)],
+    )
+    signature = registry.variant(
+        [
+            ("Ed25519", [(None, registry.array(64, u8))]),
+            ("Sr25519", [(None, registry.array(64, u8))]),
+            ("Ecdsa", [(None, registry.array(65, u8))]),
+        ],
+        ["sp_runtime", "MultiSignature"],
+    )
+    era = registry.variant([("Immortal", [])], ["sp_runtime", "generic", "era", "Era"])
+    weight = registry.composite(
+        [
+            ("ref_time", registry.compact(u64)),
+            ("proof_size", registry.compact(u64)),
+        ],
+        ["sp_weights", "weight_v2", "Weight"],
+    )
+    timepoint = registry.composite(
+        [("height", u32), ("index", u32)], ["pallet_multisig", "Timepoint"]
+    )
+    accounts = registry.sequence(account)
+
+    call = registry.reserve()
+    calls = {
+        "System": registry.variant(
+            [("remark", [("remark", bytes_, "Vec<u8>")])],
+            ["frame_system", "pallet", "Call"],
+        ),
+        "Utility": registry.variant(
+            [
+                (
+                    "batch",
+                    [
+                        (
+                            "calls",
+                            registry.sequence(call),
+                            "Vec<<T as Config>::RuntimeCall>",
+                        )
+                    ],
+                )
+            ]
+            + [(None, [])]
+            + [
+                (
+                    "batch_all",
+                    [
+                        (
+                            "calls",
+                            registry.sequence(call),
+                            "Vec<<T as Config>::RuntimeCall>",
+                        )
+                    ],
+                )
+            ],
+            ["pallet_utility", "pallet", "Call"],
+        ),
+        "Balances": registry.variant(
+            [
+                (
+                    "transfer_allow_death",
+                    [
+                        ("dest", address, "AccountIdLookupOf<T>"),
+                        ("value", registry.compact(u128), "T::Balance"),
+                    ],
+                ),
+                (None, []),
+                (None, []),
+                (
+                    "transfer_keep_alive",
+                    [
+                        ("dest", address, "AccountIdLookupOf<T>"),
+                        ("value", registry.compact(u128), "T::Balance"),
+                    ],
+                ),
+            ],
+            ["pallet_balances", "pallet", "Call"],
+        ),
+        "Multisig": registry.variant(
+            [
+                (
+                    "as_multi_threshold_1",
+                    [
+                        ("other_signatories", accounts, "Vec<T::AccountId>"),
+                        ("call", call, "Box<<T as Config>::RuntimeCall>"),
+                    ],
+                ),
+                (
+                    "as_multi",
+                    [
+                        ("threshold", u16, "u16"),
+                        ("other_signatories", accounts, "Vec<T::AccountId>"),
+                        (
+                            "maybe_timepoint",
+                            registry.variant(
+                                [("None", []), ("Some", [(None, timepoint)])],
+                                ["Option"],
+                                [("T", timepoint)],
+                            ),
+                            "Option<Timepoint<BlockNumberFor<T>>>",
+                        ),
+                        ("call", call, "Box<<T as Config>::RuntimeCall>"),
+                        ("max_weight", weight, "Weight"),
+                    ],
+                ),
+                (
+                    "approve_as_multi",
+                    [
+                        ("threshold", u16, "u16"),
+                        ("other_signatories", accounts, "Vec<T::AccountId>"),
+                        (
+                            "maybe_timepoint",
+                            registry.variant(
+                                [("None", []), ("Some", [(None, timepoint)])],
+                                ["Option"],
+                                [("T", timepoint)],
+                            ),
+                            "Option<Timepoint<BlockNumberFor<T>>>",
+                        ),
+                        ("call_hash", registry.array(32, u8), "[u8; 32]"),
+                        ("max_weight", weight, "Weight"),
+                    ],
+                ),
+            ],
+            ["pallet_multisig", "pallet", "Call"],
+        ),
+    }
+    registry.define(
+        call,
+        variant_def(
+            [(name, [(None, calls[name])], index) for name, index in PALLETS.items()]
+        ),
+        ["westend_runtime", "RuntimeCall"],
+    )
+
+    module_error = registry.composite(
+        [("index", u8), ("error", registry.array(4, u8))],
+        ["sp_runtime", "ModuleError"],
+    )
+    dispatch_error = registry.variant(
+        [
+            ("Other", []),
+            ("CannotLookup", []),
+            ("BadOrigin", []),
+            ("Module", [(None, module_error)]),
+        ],
+        ["sp_runtime", "DispatchError"],
+    )
+    dispatch_info = registry.composite(
+        [
+            ("weight", weight),
+            (
+                "class",
+                registry.variant(
+                    [("Normal", []), ("Operational", []), ("Mandatory", [])],
+                    ["frame_support", "dispatch", "DispatchClass"],
+                ),
+            ),
+            (
+                "pays_fee",
+                registry.variant(
+                    [("Yes", []), ("No", [])], ["frame_support", "dispatch", "Pays"]
+                ),
+            ),
+        ],
+        ["frame_support", "dispatch", "DispatchInfo"],
+    )
+    dispatch_result = registry.variant(
+        [("Ok", [(None, unit)]), ("Err", [(None, dispatch_error)])],
+        ["Result"],
+        [("T", unit), ("E", dispatch_error)],
+    )
+    events = {
+        "System": registry.variant(
+            [
+                (
+                    "ExtrinsicSuccess",
+                    [("dispatch_info", dispatch_info, "DispatchInfo")],
+                ),
+                (
+                    "ExtrinsicFailed",
+                    [
+                        ("dispatch_error", dispatch_error, "DispatchError"),
+                        ("dispatch_info", dispatch_info, "DispatchInfo"),
+                    ],
+                ),
+            ],
+            ["frame_system", "pallet", "Event"],
+        ),
+        "Utility": registry.variant(
+            [
+                (
+                    "BatchInterrupted",
+                    [("index", u32, "u32"), ("error", dispatch_error, "DispatchError")],
+                ),
+                ("BatchCompleted", []),
+            ],
+            ["pallet_utility", "pallet", "Event"],
+        ),
+        "Balances": registry.variant(
+            [(None, [])] * 2
+            + [
+                (
+                    "Transfer",
+                    [
+                        ("from", account, "T::AccountId"),
+                        ("to", account, "T::AccountId"),
+                        ("amount", u128, "T::Balance"),
+                    ],
+                )
+            ],
+            ["pallet_balances", "pallet", "Event"],
+        ),
+        "Multisig": registry.variant(
+            [
+                (
+                    "NewMultisig",
+                    [
+                        ("approving", account, "T::AccountId"),
+                        ("multisig", account, "T::AccountId"),
+                        ("call_hash", registry.array(32, u8), "CallHash"),
+                    ],
+                ),
+                (
+                    "MultisigApproval",
+                    [
+                        ("approving", account, "T::AccountId"),
+                        ("timepoint", timepoint, "Timepoint<BlockNumberFor<T>>"),
+                        ("multisig", account, "T::AccountId"),
+                        ("call_hash", registry.array(32, u8), "CallHash"),
+                    ],
+                ),
+                (
+                    "MultisigExecuted",
+                    [
+                        ("approving", account, "T::AccountId"),
+                        ("timepoint", timepoint, "Timepoint<BlockNumberFor<T>>"),
+                        ("multisig", account, "T::AccountId"),
+                        ("call_hash", registry.array(32, u8), "CallHash"),
+                        ("result", dispatch_result, "DispatchResult"),
+                    ],
+                ),
+            ],
+            ["pallet_multisig", "pallet", "Event"],
+        ),
+    }
+    event = registry.add(
+        variant_def(
+            [(name, [(None, events[name])], index) for name, index in PALLETS.items()]
+        ),
+        ["westend_runtime", "RuntimeEvent"],
+    )
+    phase = registry.variant(
+        [
+            ("ApplyExtrinsic", [(None, u32)]),
+            ("Finalization", []),
+            ("Initialization", []),
+        ],
+        ["frame_system", "Phase"],
+    )
+    event_record = registry.composite(
+        [("phase", phase), ("event", event), ("topics", registry.sequence(hash_))],
+        ["frame_system", "EventRecord"],
+        [("E", event), ("T", hash_)],
+    )
+    account_data = registry.composite(
+        [("free", u128), ("reserved", u128), ("frozen", u128), ("flags", u128)],
+        ["pallet_balances", "types", "AccountData"],
+    )
+    account_info = registry.composite(
+        [
+            ("nonce", u32),
+            ("consumers", u32),
+            ("providers", u32),
+            ("sufficients", u32),
+            ("data", account_data),
+        ],
+        ["frame_system", "AccountInfo"],
+    )
+    extrinsic = registry.composite(
+        [(None, bytes_)],
+        ["sp_runtime", "generic", "unchecked_extrinsic", "UncheckedExtrinsic"],
+        [
+            ("Address", address),
+            ("Call", call),
+            ("Signature", signature),
+            ("Extra", unit),
+        ],
+    )
+
+    def extension(identifier, ty=unit, additional_signed=unit):
+        return {
+            "identifier": identifier,
+            "ty": ty,
+            "additional_signed": additional_signed,
+        }
+
+    pallets = [
+        pallet(
+            "System",
+            storage={
+                "prefix": "System",
+                "entries": [
+                    storage_entry(
+                        "Account",
+                        {
+                            "Map": {
+                                "hashers": ["Blake2_128Concat"],
+                                "key": account,
+                                "value": account_info,
+                            }
+                        },
+                        "0x" + "00" * 80,
+                    ),
+                    storage_entry(
+                        "Events", {"Plain": registry.sequence(event_record)}, "0x00"
+                    ),
+                ],
+            },
+            calls=calls["System"],
+            event=events["System"],
+            constants=[
+                {
+                    "name": "SS58Prefix",
+                    "type": u16,
+                    "value": "0x" + SS58_PREFIX.to_bytes(2, "little").hex(),
+                    "documentation": [],
+                }
+            ],
+        ),
+        pallet("Balances", calls=calls["Balances"], event=events["Balances"]),
+        pallet("Utility", calls=calls["Utility"], event=events["Utility"]),
+        pallet(
+            "Multisig",
+            calls=calls["Multisig"],
+            event=events["Multisig"],
+            error=registry.variant(
+                [(name, []) for name in PALLET_ERRORS["Multisig"]],
+                ["pallet_multisig", "pallet", "Error"],
+            ),
+        ),
+    ]
+    for number in range(filler_pallets):
+        name = f"Filler{number}"
+        args = [
+            (
+                f"arg{arg}",
+                registry.composite(
+                    [("a", u32), ("b", u128), ("c", bytes_), ("d", account)],
+                    ["pallet_filler", name, f"Arg{arg}"],
+                ),
+                f"Arg{arg}",
+            )
+            for arg in range(FILLER_CALLS)
+        ]
+        filler_calls = registry.variant(
+            [(f"call{call}", args[: call + 1]) for call in range(FILLER_CALLS)],
+            ["pallet_filler", name, "Call"],
+        )
+        pallets.append(pallet(name, calls=filler_calls, index=100 + number))
+    metadata = {
+        "types": {"types": registry.types},
+        "pallets": pallets,
+        "extrinsic": {
+            "ty": extrinsic,
+            "version": 4,
+            "signed_extensions": [
+                extension("CheckNonZeroSender"),
+                extension("CheckSpecVersion", additional_signed=u32),
+                extension("CheckTxVersion", additional_signed=u32),
+                extension("CheckGenesis", additional_signed=hash_),
+                extension("CheckMortality", era, hash_),
+                extension("CheckNonce", registry.compact(u32)),
+                extension("CheckWeight"),
+                extension("ChargeTransactionPayment", registry.compact(u128)),
+            ],
+        },
+        "runtime_type": unit,
+    }
+
+    runtime_config = RuntimeConfigurationObject()
+    runtime_config.update_type_registry(load_type_registry_preset("core"))
+    encoded = runtime_config.create_scale_object("MetadataVersioned").encode(
+        ["0x6d657461", {"V14": metadata}]
+    )
+    return encoded.data
+
+
+def variant_def(variants):
+    # Outer enums are indexed by pallet index, so variants skip numbers
+    return {
+        "variant": {
+            "variants": [
+                {
+                    "name": name,
+                    "fields": TypeRegistry.fields(fields),
+                    "index": index,
+                    "docs": [],
+                }
+                for name, fields, index in variants
+            ]
+        }
+    }
+
+
+def pallet(
+    name, storage=None, calls=None, event=None, constants=(), index=None, error=None
+):
+    return {
+        "name": name,
+        "storage": storage,
+        "calls": {"ty": calls} if calls is not None else None,
+        "event": {"ty": event} if event is not None else None,
+        "constants": list(constants),
+        "error": {"ty": error} if error is not None else None,
+        "index": PALLETS[name] if index is None else index,
+    }
+
+
+def storage_entry(name, ty, default):
+    return {
+        "name": name,
+        "modifier": "Default",
+        "type": ty,
+        "default": default,
+        "documentation": [],
+    }
+
+
+def compact(value):
+    if value < 1 << 6:
+        return bytes([value << 2])
+    if value < 1 << 14:
+        return (value << 2 | 1).to_bytes(2, "little")
+    if value < 1 << 30:
+        return (value << 2 | 2).to_bytes(4, "little")
+    data = value.to_bytes((value.bit_length() + 7) // 8, "little")
+    return bytes([(len(data) - 4) << 2 | 3]) + data
+
+
+def twox128(data):
+    return (
+        xxhash.xxh64(data, seed=0).digest()[::-1]
+        + xxhash.xxh64(data, seed=1).digest()[::-1]
+    )
+
+
+def account_bytes(value):
+    # Decoded addresses and accounts come back as 0x-prefixed public keys
+    if isinstance(value, dict):
+        value = value.get("Id", next(iter(value.values())))
+    return bytes.fromhex(value[2:])
+
+
+def multisig_account(signatories, threshold):
+    # pallet_multisig::Pallet::multi_account_id
+    data = compact(len(signatories)) + b"".join(sorted(signatories))
+    return blake2b(
+        b"modlpy/utilisuba" + data + threshold.to_bytes(2, "little"), digest_size=32
+    ).digest()
+
+
+# A successful dispatch's DispatchInfo: weight, Normal class, pays the fee
+DISPATCH_INFO = compact(200_000_000) + compact(10_000) + b"\x00\x00"
+
+
+class FakeNode:
+    """An in-memory chain behind a Substrate JSON-RPC websocket.
+
+    It answers the RPCs substrate-interface makes: runtime version and
+    metadata, headers and blocks, storage for System.Account and
+    System.Events, account nonces, extrinsic submission and new-head
+    subscriptions. Submitted extrinsics are decoded against the metadata and
+    queued by signer and nonce like a transaction pool, outdated nonces are
+    rejected, and every `block_time` seconds the ready ones are included
+    with their events. Multisig approvals and transfers emit the events the
+    real pallets do, and each included extrinsic is charged a modelled fee.
+    Each RPC can be answered after `rpc_delay` seconds, to stand in for a
+    node across a network.
+    """
+
+    def __init__(
+        self, block_time=1.0, block_capacity=1000, rpc_delay=0.0, filler_pallets=0
+    ):
+        self.block_time = block_time
+        self.block_capacity = block_capacity
+        self.rpc_delay = rpc_delay
+        self.metadata = "0x" + build_metadata(filler_pallets).hex()
+        self.runtime_config = RuntimeConfigurationObject()
+        self.runtime_config.update_type_registry(load_type_registry_preset("core"))
+        self.decoded_metadata = self.runtime_config.create_scale_object(
+            "MetadataVersioned", data=ScaleBytes(self.metadata)
+        )
+        self.decoded_metadata.decode()
+        self.runtime_config.add_portable_registry(self.decoded_metadata)
+
+        self.blocks = []
+        self.by_hash = {}
+        self.nonces = {}
+        self.balances = {}
+        self.pool = {}
+        self.multisigs = {}
+        self.subscriptions = {}
+        self.subscription_ids = itertools.count(1)
+        self.stats = {
+            "rpc": 0,
+            "submitted": 0,
+            "included": 0,
+            "rejected": 0,
+            "failed": 0,
+            "fees": 0,
+        }
+        self.add_block([], [])
+
+    # Blocks
+
+    @property
+    def head(self):
+        return self.blocks[-1]
+
+    @property
+    def finalized(self):
+        return self.blocks[max(len(self.blocks) - 1 - FINALITY_LAG, 0)]
+
+    def add_block(self, extrinsics, events):
+        number = len(self.blocks)
+        parent = self.blocks[-1]["hash"] if self.blocks else "0x" + "00" * 32
+        seed = number.to_bytes(4, "little") + bytes.fromhex(parent[2:])
+        block = {
+            "number": number,
+            "hash": "0x" + blake2b(seed, digest_size=32).hexdigest(),
+            "parent": parent,
+            "extrinsics": extrinsics,
+            "events": compact(len(events)) + b"".join(events),
+        }
+        self.blocks.append(block)
+        self.by_hash[block["hash"]] = block
+        return block
+
+    def header(self, block):
+        return {
+            "parentHash": block["parent"],
+            "number": hex(block["number"]),
+            "stateRoot": "0x" + "00" * 32,
+            "extrinsicsRoot": "0x" + "00" * 32,
+            "digest": {"logs": []},
+        }
+
+    def produce_block(self):
+        extrinsics = []
+        events = []
+        for account, queued in list(self.pool.items()):
+            while queued and len(extrinsics) < self.block_capacity:
+                nonce = self.nonces.get(account, 0)
+                if nonce not in queued:
+                    break
+                data, call = queued.pop(nonce)
+                index = len(extrinsics)
+                extrinsics.append(data)
+                self.stats["fees"] += self.fee(data, call)
+                self.nonces[account] = nonce + 1
+                try:
+                    events += self.dispatch(account, call, index)
+                except DispatchError as e:
+                    # A failed call's own events are reverted with it
+                    self.stats["failed"] += 1
+                    events.append(
+                        self.event(index, "System", 1, e.data + DISPATCH_INFO)
+                    )
+                else:
+                    events.append(self.event(index, "System", 0, DISPATCH_INFO))
+            if not queued:
+                del self.pool[account]
+        self.stats["included"] += len(extrinsics)
+        return self.add_block(extrinsics, events)
+
+    def dispatch(self, account, call, index):
+        args = {arg["name"]: arg["value"] for arg in call["call_args"]}
+        function = (call["call_module"], call["call_function"])
+        if function in (
+            ("Balances", "transfer_allow_death"),
+            ("Balances", "transfer_keep_alive"),
+        ):
+            return [self.transfer(index, account, args["dest"], args["value"])]
+        if function == ("Utility", "batch_all"):
+            events = []
+            for inner in args["calls"]:
+                events += self.dispatch(account, inner, index)
+            return events + [self.event(index, "Utility", 1, b"")]
+        if function == ("Multisig", "approve_as_multi"):
+            # pallet_multisig checks the signatories as ensure_sorted_and_insert
+            # does, rather than sorting them for the caller
+            others = [account_bytes(other) for other in args["other_signatories"]]
+            if args["threshold"] < 2:
+                raise DispatchError("Multisig", "MinimumThreshold")
+            if not others:
+                raise DispatchError("Multisig", "TooFewSignatories")
+            if any(first >= second for first, second in zip(others, others[1:])):
+                raise DispatchError("Multisig", "SignatoriesOutOfOrder")
+            if account in others:
+                raise DispatchError("Multisig", "SenderInSignatories")
+            signatories = [account] + others
+            multisig = multisig_account(signatories, args["threshold"])
+            call_hash = bytes.fromhex(args["call_hash"][2:])
+            timepoint = self.multisigs.get((multisig, call_hash))
+            if timepoint is None:
+                self.multisigs[multisig, call_hash] = (len(self.blocks), index)
+                return [
+                    self.event(index, "Multisig", 0, account + multisig + call_hash)
+                ]
+            height, extrinsic_index = timepoint
+            data = (
+                account
+                + height.to_bytes(4, "little")
+                + extrinsic_index.to_bytes(4, "little")
+                + multisig
+                + call_hash
+            )
+            return [self.event(index, "Multisig", 1, data)]
+        return []
+
+    def weight(self, call):
+        # Batches weigh what their calls do; a multisig approval only carries
+        # the call's hash, so it weighs the same whatever it approves
+        weight = CALL_WEIGHTS.get((call["call_module"], call["call_function"]), 0)
+        if call["call_module"] == "Utility":
+            for arg in call["call_args"]:
+                if arg["name"] == "calls":
+                    weight += sum(self.weight(inner) for inner in arg["value"])
+        return weight
+
+    def fee(self, data, call):
+        length = len(data) // 2 - 1
+        return BASE_FEE + BYTE_FEE * length + WEIGHT_FEE * self.weight(call)
+
+    def transfer(self, index, source, dest, amount):
+        dest = account_bytes(dest)
+        self.balances[dest] = self.balances.get(dest, 0) + amount
+        data = source + dest + amount.to_bytes(16, "little")
+        return self.event(index, "Balances", 2, data)
+
+    @staticmethod
+    def event(index, pallet, event_index, data):
+        # EventRecord: ApplyExtrinsic phase, the event, no topics
+        phase = b"\x00" + index.to_bytes(4, "little")
+        return phase + bytes([PALLETS[pallet], event_index]) + data + compact(0)
+
+    # Transaction pool
+
+    def submit(self, data):
+        extrinsic = self.runtime_config.create_scale_object(
+            "Extrinsic", data=ScaleBytes(data), metadata=self.decoded_metadata
+        )
+        extrinsic.decode()
+        value = extrinsic.value
+        account = account_bytes(value["address"])
+        nonce = value["nonce"]
+        queued = self.pool.setdefault(account, {})
+        if nonce < self.nonces.get(account, 0) or nonce in queued:
+            self.stats["rejected"] += 1
+            raise RpcError(1010, "Invalid Transaction", "Transaction is outdated")
+        queued[nonce] = (data, value["call"])
+        self.stats["submitted"] += 1
+        return "0x" + blake2b(bytes.fromhex(data[2:]), digest_size=32).hexdigest()
+
+    def next_index(self, address):
+        # Counts what is already queued, as system_accountNextIndex does
+        from scalecodec.utils.ss58 import ss58_decode
+
+        account = bytes.fromhex(ss58_decode(address))
+        nonce = self.nonces.get(account, 0)
+        queued = self.pool.get(account, {})
+        while nonce in queued:
+            nonce += 1
+        return nonce
+
+    # Storage
+
+    def storage(self, key, block):
+        key = bytes.fromhex(key[2:])
+        if key == twox128(b"System") + twox128(b"Events"):
+            return "0x" + block["events"].hex()
+        if key.startswith(twox128(b"System") + twox128(b"Account")):
+            account = key[48:]
+            nonce = self.nonces.get(account, 0)
+            free = self.balances.get(account, 0)
+            if not nonce and not free:
+                return None
+            info = nonce.to_bytes(4, "little") + bytes(4) + (1).to_bytes(4, "little")
+            return (
+                "0x" + (info + bytes(4) + free.to_bytes(16, "little") + bytes(48)).hex()
+            )
+        return None
+
+    # JSON-RPC
+
+    def block(self, block_hash):
+        if block_hash is None:
+            return self.head
+        block = self.by_hash.get(block_hash)
+        if block is None:
+            raise RpcError(4003, "Client error", f"Unknown block {block_hash}")
+        return block
+
+    def call(self, method, params):
+        self.stats["rpc"] += 1
+        if method == "rpc_methods":
+            return {"methods": sorted(RPC_METHODS)}
+        if method == "system_health":
+            return {"peers": 1, "isSyncing": False, "shouldHavePeers": True}
+        if method == "system_chain":
+            return "Westend Fake"
+        if method == "system_properties":
+            return {
+                "ss58Format": SS58_PREFIX,
+                "tokenDecimals": 12,
+                "tokenSymbol": "WND",
+            }
+        if method == "system_accountNextIndex":
+            return self.next_index(params[0])
+        if method == "chain_getBlockHash":
+            number = params[0] if params else None
+            if number is None:
+                return self.head["hash"]
+            return self.blocks[number]["hash"] if number < len(self.blocks) else None
+        if method == "chain_getHead":
+            return self.head["hash"]
+        if method == "chain_getFinalizedHead":
+            return self.finalized["hash"]
+        if method == "chain_getHeader":
+            return self.header(self.block(params[0] if params else None))
+        if method == "chain_getBlock":
+            block = self.block(params[0] if params else None)
+            return {
+                "block": {
+                    "header": self.header(block),
+                    "extrinsics": block["extrinsics"],
+                },
+                "justifications": None,
+            }
+        if method in ("state_getRuntimeVersion", "chain_getRuntimeVersion"):
+            return {
+                "specName": "westend",
+                "implName": "parity-westend",
+                "authoringVersion": 2,
+                "specVersion": SPEC_VERSION,
+                "implVersion": 0,
+                "apis": [],
+                "transactionVersion": TRANSACTION_VERSION,
+                "stateVersion": 1,
+            }
+        if method == "state_getMetadata":
+            return self.metadata
+        if method in ("state_getStorage", "state_getStorageAt"):
+            return self.storage(
+                params[0], self.block(params[1] if len(params) > 1 else None)
+            )
+        if method == "state_queryStorageAt":
+            block = self.block(params[1] if len(params) > 1 else None)
+            return [
+                {
+                    "block": block["hash"],
+                    "changes": [[key, self.storage(key, block)] for key in params[0]],
+                }
+            ]
+        if method == "author_submitExtrinsic":
+            return self.submit(params[0])
+        raise RpcError(-32601, "Method not found", method)
+
+    async def handle(self, request):
+        socket = web.WebSocketResponse(max_msg_size=0)
+        await socket.prepare(request)
+        try:
+            async for message in socket:
+                if message.type != WSMsgType.TEXT:
+                    break
+                await self.respond(socket, json.loads(message.data))
+        finally:
+            for subscription_id, subscriber in list(self.subscriptions.items()):
+                if subscriber is socket:
+                    del self.subscriptions[subscription_id]
+        return socket
+
+    async def respond(self, socket, payload):
+        method = payload["method"]
+        response = {"jsonrpc": "2.0", "id": payload["id"]}
+        if method == "chain_subscribeNewHeads":
+            subscription_id = f"sub{next(self.subscription_ids)}"
+            self.subscriptions[subscription_id] = socket
+            response["result"] = subscription_id
+            await socket.send_str(json.dumps(response))
+            await self.notify(subscription_id, socket, self.head)
+            return
+        if method == "chain_unsubscribeNewHeads":
+            response["result"] = (
+                self.subscriptions.pop(payload["params"][0], None) is not None
+            )
+        else:
+            if self.rpc_delay:
+                await asyncio.sleep(self.rpc_delay)
+            try:
+                response["result"] = self.call(method, payload.get("params", []))
+            except RpcError as e:
+                response["error"] = e.error
+            except Exception as e:
+                response["error"] = {"code": -32603, "message": repr(e)}
+        await socket.send_str(json.dumps(response))
+
+    async def notify(self, subscription_id, socket, block):
+        message = {
+            "jsonrpc": "2.0",
+            "method": "chain_newHead",
+            "params": {"subscription": subscription_id, "result": self.header(block)},
+        }
+        try:
+            await socket.send_str(json.dumps(message))
+        except ConnectionError:
+            self.subscriptions.pop(subscription_id, None)
+
+    async def produce_blocks(self):
+        while True:
+            await asyncio.sleep(self.block_time)
+            block = self.produce_block()
+            for subscription_id, socket in list(self.subscriptions.items()):
+                await self.notify(subscription_id, socket, block)
+
+    async def start(self, port):
+        app = web.Application()
+        app.router.add_get("/", self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        self.producer = asyncio.create_task(self.produce_blocks())
+        return runner
+
+
+class DispatchError(Exception):
+    # A call that fails on chain; data is its encoded DispatchError::Module
+    def __init__(self, pallet, error):
+        super().__init__(f"{pallet}.{error}")
+        index = PALLET_ERRORS[pallet].index(error)
+        self.data = bytes([3, PALLETS[pallet], index, 0, 0, 0])
+
+
+class RpcError(Exception):
+    def __init__(self, code, message, data=None):
+        super().__init__(message)
+        self.error = {"code": code, "message": message, "data": data}
+
+
+RPC_METHODS = {
+    "author_submitExtrinsic",
+    "chain_getBlock",
+    "chain_getBlockHash",
+    "chain_getFinalizedHead",
+    "chain_getHead",
+    "chain_getHeader",
+    "chain_getRuntimeVersion",
+    "chain_subscribeNewHeads",
+    "chain_unsubscribeNewHeads",
+    "rpc_methods",
+    "state_getMetadata",
+    "state_getRuntimeVersion",
+    "state_getStorage",
+    "state_getStorageAt",
+    "state_queryStorageAt",
+    "system_accountNextIndex",
+    "system_chain",
+    "system_health",
+    "system_properties",
+}
@@ -0,0 +1,136 @@
+import asyncio
+import itertools
+import time
+from collections import Counter
+from urllib.parse import parse_qsl
+
+from aiohttp import web
+
+BOT_USER = {
+    "id": 1,
+    "is_bot": True,
+    "first_name": "Multisig",
+    "username": "multisig_bot",
+}
+
+
+class FakeTelegram:
+    """A local Bot API server for the bot to poll and post to.
+
+    Updates pushed by the driver are served from getUpdates, long polling
+    like Telegram does, and dropped once a later offset confirms them.
+    Messages the bot sends or edits resolve whatever the driver is waiting
+    for in that chat, with the time they arrived.
+    """
+
+    def __init__(self, member_count):
+        self.member_count = member_count
+        self.updates = []
+        self.pushed = 0
+        self.message_ids = itertools.count(1)
+        self.arrived = asyncio.Event()
+        self.waiters = {}
+        self.requests = Counter()
+
+    def update(self, chat_id, user_id, text):
+        # A message update with the next update_id
+        self.pushed += 1
+        return {
+            "update_id": self.pushed,
+            "message": {
+                "message_id": next(self.message_ids),
+                "date": int(time.time()),
+                "chat": {
+                    "id": chat_id,
+                    "type": "group",
+                    "title": f"Chat {chat_id}",
+                },
+                "from": {
+                    "id": user_id,
+                    "is_bot": False,
+                    "first_name": f"User {user_id}",
+                    "username": f"user{user_id}",
+                },
+                "text": text,
+            },
+        }
+
+    def push(self, chat_id, user_id, text):
+        # Returns when the update became available to the bot
+        self.updates.append(self.update(chat_id, user_id, text))
+        self.arrived.set()
+        return time.perf_counter()
+
+    def expect(self, chat_id, text):
+        """Return a future for the next message in the chat containing text."""
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(chat_id, []).append((text, future))
+        return future
+
+    def received(self, chat_id, text):
+        now = time.perf_counter()
+        waiting = self.waiters.get(chat_id, [])
+        for expected, future in list(waiting):
+            if expected in text and not future.done():
+                future.set_result(now)
+                waiting.remove((expected, future))
+
+    async def get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates:
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(
+                    self.arrived.wait(), float(params.get("timeout") or 0)
+                )
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[: int(params.get("limit") or 100)]
+
+    def message(self, chat_id, text, message_id=None):
+        return {
+            "message_id": message_id or next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "group", "title": f"Chat {chat_id}"},
+            "from": BOT_USER,
+            "text": text,
+        }
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        # telebot sends its parameters as a form body, on GETs too
+        body = (await request.read()).decode()
+        params = {**request.query, **dict(parse_qsl(body))}
+        self.requests[method] += 1
+
+        if method == "getUpdates":
+            result = await self.get_updates(params)
+        elif method == "getMe":
+            result = BOT_USER
+        elif method == "getChatMemberCount":
+            result = self.member_count
+        elif method in ("sendMessage", "editMessageText"):
+            chat_id = int(params["chat_id"])
+            self.received(chat_id, params["text"])
+            message_id = params.get("message_id")
+            result = self.message(
+                chat_id, params["text"], message_id and int(message_id)
+            )
+        elif method in ("pinChatMessage", "unpinChatMessage", "setWebhook"):
+            result = True
+        else:
+            return web.json_response(
+                {"ok": False, "error_code": 404, "description": "Not Found"},
+                status=404,
+            )
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, port):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/bot{token}/{method}", self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        return runner
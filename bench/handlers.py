@@ -0,0 +1,168 @@
+"""Handler latency benchmark under concurrent chats.
+
+Runs the bot against the fake Telegram server and fake node and drives
+complete multisig flows in N chats at once, as bench.run does: every chat
+registers with /hi, proposes a transfer with /create and approves it with
+/yes until the receipt is posted. Handler latency per command is then read
+from the bot's bot_handler_seconds histogram on /metrics:
+
+    python -m bench.handlers --chats 1 50
+
+A handler's time includes the chain calls it waits on, such as creating
+the group on the last /hi and submitting on the last /yes, but not time
+spent queued behind other updates. Percentiles are interpolated within
+histogram buckets, as Prometheus's histogram_quantile does.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import re
+import sys
+import tempfile
+
+import aiohttp
+
+from bench.fake_node import FakeNode
+from bench.fake_telegram import FakeTelegram
+from bench.harness import (
+    Results,
+    bench_env,
+    free_port,
+    print_table,
+    run_phase,
+    scrape,
+    start_process,
+    stop_processes,
+    wait_until,
+)
+from bench.run import run_chat
+
+BUCKET = re.compile(r'bot_handler_seconds_bucket\{command="(\w+)",le="([^"]+)"\}')
+
+
+def handler_buckets(metrics):
+    # {command: [(upper bound, cumulative count)]}, lowest bound first
+    buckets = {}
+    for sample, count in metrics.items():
+        match = BUCKET.fullmatch(sample)
+        if match:
+            command, bound = match.groups()
+            buckets.setdefault(command, []).append((float(bound), count))
+    return {command: sorted(series) for command, series in buckets.items()}
+
+
+def quantile(buckets, fraction):
+    rank = fraction * buckets[-1][1]
+    lower, below = 0.0, 0
+    for bound, count in buckets:
+        if count >= rank:
+            if math.isinf(bound):
+                return lower
+            return lower + (bound - lower) * (rank - below) / max(count - below, 1)
+        lower, below = bound, count
+    return lower
+
+
+async def run_case(node_port, chats, args):
+    state_dir = tempfile.mkdtemp(prefix="tg-multisig-handlers-")
+    telegram = FakeTelegram(member_count=args.members + 1)
+    telegram_port, metrics_port = free_port(), free_port()
+    server = await telegram.start(telegram_port)
+    env = bench_env(
+        state_dir,
+        node_port,
+        telegram_port,
+        METRICS_PORT=str(metrics_port),
+        KEY_POOL_SIZE=str(max(64, chats * args.members)),
+    )
+    log = os.path.join(state_dir, "bot.log")
+    bot = await start_process(["-m", "bench.bot"], env, log)
+    session = aiohttp.ClientSession(base_url=f"http://127.0.0.1:{metrics_port}")
+    results = Results()
+    try:
+
+        async def polling():
+            return telegram.requests["getUpdates"] > 0
+
+        await wait_until(polling, "The bot", bot, log)
+        phase = await run_phase(
+            "bot",
+            [run_chat(telegram, index, args.members, results) for index in range(chats)],
+            results,
+            lambda: telegram.pushed,
+        )
+        metrics = await scrape(session, "/metrics")
+    finally:
+        await session.close()
+        await stop_processes([bot])
+        await server.cleanup()
+
+    cases = {}
+    for command, buckets in handler_buckets(metrics).items():
+        cases[f"{chats} chats /{command}"] = {
+            "count": int(buckets[-1][1]),
+            **{
+                f"p{percent}_ms": quantile(buckets, percent / 100) * 1000
+                for percent in (50, 95, 99)
+            },
+        }
+    return cases, phase, results.failures, log
+
+
+async def bench(args):
+    node = FakeNode(block_time=args.block_time)
+    node_port = free_port()
+    server = await node.start(node_port)
+    cases = {}
+    phases = {}
+    failures = []
+    try:
+        for chats in args.chats:
+            case, phase, failed, log = await run_case(node_port, chats, args)
+            cases.update(case)
+            phases[f"{chats} chats"] = phase
+            failures.extend(f"{chats} chats: {failure}, see {log}" for failure in failed)
+    finally:
+        await server.cleanup()
+    return {"config": vars(args), "cases": cases, "phases": phases, "failures": failures}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--chats",
+        type=int,
+        nargs="+",
+        default=[1, 50],
+        help="concurrent chats, one case each",
+    )
+    parser.add_argument("--members", type=int, default=3, help="members per group")
+    parser.add_argument(
+        "--block-time", type=float, default=1.0, help="seconds between fake blocks"
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    if args.members < 2:
+        parser.error("--members must be at least 2")
+
+    result = asyncio.run(bench(args))
+    print_table(result["cases"], ["count", "p50_ms", "p95_ms", "p99_ms"])
+    for name, phase in result["phases"].items():
+        print(
+            f"{name}: {phase['completed']}/{phase['flows']} flows in "
+            f"{phase['seconds']:.2f}s"
+        )
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(result, out, indent=2)
+    for failure in result["failures"]:
+        print(f"failed: {failure}")
+    if result["failures"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
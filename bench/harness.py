@@ -0,0 +1,214 @@
+"""Helpers shared by the benchmarks: ports, percentiles, subprocesses and
+running the fake servers for code that talks to them synchronously."""
+
+import asyncio
+import os
+import secrets
+import socket
+import sys
+import threading
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Where proposed transfers go; any valid address will do
+DESTINATION = "5GrwvaEF5zXb26Fz9rcQpDWS57CtERHpNehXCPcNoHGKutQY"
+STARTUP_TIMEOUT = 60
+STAGE_TIMEOUT = 120
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, fraction):
+    # Nearest rank over sorted values
+    index = max(int(len(values) * fraction + 0.5) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def latency_summary(values):
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 0.5) * 1000,
+        "p95_ms": percentile(values, 0.95) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+        "max_ms": values[-1] * 1000,
+    }
+
+
+class Results:
+    def __init__(self):
+        self.stages = {}
+        self.failures = []
+        self.requests = 0
+
+    def record(self, stage, seconds):
+        self.stages.setdefault(stage, []).append(seconds)
+
+    def summary(self):
+        return {stage: latency_summary(values) for stage, values in self.stages.items()}
+
+
+def print_table(rows, columns):
+    # rows: {label: {column: value}}; floats get one decimal
+    width = max([len("case")] + [len(label) for label in rows])
+    print(f"{'case':<{width}}" + "".join(f"  {column:>12}" for column in columns))
+    for label, row in rows.items():
+        cells = []
+        for column in columns:
+            value = row.get(column, "")
+            cells.append(
+                f"{value:>12.1f}" if isinstance(value, float) else f"{value:>12}"
+            )
+        print(f"{label:<{width}}" + "".join(f"  {cell}" for cell in cells))
+
+
+async def arrival(future, stage, results, sent):
+    # Records how long after `sent` the bot's message reached Telegram
+    arrived = await asyncio.wait_for(future, STAGE_TIMEOUT)
+    results.record(stage, arrived - sent)
+
+
+def bench_env(state_dir, node_port=None, telegram_port=None, **extra):
+    # Points the bot and the API at the fake servers, with state in state_dir
+    env = {
+        **os.environ,
+        "TELEGRAM_API_KEY": "123456:bench",
+        # Set empty rather than unset, so a .env file can't enable webhooks
+        "TELEGRAM_WEBHOOK_URL": "",
+        "WALLET_STORE_KEY": secrets.token_hex(32),
+        "METADATA_CACHE_DIR": os.path.join(state_dir, "metadata"),
+        "BOT_STORE_PATH": os.path.join(state_dir, "bot.db"),
+        "WALLET_API_STORE_PATH": os.path.join(state_dir, "wallet_api.db"),
+        "BENCH_UNTHROTTLED": "1",
+        "PYTHONPATH": ROOT,
+    }
+    if node_port:
+        env["SUBSTRATE_URL"] = f"ws://127.0.0.1:{node_port}"
+    if telegram_port:
+        env["TELEGRAM_API_URL"] = f"http://127.0.0.1:{telegram_port}"
+    env.update(extra)
+    return env
+
+
+async def start_process(args, env, log_path):
+    log = open(log_path, "wb")
+    return await asyncio.create_subprocess_exec(
+        sys.executable, *args, cwd=ROOT, env=env, stdout=log, stderr=log
+    )
+
+
+async def start_api(port, env, log_path, app="bench.api:app"):
+    return await start_process(
+        [
+            "-m",
+            "uvicorn",
+            app,
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        env,
+        log_path,
+    )
+
+
+async def stop_processes(processes):
+    for process in processes:
+        if process.returncode is None:
+            process.terminate()
+            await process.wait()
+
+
+async def wait_until(ready, what, process, log_path):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while not await ready():
+        if process.returncode is not None or time.monotonic() > deadline:
+            raise RuntimeError(f"{what} did not start, see {log_path}")
+        await asyncio.sleep(0.1)
+
+
+async def api_ready(session):
+    try:
+        async with session.get("/metrics") as response:
+            return response.status == 200
+    except aiohttp.ClientError:
+        return False
+
+
+async def run_phase(name, flows, results, count_requests):
+    # count_requests() is how many updates or API requests have been sent
+    start = time.perf_counter()
+    requests = count_requests()
+    outcomes = await asyncio.gather(*flows, return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            results.failures.append(f"{name}: {outcome!r}")
+    return {
+        "flows": len(outcomes),
+        "completed": sum(
+            not isinstance(outcome, BaseException) for outcome in outcomes
+        ),
+        "requests": count_requests() - requests,
+        "seconds": elapsed,
+    }
+
+
+async def scrape(session, url):
+    # Prometheus text from /metrics as {sample: value}
+    async with session.get(url) as response:
+        text = await response.text()
+    return {
+        sample: float(value)
+        for sample, value in (
+            line.rsplit(" ", 1) for line in text.splitlines() if line[:1] != "#"
+        )
+    }
+
+
+async def bot_replies(telegram, session):
+    # Replies the bot has sent or dropped so far
+    metrics = await scrape(session, "/metrics")
+    return telegram.requests["sendMessage"], metrics["bot_outbox_dropped_total"]
+
+
+async def bot_drained(telegram, session, answers):
+    # Every update confirmed by a later getUpdates and every command answered
+    deadline = time.monotonic() + STAGE_TIMEOUT
+    while True:
+        if (
+            not telegram.updates
+            and sum(await bot_replies(telegram, session)) >= answers
+        ):
+            return
+        if time.monotonic() > deadline:
+            raise RuntimeError(
+                f"{len(telegram.updates)} updates unconfirmed, "
+                f"{answers - sum(await bot_replies(telegram, session))} commands "
+                "unanswered"
+            )
+        await asyncio.sleep(0.01)
+
+
+def serve_in_thread(server, port):
+    """Start a fake server's aiohttp app on its own loop in a daemon thread,
+    for benchmarks that call it through synchronous clients. Returns the loop."""
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start(port))
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return loop
@@ -0,0 +1,165 @@
+"""Instrumentation overhead microbenchmark.
+
+Times the same work bare, with the Prometheus histograms from metrics.py
+and, when OpenTelemetry is installed, with spans as well:
+
+- timed block: an empty `with Histogram.time(...)` against an empty block,
+  the fixed cost every timed handler and RPC pays
+- /start handler: the bot's send_welcome dispatched through its per-chat
+  lock, with and without the HANDLER_SECONDS timer the command decorator
+  adds (outgoing messages are discarded)
+- query RPC: a System.Account query against the fake node through
+  CachedSubstrateInterface, with and without its RPC_SECONDS timer
+
+    python -m bench.instrumentation --calls 20000 --rpc-calls 500
+
+Each mode runs --rounds times, taking turns with the others, and its
+fastest round is reported.
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+from substrateinterface import SubstrateInterface
+
+import chain
+import metrics
+from bench.fake_node import FakeNode
+from bench.harness import (
+    DESTINATION,
+    bench_env,
+    free_port,
+    print_table,
+    serve_in_thread,
+)
+
+
+def span_tracer():
+    # Spans that are recorded but never exported, the API's no-op spans
+    # without the SDK, or None without OpenTelemetry
+    try:
+        from opentelemetry.sdk.trace import TracerProvider
+    except ImportError:
+        return API_TRACER
+    return TracerProvider().get_tracer("bench")
+
+
+API_TRACER = metrics.tracer
+
+
+def per_call(func, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls
+
+
+async def handler_per_call(handler, message, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        await handler(message)
+    return (time.perf_counter() - start) / calls
+
+
+def timed_block(histogram):
+    with histogram.time("bench"):
+        pass
+
+
+def empty_block():
+    pass
+
+
+def modes(tracer):
+    # Each mode sets metrics.tracer, which Histogram.time reads per call
+    yield "bare", None
+    yield "metrics", None
+    if tracer:
+        yield "metrics + spans", tracer
+
+
+def bench(args):
+    state_dir = tempfile.mkdtemp(prefix="tg-multisig-instrumentation-")
+    os.environ.update(bench_env(state_dir))
+    chain.METADATA_CACHE_DIR = os.path.join(state_dir, "metadata")
+    # all.py shadows the builtin all() if imported by name
+    bot = importlib.import_module("all")
+    bot.outbox.send = lambda chat_id, text, **kwargs: None
+    start_handler = bot.commands["start"]
+    # in_chat_order(timed(send_welcome)) -> in_chat_order(send_welcome)
+    bare_handler = bot.in_chat_order(start_handler.__wrapped__.__wrapped__)
+    message = SimpleNamespace(chat=SimpleNamespace(id=-1, type="group"))
+
+    node = FakeNode(block_time=3600)
+    port = free_port()
+    serve_in_thread(node, port)
+    pool = chain.get_pool(f"ws://127.0.0.1:{port}", 42, "westend")
+    histogram = metrics.Histogram("bench_seconds", "Benchmark timer", "label")
+    tracer = span_tracer()
+
+    cases = {}
+    with pool.connection() as substrate:
+
+        def query(instrumented):
+            # The override adds the timer; SubstrateInterface's is the bare call
+            query = substrate.query if instrumented else SubstrateInterface.query
+            bound = () if instrumented else (substrate,)
+            return lambda: query(*bound, "System", "Account", [DESTINATION])
+
+        query(True)()
+        targets = {
+            "timed block": lambda on: per_call(
+                (lambda: timed_block(histogram)) if on else empty_block, args.calls
+            ),
+            "/start handler": lambda on: asyncio.run(
+                handler_per_call(
+                    start_handler if on else bare_handler, message, args.calls
+                )
+            ),
+            "query RPC": lambda on: per_call(query(on), args.rpc_calls),
+        }
+        for target, run in targets.items():
+            # Modes take turns within each round, so drift hits them alike
+            best = {}
+            for _ in range(args.rounds):
+                for mode, mode_tracer in modes(tracer):
+                    metrics.tracer = mode_tracer
+                    seconds = run(mode != "bare")
+                    best[mode] = min(best.get(mode, seconds), seconds)
+            for mode, seconds in best.items():
+                cases[f"{target}, {mode}"] = {
+                    "us_each": seconds * 1e6,
+                    "overhead_us": (seconds - best["bare"]) * 1e6,
+                    "overhead_pct": (seconds / best["bare"] - 1) * 100,
+                }
+        metrics.tracer = API_TRACER
+    return {"config": vars(args), "spans": tracer is not None, "cases": cases}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--calls", type=int, default=20000, help="timed blocks and handlers per round"
+    )
+    parser.add_argument("--rpc-calls", type=int, default=500, help="RPCs per round")
+    parser.add_argument("--rounds", type=int, default=5, help="rounds per case")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    result = bench(args)
+    if not result["spans"]:
+        print("OpenTelemetry is not installed, so spans are not measured")
+    print_table(result["cases"], ["us_each", "overhead_us", "overhead_pct"])
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(result, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
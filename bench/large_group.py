@@ -0,0 +1,151 @@
+"""Voting benchmark for large multisig groups.
+
+Runs the bot against the fake Telegram server and fake node. Each group
+registers all its members at once and proposes a transfer. Then every
+other member sends /yes at the same moment:
+
+    python -m bench.large_group --members 3 10 100
+
+For each group size it reports how long the concurrent votes took to
+reach the threshold, how many votes per second were applied, and the time
+until the finalized receipt.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from bench.fake_node import FakeNode
+from bench.fake_telegram import FakeTelegram
+from bench.harness import (
+    DESTINATION,
+    STAGE_TIMEOUT,
+    bench_env,
+    free_port,
+    print_table,
+    start_process,
+    stop_processes,
+    wait_until,
+)
+
+
+async def run_group(telegram, chat_id, members):
+    users = [chat_id * -1000 + member + 1 for member in range(members)]
+
+    initialized = telegram.expect(chat_id, "Group initialized!")
+    start = time.perf_counter()
+    for user in users:
+        telegram.push(chat_id, user, "/hi")
+    await asyncio.wait_for(initialized, STAGE_TIMEOUT)
+    registered = (time.perf_counter() - start) * 1000
+
+    created = telegram.expect(chat_id, "Transaction created.")
+    telegram.push(chat_id, users[0], f"/create {DESTINATION} 1000")
+    await asyncio.wait_for(created, STAGE_TIMEOUT)
+
+    reached = telegram.expect(chat_id, "Threshold has been reached")
+    finalized = telegram.expect(chat_id, "Transaction finalized in block")
+    start = time.perf_counter()
+    for user in users[1:]:
+        telegram.push(chat_id, user, "/yes")
+    voted = await asyncio.wait_for(reached, STAGE_TIMEOUT) - start
+    settled = await asyncio.wait_for(finalized, STAGE_TIMEOUT) - start
+    return {
+        "registration_ms": registered,
+        "votes": members - 1,
+        "threshold_ms": voted * 1000,
+        "votes_per_s": (members - 1) / voted,
+        "finalized_ms": settled * 1000,
+    }
+
+
+async def bench(args):
+    cases = {}
+    node = FakeNode(block_time=args.block_time)
+    node_port = free_port()
+    node_server = await node.start(node_port)
+    try:
+        for index, members in enumerate(args.members):
+            # A fresh bot per size, since the fake chat reports one member count
+            state_dir = tempfile.mkdtemp(prefix="tg-multisig-large-group-")
+            telegram = FakeTelegram(member_count=members + 1)
+            telegram_port = free_port()
+            telegram_server = await telegram.start(telegram_port)
+            env = bench_env(
+                state_dir,
+                node_port,
+                telegram_port,
+                KEY_POOL_SIZE=str(members * args.groups + 64),
+            )
+            log = os.path.join(state_dir, "bot.log")
+            bot = await start_process(["-m", "bench.bot"], env, log)
+            try:
+
+                async def polling():
+                    return telegram.requests["getUpdates"] > 0
+
+                await wait_until(polling, "The bot", bot, log)
+                results = await asyncio.gather(
+                    *(
+                        run_group(telegram, -3_000_000 - index * 1000 - group, members)
+                        for group in range(args.groups)
+                    )
+                )
+            except Exception as e:
+                raise RuntimeError(f"{members} members: {e!r}, see {log}") from e
+            finally:
+                await stop_processes([bot])
+                await telegram_server.cleanup()
+            cases[f"{members} members"] = {
+                # The slowest group's times and rate
+                key: (
+                    max(result[key] for result in results)
+                    if key.endswith("_ms")
+                    else min(result[key] for result in results)
+                )
+                for key in results[0]
+            }
+    finally:
+        await node_server.cleanup()
+    return {"config": vars(args), "cases": cases}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--members",
+        type=int,
+        nargs="+",
+        default=[3, 10, 100],
+        help="group sizes, one case each",
+    )
+    parser.add_argument(
+        "--groups", type=int, default=1, help="groups voting at once per case"
+    )
+    parser.add_argument(
+        "--block-time", type=float, default=1.0, help="seconds between fake blocks"
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    if min(args.members) < 2:
+        parser.error("--members must be at least 2")
+
+    try:
+        result = asyncio.run(bench(args))
+    except RuntimeError as e:
+        sys.exit(str(e))
+    print_table(
+        result["cases"],
+        ["registration_ms", "votes", "threshold_ms", "votes_per_s", "finalized_ms"],
+    )
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(result, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
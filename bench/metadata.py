@@ -0,0 +1,120 @@
+"""Cold and warm start benchmark for the on-disk metadata cache.
+
+Connects to a node and initializes the runtime the way a pool's first
+connection does, timing each of:
+
+- uncached: a plain SubstrateInterface, which downloads and decodes the
+  metadata every time, as before the cache
+- cold: CachedSubstrateInterface with an empty cache directory, the first
+  start on a new machine
+- warm disk: the metadata file is on disk but nothing is decoded yet, a
+  restart or a /switch_chain back to a chain seen before
+- warm memory: another connection in the same process, which reuses the
+  decoded copy
+
+    python -m bench.metadata --runs 10 --rpc-delay 0.02
+
+By default it runs against the fake node, padded with filler pallets to
+roughly the size of a relay chain's metadata (--filler-pallets). Pass --url
+to measure a real node instead.
+"""
+
+import argparse
+import json
+import shutil
+import tempfile
+import time
+
+from substrateinterface import SubstrateInterface
+
+import chain
+from bench.fake_node import FakeNode
+from bench.harness import free_port, latency_summary, print_table, serve_in_thread
+
+
+def connect(cls, url, preset):
+    start = time.perf_counter()
+    substrate = cls(url=url, ss58_format=42, type_registry_preset=preset)
+    substrate.init_runtime()
+    elapsed = time.perf_counter() - start
+    substrate.close()
+    return elapsed
+
+
+def run_case(runs, url, preset, cls, before=lambda: None):
+    times = []
+    for _ in range(runs):
+        before()
+        times.append(connect(cls, url, preset))
+    return latency_summary(times)
+
+
+def bench(args):
+    url = args.url
+    if not url:
+        port = free_port()
+        node = FakeNode(
+            block_time=3600,
+            rpc_delay=args.rpc_delay,
+            filler_pallets=args.filler_pallets,
+        )
+        serve_in_thread(node, port)
+        print(f"fake metadata: {len(node.metadata) // 2 - 1} bytes")
+        url = f"ws://127.0.0.1:{port}"
+
+    cache_dir = tempfile.mkdtemp(prefix="tg-multisig-metadata-")
+    chain.METADATA_CACHE_DIR = cache_dir
+
+    def empty_cache():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        chain.decoded_metadata.clear()
+
+    cases = {
+        "uncached": run_case(args.runs, url, args.preset, SubstrateInterface),
+        "cold": run_case(
+            args.runs, url, args.preset, chain.CachedSubstrateInterface, empty_cache
+        ),
+        "warm disk": run_case(
+            args.runs,
+            url,
+            args.preset,
+            chain.CachedSubstrateInterface,
+            chain.decoded_metadata.clear,
+        ),
+        "warm memory": run_case(
+            args.runs, url, args.preset, chain.CachedSubstrateInterface
+        ),
+    }
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    return {"config": vars(args), "cases": cases}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=10, help="connections per case")
+    parser.add_argument("--url", help="a real node to connect to instead")
+    parser.add_argument("--preset", default="westend", help="type registry preset")
+    parser.add_argument(
+        "--rpc-delay",
+        type=float,
+        default=0.02,
+        help="seconds the fake node takes to answer each RPC",
+    )
+    parser.add_argument(
+        "--filler-pallets",
+        type=int,
+        default=60,
+        help="pallets added to the fake node's metadata",
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    result = bench(args)
+    print_table(result["cases"], ["count", "p50_ms", "p95_ms", "max_ms"])
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(result, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Vote throughput and crash recovery benchmark for the group store.
+
+Fills a GroupStore with N groups the way the bot writes them (a group
+record plus an encrypted wallets record per group), then measures:
+
+- votes/s: votes recorded on random groups by concurrent handlers until
+  they are durable, with the store's group commit and, for comparison,
+  with a commit after every vote
+- recovery: reopening the database and rebuilding every group and its
+  wallets as the bot does at startup
+
+    python -m bench.recovery --groups 100000 --votes 20000
+"""
+
+import argparse
+import json
+import os
+import random
+import secrets
+import tempfile
+import threading
+import time
+
+from substrateinterface.utils.ss58 import ss58_encode
+
+from bench.harness import print_table
+from store import GroupStore, index_group, wallets_from_record
+
+CHAIN = {
+    "url": "wss://westend-rpc.polkadot.io",
+    "ss58_format": 42,
+    "type_registry_preset": "westend",
+}
+
+
+def group_record(members):
+    return {
+        "usernames": [f"member{member}" for member in range(members)],
+        "multisig_address": ss58_encode(secrets.token_bytes(32), 42),
+        "threshold": members,
+        "chain": CHAIN,
+        "pending_tx": {
+            "calls": [],
+            "call_data": "0x" + "00" * 40,
+            "call_hash": "0x" + "00" * 32,
+            "multisig_call": "0x" + "00" * 120,
+            "proposer": "member0",
+            "signed": 1,
+        },
+    }
+
+
+def wallets_record(members):
+    # Random keys stand in for generated ones; only their size matters here
+    return {
+        f"member{member}": {
+            "mnemonic": " ".join(["abandon"] * 12),
+            "seed": secrets.token_hex(32),
+            "public_key": secrets.token_hex(32),
+        }
+        for member in range(members)
+    }
+
+
+def fill(store, groups, members):
+    start = time.perf_counter()
+    for group_id in range(groups):
+        store.put("groups", group_id, group_record(members))
+        store.put("wallets", group_id, wallets_record(members), secret=True)
+        if group_id % 10000 == 9999:
+            store.flush()
+    store.flush()
+    return time.perf_counter() - start
+
+
+def vote(store, records, votes, threads, commit_each):
+    # Each thread stands in for a handler recording votes on random groups
+    def handler(count):
+        for _ in range(count):
+            group_id = random.randrange(len(records))
+            record = records[group_id]
+            record["pending_tx"]["signed"] ^= 2
+            store.put("groups", group_id, record)
+            if commit_each:
+                store.flush()
+
+    start = time.perf_counter()
+    workers = [
+        threading.Thread(target=handler, args=(votes // threads,))
+        for _ in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    # Votes only count once they are on disk
+    store.flush()
+    elapsed = time.perf_counter() - start
+    return {"votes": votes // threads * threads, "seconds": elapsed}
+
+
+def recover(path, key):
+    # What the bot does at startup: open the store, decrypt every wallet
+    # record and rebuild the groups with their indexes
+    start = time.perf_counter()
+    store = GroupStore(path, key)
+    wallets = store.load("wallets", secret=True)
+    groups = {
+        group_id: index_group(
+            {
+                **record,
+                "wallets": wallets_from_record(
+                    wallets[group_id], record["chain"]["ss58_format"]
+                ),
+            }
+        )
+        for group_id, record in store.load("groups").items()
+    }
+    return len(groups), time.perf_counter() - start
+
+
+def bench(args):
+    path = os.path.join(tempfile.mkdtemp(prefix="tg-multisig-recovery-"), "bot.db")
+    key = secrets.token_hex(32)
+    store = GroupStore(path, key)
+    filled = fill(store, args.groups, args.members)
+    records = store.load("groups")
+
+    cases = {}
+    for name, commit_each in (("group commit", False), ("commit per vote", True)):
+        votes = args.votes if not commit_each else args.votes // 10
+        result = vote(store, records, votes, args.threads, commit_each)
+        cases[name] = {
+            **result,
+            "votes_per_s": result["votes"] / result["seconds"],
+        }
+
+    recovered, seconds = recover(path, key)
+    cases["recovery"] = {"groups": recovered, "seconds": seconds}
+    return {
+        "config": vars(args),
+        "fill_seconds": filled,
+        "db_mb": os.path.getsize(path) / 1e6,
+        "cases": cases,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--groups", type=int, default=100000, help="groups stored")
+    parser.add_argument("--members", type=int, default=3, help="members per group")
+    parser.add_argument("--votes", type=int, default=20000, help="votes recorded")
+    parser.add_argument(
+        "--threads", type=int, default=8, help="handlers voting at once"
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    result = bench(args)
+    print(
+        f"filled {args.groups} groups in {result['fill_seconds']:.1f}s, "
+        f"{result['db_mb']:.1f} MB"
+    )
+    print_table(result["cases"], ["votes", "votes_per_s", "groups", "seconds"])
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(result, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""End-to-end latency benchmark for the bot and the wallet API.
+
+Runs a fake Telegram Bot API server and a fake Substrate node in this
+process, starts the bot and the wallet API against them as subprocesses,
+and drives complete multisig flows through both:
+
+    python -m bench.run --chats 20 --members 3 --groups 20
+
+Every chat registers with /hi, proposes a transfer with /create and
+approves it with /yes, which makes the bot submit it and post the receipt
+once it is finalized. Every API group goes through /init_group,
+/create_tx, /sign_tx and /confirm_tx, then polls /tx until finalized.
+Latencies are reported per stage as percentiles, with overall throughput.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from bench.fake_node import FakeNode
+from bench.fake_telegram import FakeTelegram
+from bench.harness import (
+    DESTINATION,
+    Results,
+    api_ready,
+    arrival,
+    bench_env,
+    free_port,
+    run_phase,
+    start_api,
+    start_process,
+    stop_processes,
+    wait_until,
+)
+
+TX_POLL_INTERVAL = 0.05
+
+
+async def run_chat(telegram, index, members, results):
+    chat_id = -1_000_000 - index
+    users = [index * 1000 + member + 1 for member in range(members)]
+
+    for user in users:
+        hello = telegram.expect(chat_id, f"@user{user}! You are now registered")
+        if user == users[-1]:
+            initialized = telegram.expect(chat_id, "Group initialized!")
+        sent = telegram.push(chat_id, user, "/hi")
+        await arrival(hello, "bot /hi", results, sent)
+    await arrival(initialized, "bot last /hi -> group initialized", results, sent)
+
+    created = telegram.expect(chat_id, "Transaction created.")
+    sent = telegram.push(chat_id, users[0], f"/create {DESTINATION} 1000")
+    await arrival(created, "bot /create", results, sent)
+
+    for user in users[1:-1]:
+        waiting = telegram.expect(chat_id, "more members to respond")
+        sent = telegram.push(chat_id, user, "/yes")
+        await arrival(waiting, "bot /yes", results, sent)
+
+    reached = telegram.expect(chat_id, "Threshold has been reached")
+    event = telegram.expect(chat_id, "started a multisig approval")
+    finalized = telegram.expect(chat_id, "Transaction finalized in block")
+    sent = telegram.push(chat_id, users[-1], "/yes")
+    await arrival(reached, "bot last /yes -> threshold reached", results, sent)
+    await arrival(event, "bot last /yes -> multisig event", results, sent)
+    await arrival(finalized, "bot last /yes -> finalized receipt", results, sent)
+
+
+async def call_api(session, method, url, route, results, **kwargs):
+    # Recorded by route template, so every /tx/{tx_id} poll is one stage
+    start = time.perf_counter()
+    async with session.request(method, url, **kwargs) as response:
+        body = await response.json()
+        if response.status != 200:
+            raise RuntimeError(f"{method} {url}: {response.status} {body}")
+    results.requests += 1
+    results.record(f"api {method} {route}", time.perf_counter() - start)
+    return body
+
+
+async def run_group(session, index, members, results):
+    group_id = f"bench-{index}"
+    usernames = [f"member{member}" for member in range(members)]
+
+    await call_api(
+        session,
+        "POST",
+        "/init_group",
+        "/init_group",
+        results,
+        json={"group_id": group_id, "usernames": usernames, "threshold": members},
+    )
+    await call_api(
+        session,
+        "POST",
+        "/create_tx",
+        "/create_tx",
+        results,
+        json={
+            "group_id": group_id,
+            "proposer": usernames[0],
+            "destination": DESTINATION,
+            "amount": 1000,
+        },
+    )
+    for username in usernames[1:]:
+        await call_api(
+            session,
+            "POST",
+            "/sign_tx",
+            "/sign_tx",
+            results,
+            json={"group_id": group_id, "username": username},
+        )
+
+    submitted = time.perf_counter()
+    response = await call_api(
+        session, "POST", f"/confirm_tx?group_id={group_id}", "/confirm_tx", results
+    )
+    while True:
+        record = await call_api(
+            session, "GET", f"/tx/{response['tx_id']}", "/tx/{tx_id}", results
+        )
+        if record["status"] not in ("submitted", "in_block"):
+            break
+        await asyncio.sleep(TX_POLL_INTERVAL)
+    if record["status"] != "finalized":
+        raise RuntimeError(f"Transaction {record['status']}: {record}")
+    results.record("api /confirm_tx -> finalized", time.perf_counter() - submitted)
+
+    await call_api(
+        session, "GET", f"/balance/{group_id}", "/balance/{group_id}", results
+    )
+
+
+async def bench(args):
+    state_dir = tempfile.mkdtemp(prefix="tg-multisig-bench-")
+    node = FakeNode(block_time=args.block_time)
+    telegram = FakeTelegram(member_count=args.members + 1)
+    node_port, telegram_port, api_port = free_port(), free_port(), free_port()
+    servers = [await node.start(node_port), await telegram.start(telegram_port)]
+
+    env = bench_env(
+        state_dir,
+        node_port,
+        telegram_port,
+        KEY_POOL_SIZE=str(max(64, max(args.chats, args.groups) * args.members)),
+        BENCH_UNTHROTTLED="0" if args.throttled else "1",
+    )
+    bot_log = os.path.join(state_dir, "bot.log")
+    api_log = os.path.join(state_dir, "api.log")
+    bot = await start_process(["-m", "bench.bot"], env, bot_log)
+    api = await start_api(
+        api_port,
+        {**env, "BOT_STORE_PATH": os.path.join(state_dir, "api_bot.db")},
+        api_log,
+    )
+
+    results = Results()
+    phases = {}
+    session = aiohttp.ClientSession(
+        base_url=f"http://127.0.0.1:{api_port}",
+        connector=aiohttp.TCPConnector(limit=0),
+    )
+    try:
+        if args.chats:
+
+            async def polling():
+                return telegram.requests["getUpdates"] > 0
+
+            await wait_until(polling, "The bot", bot, bot_log)
+            phases["bot"] = await run_phase(
+                "bot",
+                [
+                    run_chat(telegram, index, args.members, results)
+                    for index in range(args.chats)
+                ],
+                results,
+                lambda: telegram.pushed,
+            )
+        if args.groups:
+            await wait_until(lambda: api_ready(session), "The wallet API", api, api_log)
+            phases["api"] = await run_phase(
+                "api",
+                [
+                    run_group(session, index, args.members, results)
+                    for index in range(args.groups)
+                ],
+                results,
+                lambda: results.requests,
+            )
+    finally:
+        await session.close()
+        await stop_processes([bot, api])
+        for server in servers:
+            await server.cleanup()
+
+    return {
+        "config": vars(args),
+        "stages": results.summary(),
+        "phases": phases,
+        "chain": {"blocks": len(node.blocks) - 1, **node.stats},
+        "telegram": dict(telegram.requests),
+        "failures": results.failures,
+        "logs": {"bot": bot_log, "api": api_log},
+    }
+
+
+def report(result):
+    width = max(len(stage) for stage in result["stages"]) if result["stages"] else 5
+    print(
+        f"{'stage':<{width}}  {'count':>6}  {'p50 ms':>9}  {'p95 ms':>9}"
+        f"  {'p99 ms':>9}  {'max ms':>9}"
+    )
+    for stage, stats in result["stages"].items():
+        print(
+            f"{stage:<{width}}  {stats['count']:>6}  {stats['p50_ms']:>9.1f}"
+            f"  {stats['p95_ms']:>9.1f}  {stats['p99_ms']:>9.1f}  {stats['max_ms']:>9.1f}"
+        )
+    print()
+
+    units = {"bot": "updates", "api": "requests"}
+    for name, phase in result["phases"].items():
+        print(
+            f"{name}: {phase['completed']}/{phase['flows']} flows in "
+            f"{phase['seconds']:.2f}s, {phase['completed'] / phase['seconds']:.2f} flows/s, "
+            f"{phase['requests'] / phase['seconds']:.1f} {units[name]}/s"
+        )
+    chain = result["chain"]
+    print(
+        f"chain: {chain['blocks']} blocks, {chain['included']} extrinsics included, "
+        f"{chain['rejected']} rejected, {chain['rpc']} RPCs"
+    )
+    print(
+        "telegram: "
+        + ", ".join(
+            f"{method} {count}" for method, count in sorted(result["telegram"].items())
+        )
+    )
+    for failure in result["failures"]:
+        print(f"failed: {failure}")
+    if result["failures"]:
+        print(f"logs: {result['logs']['bot']}, {result['logs']['api']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--chats", type=int, default=20, help="bot chats to run")
+    parser.add_argument(
+        "--groups", type=int, default=20, help="wallet API groups to run"
+    )
+    parser.add_argument("--members", type=int, default=3, help="members per group")
+    parser.add_argument(
+        "--block-time", type=float, default=1.0, help="seconds between fake blocks"
+    )
+    parser.add_argument(
+        "--throttled",
+        action="store_true",
+        help="keep the bot's Telegram rate limits (20 messages a minute per chat)",
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    if args.members < 2:
+        parser.error("--members must be at least 2")
+
+    result = asyncio.run(bench(args))
+    report(result)
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(result, out, indent=2)
+    if result["failures"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
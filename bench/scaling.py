@@ -0,0 +1,139 @@
+"""Worker scaling benchmark for the sharded bot.
+
+Runs shard.py, a front process routing chats to N worker processes, against
+the fake Telegram server and fake node, and drives complete multisig flows
+through it as bench.run does: every chat registers with /hi, proposes a
+transfer with /create and approves it with /yes until the receipt is
+posted.
+
+    python -m bench.scaling --workers 1 2 4 8 --chats 40
+
+Throughput can only scale with the cores actually available; the fake
+servers and this driver share them with the bot.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+from bench.fake_node import FakeNode
+from bench.fake_telegram import FakeTelegram
+from bench.harness import (
+    Results,
+    bench_env,
+    free_port,
+    print_table,
+    run_phase,
+    start_process,
+    stop_processes,
+    wait_until,
+)
+from bench.run import run_chat
+
+
+async def run_case(node_port, workers, args):
+    state_dir = tempfile.mkdtemp(prefix="tg-multisig-scaling-")
+    telegram = FakeTelegram(member_count=args.members + 1)
+    telegram_port = free_port()
+    server = await telegram.start(telegram_port)
+    env = bench_env(
+        state_dir,
+        node_port,
+        telegram_port,
+        BOT_WORKERS=str(workers),
+        KEY_POOL_SIZE=str(max(64, args.chats * args.members // workers)),
+    )
+    log = os.path.join(state_dir, "bot.log")
+    bot = await start_process(["-m", "bench.sharded"], env, log)
+    results = Results()
+    try:
+
+        async def polling():
+            return telegram.requests["getUpdates"] > 0
+
+        await wait_until(polling, "The sharded bot", bot, log)
+        # Workers import the bot and fill their key pools after the front polls
+        await asyncio.sleep(args.warmup)
+        phase = await run_phase(
+            "bot",
+            [
+                run_chat(telegram, index, args.members, results)
+                for index in range(args.chats)
+            ],
+            results,
+            lambda: telegram.pushed,
+        )
+    finally:
+        await stop_processes([bot])
+        await server.cleanup()
+    return {
+        "flows": phase["completed"],
+        "seconds": phase["seconds"],
+        "flows_per_s": phase["completed"] / phase["seconds"],
+        "updates_per_s": phase["requests"] / phase["seconds"],
+        "failures": results.failures,
+        "log": log,
+    }
+
+
+async def bench(args):
+    node = FakeNode(block_time=args.block_time)
+    node_port = free_port()
+    server = await node.start(node_port)
+    cases = {}
+    try:
+        for workers in args.workers:
+            cases[f"{workers} workers"] = await run_case(node_port, workers, args)
+    finally:
+        await server.cleanup()
+    baseline = next(iter(cases.values()))["flows_per_s"]
+    for case in cases.values():
+        case["speedup"] = case["flows_per_s"] / baseline
+    return {"config": vars(args), "cpus": os.cpu_count(), "cases": cases}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8],
+        help="worker counts, one case each",
+    )
+    parser.add_argument("--chats", type=int, default=40, help="bot chats to run")
+    parser.add_argument("--members", type=int, default=3, help="members per group")
+    parser.add_argument(
+        "--block-time", type=float, default=1.0, help="seconds between fake blocks"
+    )
+    parser.add_argument(
+        "--warmup", type=float, default=5, help="seconds to let workers start"
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    if args.members < 2:
+        parser.error("--members must be at least 2")
+
+    result = asyncio.run(bench(args))
+    print(f"{result['cpus']} CPUs")
+    print_table(
+        result["cases"],
+        ["flows", "seconds", "flows_per_s", "updates_per_s", "speedup"],
+    )
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(result, out, indent=2)
+    failed = [case for case in result["cases"].values() if case["failures"]]
+    for case in failed:
+        for failure in case["failures"]:
+            print(f"failed: {failure}")
+        print(f"log: {case['log']}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
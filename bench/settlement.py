@@ -0,0 +1,120 @@
+"""Batched versus sequential settlement benchmark.
+
+Settles N transfers from one multisig group against the fake node in two
+ways:
+
+- sequential: one proposal per transfer, each signed, submitted and
+  finalized before the next is proposed, as with a single pending slot
+- batched: the N transfers queued as one proposal and settled as a single
+  Utility.batch_all behind one approve_as_multi
+
+and reports extrinsics, fees from the fake node's fee model and wall-clock
+time until the last one is finalized:
+
+    python -m bench.settlement --transfers 1 5 20 --block-time 0.5
+"""
+
+import argparse
+import json
+import tempfile
+import threading
+import time
+
+from substrateinterface import Keypair
+
+import chain
+from bench.fake_node import FakeNode
+from bench.harness import DESTINATION, free_port, print_table, serve_in_thread
+
+FINALIZE_TIMEOUT = 120
+
+
+def settle(node, pool, keypairs, batches):
+    # Settles each batch of calls in turn, waiting for it to be finalized
+    proposer, others = keypairs[0], keypairs[1:]
+    other_signatories = sorted(keypair.ss58_address for keypair in others)
+    fees = node.stats["fees"]
+    extrinsics = node.stats["included"]
+    start = time.perf_counter()
+    for calls in batches:
+        finalized = threading.Event()
+        records = []
+
+        def on_done(record):
+            records.append(record)
+            finalized.set()
+
+        with pool.connection() as substrate:
+            _, _, multisig_call = chain.prepare_proposal(
+                substrate, calls, len(keypairs), other_signatories
+            )
+            chain.submit_signed(pool, substrate, multisig_call, proposer, on_done)
+        if not finalized.wait(FINALIZE_TIMEOUT):
+            raise RuntimeError("Settlement was not finalized")
+        if records[0]["status"] != "finalized":
+            raise RuntimeError(f"Settlement {records[0]['status']}: {records[0]}")
+    return {
+        "extrinsics": node.stats["included"] - extrinsics,
+        "fees_planck": node.stats["fees"] - fees,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def bench(args):
+    chain.METADATA_CACHE_DIR = tempfile.mkdtemp(prefix="tg-multisig-settlement-")
+    node = FakeNode(block_time=args.block_time)
+    port = free_port()
+    serve_in_thread(node, port)
+    pool = chain.get_pool(f"ws://127.0.0.1:{port}", 42, "westend")
+    keypairs = [
+        Keypair.create_from_uri(f"//Member{member}") for member in range(args.members)
+    ]
+
+    cases = {}
+    for count in args.transfers:
+        with pool.connection() as substrate:
+            calls = [
+                substrate.compose_call(
+                    call_module="Balances",
+                    call_function="transfer_allow_death",
+                    call_params={"dest": DESTINATION, "value": 1000 + number},
+                ).value
+                for number in range(count)
+            ]
+        sequential = settle(node, pool, keypairs, [[call] for call in calls])
+        batched = settle(node, pool, keypairs, [calls])
+        cases[f"{count} sequential"] = sequential
+        cases[f"{count} batched"] = batched
+        cases[f"{count} batched"]["fee_saving_pct"] = 100 * (
+            1 - batched["fees_planck"] / sequential["fees_planck"]
+        )
+    return {"config": vars(args), "cases": cases}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--transfers",
+        type=int,
+        nargs="+",
+        default=[1, 5, 20],
+        help="transfers settled per case",
+    )
+    parser.add_argument("--members", type=int, default=3, help="members per group")
+    parser.add_argument(
+        "--block-time", type=float, default=0.5, help="seconds between fake blocks"
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    result = bench(args)
+    print_table(
+        result["cases"], ["extrinsics", "fees_planck", "fee_saving_pct", "seconds"]
+    )
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(result, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
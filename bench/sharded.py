@@ -0,0 +1,9 @@
+import asyncio
+
+# Lifts the Telegram rate limits in the front and, since spawned workers
+# import this module again as their main module, in every worker too
+import bench.bot  # noqa: F401
+import shard
+
+if __name__ == "__main__":
+    asyncio.run(shard.main(shard.WORKERS))
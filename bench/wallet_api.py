@@ -0,0 +1,179 @@
+"""Load test for the wallet API with chain work on and off the event loop.
+
+Starts the wallet API against the fake node, with every RPC answered
+after --rpc-delay, in two ways:
+
+- inline: chain calls made directly from the async routes, blocking the
+  event loop, as before run_chain
+- executor: chain calls on the bounded chain executor with per-request
+  timeouts, as now
+
+then keeps --concurrency clients busy for --seconds, each sending
+GET /balance/{group_id}, which queries the chain, or GET /metrics, which
+doesn't, and reports requests/s and latency percentiles for both:
+
+    python -m bench.wallet_api --concurrency 32 --rpc-delay 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from bench.fake_node import FakeNode
+from bench.harness import (
+    Results,
+    api_ready,
+    bench_env,
+    free_port,
+    print_table,
+    start_api,
+    stop_processes,
+    wait_until,
+)
+
+
+async def client(session, group_ids, args, deadline, results):
+    while time.perf_counter() < deadline:
+        if random.random() < args.chain_fraction:
+            route, url = "/balance", f"/balance/{random.choice(group_ids)}"
+        else:
+            route, url = "/metrics", "/metrics"
+        start = time.perf_counter()
+        try:
+            async with session.get(url) as response:
+                await response.read()
+                if response.status != 200:
+                    raise RuntimeError(f"{url}: {response.status}")
+        except Exception as e:
+            results.failures.append(repr(e))
+            continue
+        results.requests += 1
+        results.record(route, time.perf_counter() - start)
+
+
+async def run_mode(node_port, inline, args):
+    state_dir = tempfile.mkdtemp(prefix="tg-multisig-wallet-api-")
+    api_port = free_port()
+    env = bench_env(
+        state_dir,
+        node_port,
+        BENCH_INLINE_CHAIN="1" if inline else "0",
+        KEY_POOL_SIZE=str(args.groups * 2),
+    )
+    log = os.path.join(state_dir, "api.log")
+    api = await start_api(api_port, env, log)
+    session = aiohttp.ClientSession(
+        base_url=f"http://127.0.0.1:{api_port}",
+        connector=aiohttp.TCPConnector(limit=0),
+    )
+    try:
+        await wait_until(lambda: api_ready(session), "The wallet API", api, log)
+        group_ids = [f"load-{index}" for index in range(args.groups)]
+        for group_id in group_ids:
+            async with session.post(
+                "/init_group",
+                json={
+                    "group_id": group_id,
+                    "usernames": ["alice", "bob"],
+                    "threshold": 2,
+                },
+            ) as response:
+                if response.status != 200:
+                    raise RuntimeError(f"/init_group: {await response.text()}")
+
+        results = Results()
+        start = time.perf_counter()
+        deadline = start + args.seconds
+        await asyncio.gather(
+            *(
+                client(session, group_ids, args, deadline, results)
+                for _ in range(args.concurrency)
+            )
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        await session.close()
+        await stop_processes([api])
+    return {
+        "requests_per_s": results.requests / elapsed,
+        "failed": len(results.failures),
+        "routes": results.summary(),
+        "errors": results.failures[:5],
+        "log": log,
+    }
+
+
+async def bench(args):
+    node = FakeNode(block_time=args.block_time, rpc_delay=args.rpc_delay)
+    node_port = free_port()
+    server = await node.start(node_port)
+    try:
+        cases = {
+            "inline": await run_mode(node_port, True, args),
+            "executor": await run_mode(node_port, False, args),
+        }
+    finally:
+        await server.cleanup()
+    return {"config": vars(args), "cases": cases}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--concurrency", type=int, default=32, help="clients sending at once"
+    )
+    parser.add_argument("--seconds", type=float, default=10, help="length of each case")
+    parser.add_argument("--groups", type=int, default=20, help="groups queried")
+    parser.add_argument(
+        "--chain-fraction",
+        type=float,
+        default=0.5,
+        help="fraction of requests that query the chain",
+    )
+    parser.add_argument(
+        "--rpc-delay",
+        type=float,
+        default=0.02,
+        help="seconds the fake node takes to answer each RPC",
+    )
+    parser.add_argument(
+        "--block-time", type=float, default=1.0, help="seconds between fake blocks"
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(bench(args))
+    rows = {}
+    for mode, case in result["cases"].items():
+        rows[mode] = {
+            "requests_per_s": case["requests_per_s"],
+            "failed": case["failed"],
+        }
+        for route, stats in case["routes"].items():
+            rows[f"{mode} {route}"] = {
+                "p50_ms": stats["p50_ms"],
+                "p99_ms": stats["p99_ms"],
+                "max_ms": stats["max_ms"],
+            }
+    print_table(rows, ["requests_per_s", "failed", "p50_ms", "p99_ms", "max_ms"])
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(result, out, indent=2)
+    failed = [case for case in result["cases"].values() if case["failed"]]
+    for case in failed:
+        for error in case["errors"]:
+            print(f"failed: {error}")
+        print(f"log: {case['log']}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
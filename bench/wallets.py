@@ -0,0 +1,121 @@
+"""Memory benchmark for compact wallets.
+
+Builds N wallets the way the bot holds them, as compact Wallet records, and
+measures the memory they take, against a Keypair object plus its mnemonic,
+which every member used to keep for the life of the process. Also measures
+the live_keypair LRU once it is full, the most that signing ever adds on
+top of the compact records.
+
+    python -m bench.wallets --wallets 1000000
+
+Building a Keypair is slow, so the old layout is measured on --sample
+wallets and scaled to N. Memory is what tracemalloc sees allocated by
+Python, including the list holding the wallets.
+"""
+
+import argparse
+import gc
+import json
+import secrets
+import time
+import tracemalloc
+
+from substrateinterface import Keypair
+
+from bench.harness import print_table
+from keys import KEYPAIR_CACHE_SIZE, Wallet, live_keypair
+
+
+def traced(build):
+    # Memory still allocated once build() returns, with its result held
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        held = build()
+        seconds = time.perf_counter() - start
+        gc.collect()
+        allocated = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return held, allocated, seconds
+
+
+def measure(count, build, scale_to=None):
+    held, allocated, seconds = traced(build)
+    del held
+    each = allocated / count
+    return {
+        "wallets": count,
+        "bytes_each": each,
+        "total_mb": each * (scale_to or count) / 1e6,
+        "seconds": seconds,
+    }
+
+
+def keypairs(count):
+    # Random seeds stand in for generated ones; deriving from a mnemonic
+    # only costs time, and the mnemonic is kept as it used to be
+    return [
+        (Keypair.create_from_seed(secrets.token_bytes(32)), Keypair.generate_mnemonic())
+        for _ in range(count)
+    ]
+
+
+def wallets(count):
+    # Public keys are stored next to the seeds, as wallets_from_record does
+    return [
+        Wallet(secrets.token_bytes(32), secrets.token_bytes(32)) for _ in range(count)
+    ]
+
+
+def fill_lru(count):
+    live_keypair.cache_clear()
+    for wallet in wallets(count):
+        wallet.keypair
+    return live_keypair
+
+
+def bench(args):
+    cases = {
+        "Keypair + mnemonic": measure(
+            args.sample,
+            lambda: keypairs(args.sample),
+            scale_to=args.wallets,
+        ),
+        "Wallet": measure(args.wallets, lambda: wallets(args.wallets)),
+    }
+    lru = measure(KEYPAIR_CACHE_SIZE, lambda: fill_lru(KEYPAIR_CACHE_SIZE))
+    live_keypair.cache_clear()
+    cases["live_keypair LRU"] = lru
+    for case in cases.values():
+        case["ratio"] = case["bytes_each"] / cases["Wallet"]["bytes_each"]
+    return {"config": vars(args), "lru_size": KEYPAIR_CACHE_SIZE, "cases": cases}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--wallets", type=int, default=1000000, help="compact wallets to build"
+    )
+    parser.add_argument(
+        "--sample", type=int, default=20000, help="full keypairs to measure"
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    result = bench(args)
+    print(
+        f"{args.wallets} wallets; Keypair measured on {args.sample} and scaled, "
+        f"LRU holds {result['lru_size']} keypairs"
+    )
+    print_table(
+        result["cases"], ["wallets", "bytes_each", "total_mb", "ratio", "seconds"]
+    )
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(result, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
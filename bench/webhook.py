@@ -0,0 +1,172 @@
+"""Webhook ingestion load test for the wallet API in webhook mode.
+
+Starts the wallet API with TELEGRAM_WEBHOOK_URL set, so it loads the bot
+and serves /telegram/webhook, against the fake Telegram server, then posts
+synthetic updates to it at fixed rates, open loop:
+
+    python -m bench.webhook --rates 100 250 500 1000 --seconds 5
+
+Most updates are group chatter the bot ignores; the rest are /start, which
+it answers. For each rate it reports the rate achieved, the webhook's
+response latency and how long /start took to be answered.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from bench.fake_telegram import FakeTelegram
+from bench.harness import (
+    Results,
+    api_ready,
+    arrival,
+    bench_env,
+    free_port,
+    latency_summary,
+    print_table,
+    start_api,
+    stop_processes,
+    wait_until,
+)
+
+CHATTER = [
+    "gm",
+    "did everyone see the proposal?",
+    "I'll approve it tonight",
+    "what's the balance now",
+]
+
+
+async def post_update(session, telegram, chat_id, user_id, text, results):
+    update = telegram.update(chat_id, user_id, text)
+    answered = (
+        telegram.expect(chat_id, "Welcome to the MultiSig Wallet Bot")
+        if text == "/start"
+        else None
+    )
+    start = time.perf_counter()
+    async with session.post("/telegram/webhook", json=update) as response:
+        if response.status != 200:
+            raise RuntimeError(f"Webhook: {response.status} {await response.text()}")
+    results.record("webhook response", time.perf_counter() - start)
+    if answered:
+        await arrival(answered, "/start answered", results, start)
+
+
+async def run_rate(session, telegram, rate, args):
+    # Updates are sent on schedule whether or not earlier ones have finished
+    results = Results()
+    posts = []
+    start = time.perf_counter()
+    for number in range(int(rate * args.seconds)):
+        delay = start + number / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        chat_id = -2_000_000 - random.randrange(args.chats)
+        text = random.choice(CHATTER) if random.random() < args.chatter else "/start"
+        posts.append(
+            asyncio.create_task(
+                post_update(session, telegram, chat_id, number % 50 + 1, text, results)
+            )
+        )
+    outcomes = await asyncio.gather(*posts, return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    failures = [repr(outcome) for outcome in outcomes if isinstance(outcome, Exception)]
+    return {
+        "offered_per_s": float(rate),
+        "achieved_per_s": (len(posts) - len(failures)) / elapsed,
+        "failed": len(failures),
+        "stages": {
+            stage: latency_summary(values) for stage, values in results.stages.items()
+        },
+        "errors": failures[:5],
+    }
+
+
+async def bench(args):
+    state_dir = tempfile.mkdtemp(prefix="tg-multisig-webhook-")
+    telegram = FakeTelegram(member_count=4)
+    telegram_port, api_port = free_port(), free_port()
+    server = await telegram.start(telegram_port)
+    env = bench_env(
+        state_dir,
+        telegram_port=telegram_port,
+        TELEGRAM_WEBHOOK_URL=f"http://127.0.0.1:{api_port}/telegram/webhook",
+    )
+    log = f"{state_dir}/api.log"
+    api = await start_api(api_port, env, log)
+
+    session = aiohttp.ClientSession(
+        base_url=f"http://127.0.0.1:{api_port}",
+        connector=aiohttp.TCPConnector(limit=0),
+    )
+    cases = {}
+    try:
+        await wait_until(lambda: api_ready(session), "The wallet API", api, log)
+        if not telegram.requests["setWebhook"]:
+            raise RuntimeError(f"The webhook was not set, see {log}")
+        for rate in args.rates:
+            cases[f"{rate}/s"] = await run_rate(session, telegram, rate, args)
+    finally:
+        await session.close()
+        await stop_processes([api])
+        await server.cleanup()
+    return {"config": vars(args), "cases": cases, "log": log}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--rates",
+        type=int,
+        nargs="+",
+        default=[100, 250, 500, 1000],
+        help="updates posted per second, one case each",
+    )
+    parser.add_argument("--seconds", type=float, default=5, help="length of each case")
+    parser.add_argument("--chats", type=int, default=200, help="chats posting")
+    parser.add_argument(
+        "--chatter",
+        type=float,
+        default=0.9,
+        help="fraction of updates that are chatter",
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(bench(args))
+    rows = {}
+    for label, case in result["cases"].items():
+        row = {
+            "offered_per_s": case["offered_per_s"],
+            "achieved_per_s": case["achieved_per_s"],
+            "failed": case["failed"],
+        }
+        for stage, column in (
+            ("webhook response", "webhook"),
+            ("/start answered", "answered"),
+        ):
+            stats = case["stages"].get(stage, {})
+            row[f"{column}_p50"] = stats.get("p50_ms", "")
+            row[f"{column}_p99"] = stats.get("p99_ms", "")
+        rows[label] = row
+    print_table(rows, list(next(iter(rows.values()))))
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(result, out, indent=2)
+    if any(case["failed"] for case in result["cases"].values()):
+        for case in result["cases"].values():
+            for error in case["errors"]:
+                print(f"failed: {error}")
+        print(f"log: {result['log']}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
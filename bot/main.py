@@ -57,9 +57,4 @@ def confirm_no(message):
         bot.reply_to(message, "No active process. Please start with /startprocess.")
 
 
-@bot.message_handler(func=lambda msg: True)
-def echo_all(message):
-    bot.reply_to(message, message.text)
-
-
-bot.infinity_polling()
+bot.infinity_polling(allowed_updates=["message"])
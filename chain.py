@@ -0,0 +1,882 @@
+import os
+import asyncio
+import contextvars
+import queue
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from hashlib import blake2b
+from scalecodec.base import ScaleBytes
+from substrateinterface import ExtrinsicReceipt, SubstrateInterface
+from substrateinterface.exceptions import SubstrateRequestException
+from substrateinterface.storage import StorageKey
+from dotenv import load_dotenv
+from websocket import WebSocketException
+from metrics import INCLUSION_SECONDS, RPC_SECONDS
+
+# Settings below are read on import, before the bot or the API loads .env
+load_dotenv()
+
+POOL_SIZE = int(os.getenv("SUBSTRATE_POOL_SIZE", "4"))
+# Chains kept connected at once; idle ones beyond this are closed
+MAX_CHAINS = int(os.getenv("SUBSTRATE_MAX_CHAINS", "8"))
+KEEPALIVE_INTERVAL = 30
+RECONNECT_ATTEMPTS = 5
+RECONNECT_BACKOFF = 0.5
+RECONNECT_BACKOFF_MAX = 8
+METADATA_CACHE_DIR = os.getenv("METADATA_CACHE_DIR", ".metadata_cache")
+# Blocks to wait for inclusion before a submitted extrinsic is reported dropped
+TX_INCLUSION_BLOCKS = 50
+TX_HISTORY = 10000
+# Blocks missed while resubscribing that are replayed; nodes prune older state
+CATCH_UP_BLOCKS = 256
+CHAIN_WORKERS = int(os.getenv("CHAIN_WORKERS", "16"))
+CHAIN_TIMEOUT = float(os.getenv("CHAIN_TIMEOUT", "30"))
+MULTISIG_MAX_WEIGHT = {"proof_size": 0, "ref_time": 1000000000}
+# The Multisig pallet's MaxSignatories on Polkadot, Kusama and Westend
+MAX_SIGNATORIES = 100
+# approve_as_multi rejects lower thresholds (MinimumThreshold), and a group
+# needs as many members
+MIN_THRESHOLD = 2
+
+# Transaction pool rejections that mean our local nonce is out of step
+NONCE_ERRORS = ("outdated", "stale", "future", "priority is too low")
+
+# Errors that mean the websocket itself is unusable, as opposed to an RPC error
+CONNECTION_ERRORS = (WebSocketException, OSError)
+
+
+# Decoded metadata shared by every connection, keyed by genesis hash and the
+# "METADATA_<spec version>" key SubstrateInterface uses for its cache_region
+decoded_metadata = {}
+
+
+class MetadataRegion:
+    """In-process store for decoded metadata with the get/set interface that
+    SubstrateInterface expects from a cache_region.
+
+    Decoded metadata builds types through the runtime configuration of the
+    connection that decoded it, so a copy is only shared once that
+    connection has registered them; until then other connections decode
+    their own.
+    """
+
+    def __init__(self, genesis_hash):
+        self.genesis_hash = genesis_hash
+        self.decoded = {}
+
+    def get(self, key):
+        return decoded_metadata.get((self.genesis_hash, key))
+
+    def set(self, key, value):
+        self.decoded[key] = value
+
+    def publish(self):
+        for key, value in self.decoded.items():
+            decoded_metadata.setdefault((self.genesis_hash, key), value)
+        self.decoded.clear()
+
+
+class CachedSubstrateInterface(SubstrateInterface):
+    """SubstrateInterface that keeps runtime metadata on disk.
+
+    Metadata is stored per genesis hash and spec version, so a restart or a
+    switch back to a known chain only downloads it again after a runtime
+    upgrade. Decoded metadata can't be pickled, so the raw SCALE bytes are
+    stored and decoded on load; connections in the same process share the
+    decoded copy through MetadataRegion.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.genesis_hash = self.get_block_hash(0)
+        self.cache_region = MetadataRegion(self.genesis_hash)
+
+    def init_runtime(self, block_hash=None, block_id=None):
+        super().init_runtime(block_hash, block_id)
+        # The type registry is set up now, so the metadata is safe to share
+        self.cache_region.publish()
+
+    def get_block_metadata(self, block_hash=None, decode=True):
+        if not decode:
+            return super().get_block_metadata(block_hash, decode=False)
+
+        # init_runtime sets runtime_version before it asks for the metadata
+        path = os.path.join(
+            METADATA_CACHE_DIR, f"{self.genesis_hash}-{self.runtime_version}.scale"
+        )
+        try:
+            with open(path, "rb") as metadata_file:
+                data = metadata_file.read()
+        except FileNotFoundError:
+            response = super().get_block_metadata(block_hash, decode=False)
+            data = bytes.fromhex(response["result"][2:])
+            os.makedirs(METADATA_CACHE_DIR, exist_ok=True)
+            # Pooled connections can download the same runtime at once, so
+            # each writes its own temp file; the last rename wins
+            fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=METADATA_CACHE_DIR)
+            try:
+                with os.fdopen(fd, "wb") as metadata_file:
+                    metadata_file.write(data)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+
+        metadata = self.runtime_config.create_scale_object(
+            "MetadataVersioned", data=ScaleBytes(bytearray(data))
+        )
+        metadata.decode()
+        return metadata
+
+    # The calls the bot and the API make, timed per method
+
+    def compose_call(self, *args, **kwargs):
+        with RPC_SECONDS.time("compose_call"):
+            return super().compose_call(*args, **kwargs)
+
+    def query(self, *args, **kwargs):
+        with RPC_SECONDS.time("query"):
+            return super().query(*args, **kwargs)
+
+    def query_multi(self, *args, **kwargs):
+        with RPC_SECONDS.time("query_multi"):
+            return super().query_multi(*args, **kwargs)
+
+    def get_account_nonce(self, *args, **kwargs):
+        with RPC_SECONDS.time("get_account_nonce"):
+            return super().get_account_nonce(*args, **kwargs)
+
+    def submit_extrinsic(self, *args, **kwargs):
+        with RPC_SECONDS.time("submit_extrinsic"):
+            return super().submit_extrinsic(*args, **kwargs)
+
+
+class SubstratePool:
+    """A bounded pool of SubstrateInterface connections to one RPC URL.
+
+    SubstrateInterface keeps a single websocket and a private message queue,
+    so it can't be shared by concurrent callers. Each operation checks out its
+    own connection with `pool.connection()` and returns it when done.
+    """
+
+    def __init__(self, url, ss58_format=42, type_registry_preset=None, size=POOL_SIZE):
+        self.url = url
+        self.ss58_format = ss58_format
+        self.type_registry_preset = type_registry_preset
+        self.key = (url, ss58_format, type_registry_preset)
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.open_count = 0
+        self.lock = threading.Lock()
+        # Signalled whenever a connection is returned or discarded, so a
+        # caller waiting on a full pool can take it or open a new one
+        self.available = threading.Condition(self.lock)
+        self.keepalive = None
+        self.closed = False
+        # System.Account results cached at the chain head they were read from,
+        # dropped by a block listener as each new block arrives
+        self.balances_block = None
+        self.balances = {}
+        self.watching_balances = False
+        self.blocks = BlockWatcher(self)
+        self.tracker = TxTracker(self)
+        self.events = EventWatcher(self)
+        self.nonces = NonceManager()
+
+    def connect(self):
+        delay = RECONNECT_BACKOFF
+        for attempt in range(RECONNECT_ATTEMPTS):
+            try:
+                return CachedSubstrateInterface(
+                    url=self.url,
+                    ss58_format=self.ss58_format,
+                    type_registry_preset=self.type_registry_preset,
+                )
+            except CONNECTION_ERRORS:
+                if attempt == RECONNECT_ATTEMPTS - 1:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_BACKOFF_MAX)
+
+    def reconnect(self, substrate):
+        delay = RECONNECT_BACKOFF
+        for attempt in range(RECONNECT_ATTEMPTS):
+            try:
+                substrate.connect_websocket()
+                return
+            except CONNECTION_ERRORS:
+                if attempt == RECONNECT_ATTEMPTS - 1:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_BACKOFF_MAX)
+
+    def acquire(self):
+        # A pool can be evicted from the registry after a caller looked it
+        # up; it is reopened rather than failing the call
+        if self.closed and get_pool(*self.key) is not self:
+            raise RuntimeError(f"Connection pool for {self.url} is closed")
+        with self.available:
+            while True:
+                try:
+                    substrate = self.idle.get_nowait()
+                    break
+                except queue.Empty:
+                    pass
+                if self.open_count < self.size:
+                    self.open_count += 1
+                    substrate = None
+                    break
+                self.available.wait()
+
+        if substrate is None:
+            try:
+                substrate = self.connect()
+            except Exception:
+                with self.available:
+                    self.open_count -= 1
+                    self.available.notify()
+                raise
+            self.start_keepalive()
+            return substrate
+
+        if not substrate.websocket or not substrate.websocket.connected:
+            try:
+                self.reconnect(substrate)
+            except Exception:
+                self.discard(substrate)
+                raise
+        return substrate
+
+    def release(self, substrate):
+        if self.closed:
+            self.discard(substrate)
+        else:
+            with self.available:
+                self.idle.put(substrate)
+                self.available.notify()
+
+    def discard(self, substrate):
+        try:
+            substrate.close()
+        except Exception:
+            pass
+        with self.available:
+            self.open_count -= 1
+            self.available.notify()
+
+    @contextmanager
+    def connection(self):
+        substrate = self.acquire()
+        try:
+            yield substrate
+        except CONNECTION_ERRORS:
+            self.discard(substrate)
+            raise
+        except BaseException:
+            self.release(substrate)
+            raise
+        else:
+            self.release(substrate)
+
+    def busy(self):
+        # Connections are checked out, or extrinsics are still being followed
+        with self.lock:
+            checked_out = self.open_count > self.idle.qsize()
+        return checked_out or self.tracker.busy() or self.events.busy()
+
+    def close(self):
+        self.closed = True
+        self.discard_idle()
+
+    def discard_idle(self):
+        while True:
+            try:
+                self.discard(self.idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def start_keepalive(self):
+        with self.lock:
+            if self.keepalive:
+                return
+            self.keepalive = threading.Thread(target=self.ping_idle, daemon=True)
+        self.keepalive.start()
+
+    def ping_idle(self):
+        while True:
+            time.sleep(KEEPALIVE_INTERVAL)
+            with self.lock:
+                # Cleared under the lock, so a pool reopened as this exits
+                # starts a new keepalive with its next connection
+                if self.closed:
+                    self.keepalive = None
+                    return
+            checked = []
+            while True:
+                try:
+                    checked.append(self.idle.get_nowait())
+                except queue.Empty:
+                    break
+
+            for substrate in checked:
+                try:
+                    substrate.rpc_request("system_health", [])
+                except CONNECTION_ERRORS:
+                    try:
+                        self.reconnect(substrate)
+                    except CONNECTION_ERRORS:
+                        self.discard(substrate)
+                        continue
+                self.release(substrate)
+
+
+class EventWatcher:
+    """Reports chain events that touch watched accounts.
+
+    Accounts are indexed by address, so each block costs one System.Events
+    query and a dict lookup per event however many accounts are watched.
+    Incoming Balances transfers and Multisig events are passed to the
+    callbacks registered for the account, on the block watcher's thread.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.accounts = {}
+        self.lock = threading.Lock()
+        self.watching = False
+
+    def watch(self, address, key, callback):
+        with self.lock:
+            self.accounts.setdefault(address, {})[key] = callback
+            start = not self.watching
+            self.watching = True
+        if start:
+            self.pool.blocks.add(self.on_block)
+
+    def unwatch(self, address, key):
+        with self.lock:
+            callbacks = self.accounts.get(address, {})
+            callbacks.pop(key, None)
+            if not callbacks:
+                self.accounts.pop(address, None)
+
+    def busy(self):
+        with self.lock:
+            return bool(self.accounts)
+
+    def on_block(self, substrate, block_hash, block_number):
+        if not self.accounts:
+            return
+
+        for record in substrate.query("System", "Events", block_hash=block_hash):
+            event = record.value["event"]
+            attributes = event["attributes"]
+            if not isinstance(attributes, dict):
+                continue
+
+            if event["module_id"] == "Balances" and event["event_id"] == "Transfer":
+                address = attributes.get("to")
+            elif event["module_id"] == "Multisig":
+                address = attributes.get("multisig")
+            else:
+                continue
+
+            with self.lock:
+                callbacks = list(self.accounts.get(address, {}).values())
+            for callback in callbacks:
+                callback({**event, "block_number": block_number})
+
+
+class NonceManager:
+    """Hands out account nonces locally so a signer can pipeline extrinsics.
+
+    The first nonce for an address comes from the node, which counts
+    transactions already in its pool. Later ones are allocated here without a
+    round trip, so several extrinsics from one signer can be in flight at
+    once. An address is resynced from the node whenever a submission fails or
+    a transaction is dropped, since either can leave a gap.
+    """
+
+    def __init__(self):
+        self.nonces = {}
+        self.lock = threading.Lock()
+
+    def next(self, substrate, address):
+        with self.lock:
+            nonce = self.nonces.get(address)
+        if nonce is None:
+            nonce = substrate.get_account_nonce(address)
+
+        with self.lock:
+            # Another thread may have synced this address while we asked
+            nonce = self.nonces.setdefault(address, nonce)
+            self.nonces[address] = nonce + 1
+        return nonce
+
+    def reset(self, address):
+        with self.lock:
+            self.nonces.pop(address, None)
+
+
+class BlockWatcher:
+    """A single new-heads subscription per pool, shared by its listeners.
+
+    Each listener is called with a connection, the block hash and the block
+    number for every new block, so the head is only fetched once no matter
+    how many parts of the app follow the chain. Blocks produced while the
+    subscription reconnects are replayed from the last one seen.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self.last_number = None
+
+    def add(self, listener):
+        with self.lock:
+            self.listeners.append(listener)
+            self.start()
+
+    def resume(self):
+        # Restarts the subscription of a pool that was closed and reopened
+        with self.lock:
+            if self.listeners:
+                self.start()
+
+    def start(self):
+        if not self.thread:
+            self.thread = threading.Thread(target=self.watch, daemon=True)
+            self.thread.start()
+
+    def watch(self):
+        # The subscription blocks its connection, so it gets its own socket
+        # rather than holding one of the pool's connections forever
+        while True:
+            with self.lock:
+                # Checked under the lock, so a pool reopened as this exits
+                # is resumed with a new thread
+                if self.pool.closed:
+                    self.thread = None
+                    return
+            substrate = None
+            try:
+                substrate = self.pool.connect()
+                substrate.subscribe_block_headers(
+                    lambda block, update_nr, subscription_id: self.on_head(
+                        substrate, block["header"]["number"]
+                    )
+                )
+            except Exception:
+                time.sleep(RECONNECT_BACKOFF)
+            finally:
+                if substrate:
+                    try:
+                        substrate.close()
+                    except Exception:
+                        pass
+
+    def on_head(self, substrate, head_number):
+        # Returning a value ends the subscription
+        first = head_number
+        if self.last_number is not None and head_number > self.last_number:
+            first = max(self.last_number + 1, head_number - CATCH_UP_BLOCKS + 1)
+        for block_number in range(first, head_number + 1):
+            if self.on_block(substrate, block_number):
+                return True
+
+    def on_block(self, substrate, block_number):
+        if self.pool.closed:
+            return True
+
+        block_hash = substrate.get_block_hash(block_number)
+        for listener in list(self.listeners):
+            try:
+                listener(substrate, block_hash, block_number)
+            except CONNECTION_ERRORS:
+                raise
+            except Exception:
+                # One listener failing must not starve the others
+                pass
+        self.last_number = block_number
+
+
+class TxTracker:
+    """Follows submitted extrinsics until they are finalized.
+
+    Submitting returns a tracking id straight away instead of holding a
+    connection open with wait_for_inclusion. The pool's block watcher
+    matches every block against the tracked extrinsic hashes and moves each
+    one through submitted -> in_block -> finalized (or dropped).
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.txs = OrderedDict()
+        self.pending = {}
+        self.included = {}
+        self.callbacks = {}
+        self.lock = threading.Lock()
+        self.watching = False
+
+    def submit(self, substrate, extrinsic, on_done=None):
+        receipt = substrate.submit_extrinsic(extrinsic, wait_for_inclusion=False)
+        tx_id = uuid.uuid4().hex
+        record = {
+            "id": tx_id,
+            "extrinsic_hash": receipt.extrinsic_hash,
+            "status": "submitted",
+            "block_hash": None,
+            "block_number": None,
+            "success": None,
+            "error": None,
+            "submitted_at": time.time(),
+        }
+
+        with self.lock:
+            self.txs[tx_id] = record
+            if len(self.txs) > TX_HISTORY:
+                self.txs.popitem(last=False)
+            self.pending[receipt.extrinsic_hash] = (tx_id, None)
+            if on_done:
+                self.callbacks[tx_id] = on_done
+            start = not self.watching
+            self.watching = True
+        if start:
+            self.pool.blocks.add(self.on_block)
+
+        return tx_id
+
+    def get(self, tx_id):
+        return self.txs.get(tx_id)
+
+    def busy(self):
+        with self.lock:
+            return bool(self.pending or self.included)
+
+    def on_block(self, substrate, block_hash, block_number):
+        with self.lock:
+            if not self.pending and not self.included:
+                return
+
+        if self.pending:
+            self.match_extrinsics(substrate, block_hash, block_number)
+        if self.included:
+            self.check_finalized(substrate)
+
+    def match_extrinsics(self, substrate, block_hash, block_number):
+        block = substrate.rpc_request("chain_getBlock", [block_hash])["result"]
+        hashes = [
+            "0x" + blake2b(bytes.fromhex(extrinsic[2:]), digest_size=32).hexdigest()
+            for extrinsic in block["block"]["extrinsics"]
+        ]
+
+        for index, extrinsic_hash in enumerate(hashes):
+            with self.lock:
+                tracked = self.pending.pop(extrinsic_hash, None)
+            if not tracked:
+                continue
+
+            receipt = ExtrinsicReceipt(
+                substrate=substrate,
+                extrinsic_hash=extrinsic_hash,
+                block_hash=block_hash,
+                block_number=block_number,
+                extrinsic_idx=index,
+            )
+            record = self.txs.get(tracked[0])
+            if not record:
+                continue
+            record.update(
+                status="in_block",
+                block_hash=block_hash,
+                block_number=block_number,
+                success=receipt.is_success,
+                error=receipt.error_message,
+            )
+            INCLUSION_SECONDS.observe(
+                self.pool.url, time.time() - record["submitted_at"]
+            )
+            with self.lock:
+                self.included[extrinsic_hash] = tracked[0]
+
+        # Anything that has waited too long without being included is dropped
+        dropped = []
+        with self.lock:
+            for extrinsic_hash, (tx_id, first_block) in list(self.pending.items()):
+                if first_block is None:
+                    self.pending[extrinsic_hash] = (tx_id, block_number)
+                elif block_number - first_block >= TX_INCLUSION_BLOCKS:
+                    del self.pending[extrinsic_hash]
+                    dropped.append(tx_id)
+        for tx_id in dropped:
+            self.finish(tx_id, "dropped")
+
+    def check_finalized(self, substrate):
+        finalized_number = substrate.get_block_number(
+            substrate.get_chain_finalised_head()
+        )
+
+        with self.lock:
+            included = list(self.included.items())
+
+        for extrinsic_hash, tx_id in included:
+            record = self.txs.get(tx_id)
+            if record and record["block_number"] > finalized_number:
+                continue
+
+            with self.lock:
+                del self.included[extrinsic_hash]
+            if not record:
+                continue
+
+            # The block was retracted by a reorg, so watch for the extrinsic again
+            canonical_hash = substrate.get_block_hash(record["block_number"])
+            if canonical_hash != record["block_hash"]:
+                record.update(status="submitted", block_hash=None, block_number=None)
+                with self.lock:
+                    self.pending[extrinsic_hash] = (tx_id, None)
+                continue
+
+            self.finish(tx_id, "finalized")
+
+    def finish(self, tx_id, status):
+        with self.lock:
+            record = self.txs.get(tx_id)
+            callback = self.callbacks.pop(tx_id, None)
+        if not record:
+            return
+        record["status"] = status
+        if callback:
+            callback(record)
+
+
+def get_balances(pool, addresses):
+    """Return balances for many accounts with a single storage query.
+
+    Results are cached per pool at the current chain head, so repeated lookups
+    within a block are answered locally without any RPC. The pool's block
+    watcher drops them as soon as the head moves on to a new block.
+    """
+    with pool.lock:
+        start = not pool.watching_balances
+        pool.watching_balances = True
+        block_hash, balances = pool.balances_block, pool.balances
+    if start:
+        pool.blocks.add(partial(reset_balances, pool))
+
+    missing = [address for address in set(addresses) if address not in balances]
+    if missing:
+        with pool.connection() as substrate:
+            if block_hash is None:
+                # No block has arrived since the cache was started or reset
+                block_hash = substrate.get_chain_head()
+                with pool.lock:
+                    if pool.balances is balances:
+                        pool.balances_block = block_hash
+            # Build the keys directly; create_storage_key re-inits the runtime
+            # (three RPCs) for every key it creates
+            substrate.init_runtime(block_hash=block_hash)
+            storage_keys = [
+                StorageKey.create_from_storage_function(
+                    "System",
+                    "Account",
+                    [address],
+                    runtime_config=substrate.runtime_config,
+                    metadata=substrate.metadata,
+                )
+                for address in missing
+            ]
+            for storage_key, account in substrate.query_multi(
+                storage_keys, block_hash=block_hash
+            ):
+                data = account["data"]
+                balances[storage_key.params[0]] = {
+                    "free": int(data["free"].value),
+                    "reserved": int(data["reserved"].value),
+                    "frozen": int(data["frozen"].value),
+                    "flags": int(data["flags"].value),
+                }
+
+    return {address: balances[address] for address in addresses}
+
+
+def reset_balances(pool, substrate, block_hash, block_number):
+    # Lookups still filling the old dict write into a detached copy
+    with pool.lock:
+        pool.balances_block = block_hash
+        pool.balances = {}
+
+
+def submit_signed(pool, substrate, call, keypair, on_done=None):
+    """Sign `call` with a locally allocated nonce and submit it for tracking.
+
+    A nonce the node rejects as stale or from the future is resynced and the
+    extrinsic signed again once. Returns the tracking id from TxTracker.
+    """
+    address = keypair.ss58_address
+
+    def done(record):
+        if record["status"] == "dropped":
+            pool.nonces.reset(address)
+        if on_done:
+            on_done(record)
+
+    for attempt in range(2):
+        nonce = pool.nonces.next(substrate, address)
+        try:
+            # Signing makes its own RPCs; if it fails the nonce is never used
+            extrinsic = substrate.create_signed_extrinsic(
+                call=call, keypair=keypair, nonce=nonce
+            )
+            return pool.tracker.submit(substrate, extrinsic, on_done=done)
+        except SubstrateRequestException as e:
+            pool.nonces.reset(address)
+            if attempt or not any(error in str(e).lower() for error in NONCE_ERRORS):
+                raise
+        except Exception:
+            pool.nonces.reset(address)
+            raise
+
+
+def prepare_proposal(substrate, calls, threshold, other_signatories):
+    """Encode a proposal and wrap it for the multisig up front.
+
+    This runs when a proposal is created, so confirming it only has to sign
+    and submit. Returns the proposal's call data and call hash as hex, and
+    the approve_as_multi call that the submitter signs.
+    """
+    if len(calls) == 1:
+        call = substrate.compose_call(
+            call_module=calls[0]["call_module"],
+            call_function=calls[0]["call_function"],
+            call_params=calls[0]["call_args"],
+        )
+    else:
+        call = substrate.compose_call(
+            call_module="Utility",
+            call_function="batch_all",
+            call_params={"calls": calls},
+        )
+
+    call_hash = blake2b(call.data.data, digest_size=32).digest()
+
+    multisig_call = substrate.compose_call(
+        call_module="Multisig",
+        call_function="approve_as_multi",
+        call_params={
+            "threshold": threshold,
+            "other_signatories": other_signatories,
+            "maybe_timepoint": None,
+            "call_hash": call_hash,
+            "store_call": True,
+            "max_weight": MULTISIG_MAX_WEIGHT,
+        },
+    )
+
+    return call.data.to_hex(), "0x" + call_hash.hex(), multisig_call
+
+
+def decode_call(substrate, call_data):
+    # Rebuilds a prepared call from its stored encoding, e.g. after a restart
+    call = substrate.create_scale_object("Call", data=ScaleBytes(call_data))
+    call.decode()
+    return call
+
+
+# Blocking chain work from async code runs here, bounded so a burst of
+# requests can't open an unbounded number of threads
+chain_executor = ThreadPoolExecutor(max_workers=CHAIN_WORKERS)
+
+
+async def run_chain(func, *args, timeout=CHAIN_TIMEOUT):
+    # A timed-out call keeps its worker until the RPC returns; the caller just
+    # stops waiting for it. The worker runs in a copy of the caller's context,
+    # so RPC spans belong to the request that made them.
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await asyncio.wait_for(
+        loop.run_in_executor(chain_executor, partial(context.run, func, *args)),
+        timeout,
+    )
+
+
+# Pools are opened on first use and shared by every group on the same chain.
+# Once more than MAX_CHAINS are open, the least recently used idle ones close.
+pools = OrderedDict()
+pools_lock = threading.Lock()
+# Evicted pools that callers still hold, so looking one up again reopens it
+# instead of starting a second pool, and nonce manager, for the same chain
+closed_pools = weakref.WeakValueDictionary()
+
+
+def get_pool(url, ss58_format=42, type_registry_preset=None):
+    key = (url, ss58_format, type_registry_preset)
+    with pools_lock:
+        pool = pools.get(key) or closed_pools.pop(key, None)
+        if pool is None:
+            pool = SubstratePool(url, ss58_format, type_registry_preset)
+        pools[key] = pool
+        pools.move_to_end(key)
+        reopened = pool.closed
+        pool.closed = False
+
+        evicted = []
+        for idle_key, idle_pool in list(pools.items())[:-1]:
+            if len(pools) <= MAX_CHAINS:
+                break
+            if not idle_pool.busy():
+                # Marked closed while the lock is held, so a caller that
+                # looked it up just before reopens it on its next acquire()
+                idle_pool.closed = True
+                closed_pools[idle_key] = pools.pop(idle_key)
+                evicted.append(idle_pool)
+
+    if reopened:
+        # No blocks were watched while it was closed
+        reset_balances(pool, None, None, None)
+        pool.blocks.resume()
+    for idle_pool in evicted:
+        idle_pool.discard_idle()
+    return pool
+
+
+def chain_ss58_format(url, type_registry_preset=None):
+    # The address format a chain advertises in its system properties
+    substrate = CachedSubstrateInterface(
+        url=url, type_registry_preset=type_registry_preset
+    )
+    try:
+        return substrate.ss58_format
+    finally:
+        substrate.close()
+
+
+# Each group has its own chain; new chats start on the default parachain
+DEFAULT_CHAIN = {
+    "url": os.getenv("SUBSTRATE_URL", "wss://westend-rpc.polkadot.io"),
+    "ss58_format": 42,
+    "type_registry_preset": "westend",
+}
+
+
+def chain_pool(chain):
+    # Resolved on every use so the registry can close pools nobody is using
+    return get_pool(**chain)
+
+
+def find_tx(tx_id):
+    with pools_lock:
+        open_pools = list(pools.values())
+    for pool in open_pools:
+        record = pool.tracker.get(tx_id)
+        if record:
+            return record
@@ -0,0 +1,99 @@
+import asyncio
+import heapq
+from collections import deque
+
+# Once this many updates are waiting to be applied, polling waits for room
+BACKLOG_LIMIT = 10000
+BACKLOG_WAIT = 0.1
+
+
+class Inbox:
+    """Incoming updates queued per chat and applied in the background.
+
+    Each chat with queued updates has one task applying them in order, so a
+    chat waiting on a slow chain call holds up only its own updates. Telegram
+    forgets an update as soon as a later getUpdates (or the webhook response)
+    confirms it, which can be long before a busy chat gets to it, so queued
+    updates are kept in the store until they have been applied. The stored
+    polling offset is the lowest update still outstanding; processes that
+    don't poll, like shard workers, pass save_offset=False.
+    """
+
+    def __init__(self, store, apply, save_offset=True):
+        self.store = store
+        self.apply = apply
+        self.save_offset = save_offset
+        self.queues = {}
+        self.drains = {}
+        self.outstanding = set()
+        # Outstanding update ids, lowest first; applied ones are skipped lazily
+        self.heap = []
+        # The next update to fetch, for when nothing is outstanding
+        self.offset = None
+        self.stats = {"queued": 0, "applied": 0, "failed": 0}
+
+    def put(self, chat_id, data, stored=False):
+        update_id = data["update_id"]
+        if update_id in self.outstanding:
+            return
+        if not stored:
+            self.store.put("updates", update_id, data)
+        self.outstanding.add(update_id)
+        heapq.heappush(self.heap, update_id)
+        self.stats["queued"] += 1
+
+        self.queues.setdefault(chat_id, deque()).append(data)
+        if chat_id not in self.drains:
+            self.drains[chat_id] = asyncio.get_running_loop().create_task(
+                self.drain(chat_id)
+            )
+
+    def stored(self):
+        # Updates confirmed to Telegram but not applied before a restart
+        backlog = self.store.load("updates")
+        return [backlog[update_id] for update_id in sorted(backlog)]
+
+    def first_outstanding(self):
+        while self.heap and self.heap[0] not in self.outstanding:
+            heapq.heappop(self.heap)
+        return self.heap[0] if self.heap else self.offset
+
+    def __len__(self):
+        return len(self.outstanding)
+
+    async def wait_for_room(self):
+        while len(self.outstanding) >= BACKLOG_LIMIT:
+            await asyncio.sleep(BACKLOG_WAIT)
+
+    async def wait_applied(self, chat_ids):
+        # Waits until these chats have applied everything queued for them
+        await asyncio.gather(
+            *(self.drains[chat_id] for chat_id in chat_ids if chat_id in self.drains)
+        )
+
+    async def drain(self, chat_id):
+        queue = self.queues[chat_id]
+        try:
+            while queue:
+                data = queue[0]
+                try:
+                    await self.apply(chat_id, data)
+                    self.stats["applied"] += 1
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    print(f"Update {data['update_id']} failed: {e!r}")
+                queue.popleft()
+                self.done(data["update_id"])
+        finally:
+            del self.drains[chat_id]
+            if not queue:
+                del self.queues[chat_id]
+
+    def done(self, update_id):
+        self.outstanding.discard(update_id)
+        self.store.delete("updates", update_id)
+        if not self.save_offset:
+            return
+        offset = self.first_outstanding()
+        if offset is not None:
+            self.store.put("polling", "offset", offset)
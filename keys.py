@@ -0,0 +1,145 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from nacl.secret import SecretBox
+from nacl.utils import random
+from sr25519 import pair_from_seed
+from substrateinterface import Keypair
+from substrateinterface.utils.ss58 import ss58_encode
+
+KEY_POOL_SIZE = int(os.getenv("KEY_POOL_SIZE", "64"))
+# Live Keypair objects kept around for signing
+KEYPAIR_CACHE_SIZE = int(os.getenv("KEYPAIR_CACHE_SIZE", "1024"))
+
+
+def generate_key(_=None):
+    # BIP39 seed derivation is deliberately slow, so this runs in a worker
+    # process; the parent rebuilds the keypair cheaply from the seed.
+    # generate_mnemonic draws from a per-thread generator that survives fork,
+    # so workers forked after the parent made a key would all repeat its
+    # next mnemonics; a new thread seeds its own from the OS
+    with ThreadPoolExecutor(max_workers=1) as thread:
+        return thread.submit(new_key).result()
+
+
+def new_key():
+    mnemonic = Keypair.generate_mnemonic()
+    keypair = Keypair.create_from_mnemonic(mnemonic)
+    return mnemonic, keypair.seed_hex.hex()
+
+
+def exit_with_parent(parent):
+    # Idle pool processes never notice their parent exiting on their own, so
+    # each one exits as soon as it has been orphaned
+    def check():
+        while os.getppid() == parent:
+            time.sleep(1)
+        os._exit(0)
+
+    threading.Thread(target=check, daemon=True).start()
+
+
+@lru_cache(maxsize=KEYPAIR_CACHE_SIZE)
+def live_keypair(seed, ss58_format):
+    return Keypair.create_from_seed(seed, ss58_format=ss58_format)
+
+
+class Wallet:
+    """A member's key held as plain bytes rather than a Keypair.
+
+    Only what lookups need stays in memory: the 32-byte seed, the public key
+    and the address. A Keypair is rebuilt from the seed when the wallet signs
+    and kept in a bounded LRU, and the mnemonic stays in the encrypted store.
+    """
+
+    __slots__ = ("seed", "public_key", "ss58_address", "ss58_format")
+
+    def __init__(self, seed, public_key=None, ss58_format=42):
+        self.seed = seed
+        self.public_key = public_key or pair_from_seed(seed)[0]
+        self.ss58_address = ss58_encode(self.public_key, ss58_format)
+        self.ss58_format = ss58_format
+
+    @property
+    def keypair(self):
+        return live_keypair(self.seed, self.ss58_format)
+
+
+class KeyPool:
+    """A bounded pool of pre-generated keypairs.
+
+    A process pool keeps the pool topped up in the background, so creating a
+    group only draws keys that already exist. Waiting keys are held encrypted
+    with a per-process key and are opened when they are drawn.
+    """
+
+    def __init__(self, size=KEY_POOL_SIZE, workers=None):
+        self.size = size
+        self.workers = workers
+        self.box = SecretBox(random(SecretBox.KEY_SIZE))
+        self.keys = deque()
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def start(self):
+        with self.lock:
+            if not self.executor:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=exit_with_parent,
+                    initargs=(os.getpid(),),
+                )
+        self.refill()
+
+    def stop(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def take(self, count, ss58_format=42):
+        # Returns the mnemonics, for the store, and the matching wallets
+        drawn = []
+        with self.lock:
+            while self.keys and len(drawn) < count:
+                drawn.append(self.keys.popleft())
+        keys = [self.open(sealed) for sealed in drawn]
+
+        # The pool ran dry, so generate the rest in parallel right now
+        if len(keys) < count:
+            self.start()
+            keys.extend(self.executor.map(generate_key, range(count - len(keys))))
+        self.refill()
+
+        mnemonics = [mnemonic for mnemonic, _ in keys]
+        wallets = [
+            Wallet(bytes.fromhex(seed), ss58_format=ss58_format) for _, seed in keys
+        ]
+        return mnemonics, wallets
+
+    def refill(self):
+        if not self.executor:
+            return
+        with self.lock:
+            needed = self.size - len(self.keys) - self.in_flight
+            self.in_flight += max(needed, 0)
+        for _ in range(needed):
+            self.executor.submit(generate_key).add_done_callback(self.add)
+
+    def add(self, future):
+        with self.lock:
+            self.in_flight -= 1
+            if not future.exception():
+                self.keys.append(self.seal(future.result()))
+
+    def seal(self, key):
+        mnemonic, seed = key
+        return self.box.encrypt(f"{mnemonic}\n{seed}".encode())
+
+    def open(self, sealed):
+        mnemonic, seed = self.box.decrypt(sealed).decode().split("\n")
+        return mnemonic, seed
@@ -0,0 +1,96 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+# Latency buckets in seconds, from a cached lookup up to a slow inclusion
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# With OpenTelemetry installed every timed block is also a span, so an update's
+# span is the parent of the chain calls it makes. The API alone is a no-op
+# until an SDK is configured.
+tracer = trace.get_tracer("tg-multisig") if trace else None
+
+
+class Histogram:
+    """A Prometheus histogram with one label, rendered in the text format.
+
+    Buckets are counted individually and only made cumulative when scraped,
+    so an observation is one bisect and two additions under a lock.
+    """
+
+    def __init__(self, name, help, label):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.series = {}
+        self.lock = threading.Lock()
+        histograms.append(self)
+
+    def observe(self, label, value):
+        index = bisect_left(BUCKETS, value)
+        with self.lock:
+            series = self.series.get(label)
+            if series is None:
+                series = self.series[label] = [0] * (len(BUCKETS) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, label):
+        span = tracer.start_as_current_span(f"{self.name} {label}") if tracer else None
+        start = time.perf_counter()
+        try:
+            with span or nullcontext():
+                yield
+        finally:
+            self.observe(label, time.perf_counter() - start)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = {label: list(counts) for label, counts in self.series.items()}
+        for label, counts in series.items():
+            labels = f'{self.label}="{label}"'
+            total = 0
+            for bound, count in zip((*BUCKETS, "+Inf"), counts):
+                total += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {total}')
+            lines.append(f"{self.name}_count{{{labels}}} {total}")
+            lines.append(f"{self.name}_sum{{{labels}}} {counts[-1]}")
+        return lines
+
+
+histograms = []
+# Functions returning {sample: value} for values that are read when scraped
+collectors = []
+
+
+def collector(func):
+    collectors.append(func)
+    return func
+
+
+def render():
+    lines = []
+    for histogram in histograms:
+        lines.extend(histogram.render())
+    for func in collectors:
+        lines.extend(f"{sample} {value}" for sample, value in func().items())
+    return "\n".join(lines) + "\n"
+
+
+HANDLER_SECONDS = Histogram(
+    "bot_handler_seconds", "Time spent handling a bot command", "command"
+)
+RPC_SECONDS = Histogram("substrate_rpc_seconds", "Substrate RPC latency", "method")
+INCLUSION_SECONDS = Histogram(
+    "substrate_inclusion_seconds",
+    "Time from submitting an extrinsic to seeing it in a block",
+    "url",
+)
@@ -0,0 +1,235 @@
+import asyncio
+import time
+from collections import deque
+from telebot.asyncio_helper import ApiTelegramException
+
+# Telegram allows roughly 20 messages a minute in a group and 30 a second overall
+CHAT_RATE = 20 / 60
+CHAT_BURST = 5
+GLOBAL_RATE = 30
+GLOBAL_BURST = 30
+# Messages queued for a single chat beyond this are dropped
+CHAT_QUEUE_LIMIT = 50
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def refill_time(self):
+        # Once full, the bucket holds nothing back and can be dropped
+        self.wait_time()
+        return (self.capacity - self.tokens) / self.rate
+
+    async def acquire(self):
+        while delay := self.wait_time():
+            await asyncio.sleep(delay)
+        self.tokens -= 1
+
+
+class Outbox:
+    """Sends bot messages through per-chat and global token buckets.
+
+    Handlers enqueue messages and return immediately; one sender task per
+    busy chat drains its queue. Status messages (such as a vote tally) are
+    keyed: an update to a status that hasn't been sent yet replaces the
+    queued text, and once sent, later updates edit the same message in
+    place. Ending a status cancels an update that hasn't been sent and
+    unpins its message. A 429 pauses the chat for the retry_after Telegram
+    asks for and the message is retried. A chat's bucket and pause are
+    dropped once its queue is empty and they no longer hold anything back.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self.buckets = {}
+        self.queues = {}
+        self.senders = {}
+        self.paused_until = {}
+        self.pending_status = {}
+        self.status_messages = {}
+        self.stats = {
+            "depth": 0,
+            "sent": 0,
+            "edited": 0,
+            "coalesced": 0,
+            "dropped": 0,
+            "retries": 0,
+            # Requests made, whatever their outcome
+            "pins": 0,
+            "unpins": 0,
+            # Every 429 Telegram answered, retried or not
+            "rate_limited": 0,
+        }
+
+    def send(self, chat_id, text, **kwargs):
+        self.enqueue(chat_id, {"text": text, "kwargs": kwargs})
+
+    def reply(self, message, text, **kwargs):
+        self.enqueue(
+            message.chat.id, {"text": text, "reply": message, "kwargs": kwargs}
+        )
+
+    def status(self, chat_id, key, text, pin=False):
+        job = self.pending_status.get(key)
+        # A job already being sent would lose the new text
+        if job and not job["sending"]:
+            job["text"] = text
+            self.stats["coalesced"] += 1
+            return
+
+        job = {"text": text, "status": key, "pin": pin, "sending": False, "kwargs": {}}
+        if self.enqueue(chat_id, job):
+            self.pending_status[key] = job
+
+    def end_status(self, key):
+        # The next status with this key starts a fresh message
+        job = self.pending_status.pop(key, None)
+        if job:
+            job["cancelled"] = True
+        message = self.status_messages.pop(key, None)
+        if message and message[2]:
+            self.enqueue(message[0], {"unpin": message[1]})
+
+    def enqueue(self, chat_id, job):
+        queue = self.queues.setdefault(chat_id, deque())
+        if len(queue) >= CHAT_QUEUE_LIMIT:
+            self.stats["dropped"] += 1
+            return False
+
+        queue.append(job)
+        self.stats["depth"] += 1
+        if chat_id not in self.senders:
+            self.senders[chat_id] = asyncio.get_running_loop().create_task(
+                self.drain(chat_id)
+            )
+        return True
+
+    async def drain(self, chat_id):
+        queue = self.queues[chat_id]
+        bucket = self.buckets.setdefault(chat_id, TokenBucket(CHAT_RATE, CHAT_BURST))
+        try:
+            while queue:
+                job = queue[0]
+                if job.get("cancelled"):
+                    queue.popleft()
+                    self.stats["depth"] -= 1
+                    continue
+
+                pause = self.paused_until.get(chat_id, 0) - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+
+                await bucket.acquire()
+                await self.global_bucket.acquire()
+
+                key = job.get("status")
+                if key:
+                    job["sending"] = True
+                try:
+                    await self.deliver(chat_id, job)
+                except ApiTelegramException as e:
+                    if e.error_code != 429:
+                        self.stats["dropped"] += 1
+                    else:
+                        retry_after = e.result_json.get("parameters", {}).get(
+                            "retry_after", 1
+                        )
+                        self.paused_until[chat_id] = time.monotonic() + retry_after
+                        self.stats["retries"] += 1
+                        self.stats["rate_limited"] += 1
+                        if key:
+                            job["sending"] = False
+                        continue
+                except Exception:
+                    self.stats["dropped"] += 1
+
+                if key and self.pending_status.get(key) is job:
+                    del self.pending_status[key]
+                queue.popleft()
+                self.stats["depth"] -= 1
+        finally:
+            del self.senders[chat_id]
+            if not queue:
+                del self.queues[chat_id]
+                self.prune(chat_id)
+
+    def prune(self, chat_id):
+        # Drops an idle chat's bucket and pause once a fresh bucket would
+        # allow no more than they do, checking back until then
+        if chat_id in self.senders or chat_id not in self.buckets:
+            return
+        wait = max(
+            self.buckets[chat_id].refill_time(),
+            self.paused_until.get(chat_id, 0) - time.monotonic(),
+        )
+        if wait > 0:
+            asyncio.get_running_loop().call_later(wait, self.prune, chat_id)
+        else:
+            del self.buckets[chat_id]
+            self.paused_until.pop(chat_id, None)
+
+    async def deliver(self, chat_id, job):
+        if "unpin" in job:
+            self.stats["unpins"] += 1
+            try:
+                await self.bot.unpin_chat_message(chat_id, job["unpin"])
+            except ApiTelegramException as e:
+                # The message may already be unpinned or deleted
+                if e.error_code == 429:
+                    raise
+            return
+
+        key = job.get("status")
+        if key and key in self.status_messages:
+            try:
+                await self.bot.edit_message_text(
+                    job["text"], chat_id, self.status_messages[key][1]
+                )
+            except ApiTelegramException as e:
+                # Editing to identical text is an error we can safely ignore
+                if "message is not modified" not in e.description:
+                    raise
+            self.stats["edited"] += 1
+            return
+
+        if job.get("reply"):
+            message = await self.bot.reply_to(
+                job["reply"], job["text"], **job["kwargs"]
+            )
+        else:
+            message = await self.bot.send_message(chat_id, job["text"], **job["kwargs"])
+        self.stats["sent"] += 1
+
+        if key:
+            pinned = False
+            if job["pin"] and not job.get("cancelled"):
+                self.stats["pins"] += 1
+                try:
+                    await self.bot.pin_chat_message(
+                        chat_id, message.message_id, disable_notification=True
+                    )
+                    pinned = True
+                except ApiTelegramException as e:
+                    # Pinning needs admin rights; the tally still works unpinned
+                    if e.error_code == 429:
+                        self.stats["rate_limited"] += 1
+            if not job.get("cancelled"):
+                self.status_messages[key] = (chat_id, message.message_id, pinned)
+            elif pinned:
+                # The status ended while this was being sent
+                self.enqueue(chat_id, {"unpin": message.message_id})
@@ -0,0 +1,321 @@
+import os
+import argparse
+import asyncio
+import multiprocessing
+import queue
+import signal
+import threading
+from bisect import bisect, insort
+from hashlib import blake2b
+
+# Workers load chat state on demand, and so does the front, which never
+# handles updates itself. This must be set before all.py is imported.
+os.environ["BOT_LAZY_STATE"] = "1"
+
+from all import inbox as chat_inbox
+from all import (
+    drop_chat,
+    held_chats,
+    key_pool,
+    outbox,
+    poll,
+    queue_stored_updates,
+    queue_updates,
+    resume_chats,
+    start_deadlines,
+    store,
+    update_chat_id,
+    wanted_update,
+)
+from outbox import GLOBAL_BURST, GLOBAL_RATE, TokenBucket
+
+WORKERS = int(os.getenv("BOT_WORKERS", "4"))
+# Points each worker owns on the hash ring; more points spread chats more evenly
+RING_REPLICAS = 64
+ACK_POLL_INTERVAL = 1
+STOP_TIMEOUT = 10
+
+
+def ring_hash(value):
+    # Python's hash() is salted per process, so the ring uses a stable hash
+    return int.from_bytes(blake2b(str(value).encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing of chat ids onto worker names.
+
+    Every worker owns RING_REPLICAS points on the ring and a chat belongs to
+    the worker owning the next point after the chat's hash, so a worker
+    joining or leaving only moves the chats on its own arcs.
+    """
+
+    def __init__(self, workers=()):
+        self.points = []
+        for worker in workers:
+            self.add(worker)
+
+    def add(self, worker):
+        for replica in range(RING_REPLICAS):
+            insort(self.points, (ring_hash(f"{worker}:{replica}"), worker))
+
+    def remove(self, worker):
+        self.points = [point for point in self.points if point[1] != worker]
+
+    def owner(self, chat_id):
+        index = bisect(self.points, (ring_hash(chat_id), ""))
+        return self.points[index % len(self.points)][1]
+
+
+def share_global_rate(workers):
+    # Telegram's global limit is per bot, so the workers split it
+    outbox.global_bucket = TokenBucket(
+        GLOBAL_RATE / len(workers), max(GLOBAL_BURST // len(workers), 1)
+    )
+
+
+async def serve(name, workers, inbox, acks):
+    loop = asyncio.get_running_loop()
+    # Key generation processes are split between the workers rather than
+    # each worker starting one per core
+    key_pool.workers = max((os.cpu_count() or 1) // len(workers), 1)
+    key_pool.start()
+    start_deadlines()
+    ring = HashRing(workers)
+    share_global_rate(workers)
+    resume_chats(lambda chat_id: ring.owner(chat_id) == name, loop)
+    # The front tracks the polling offset; workers only keep their queues
+    chat_inbox.save_offset = False
+
+    # A daemon thread feeds the inbox to the loop, so a blocked read never
+    # holds up the worker's exit
+    messages = asyncio.Queue()
+
+    def read_inbox():
+        while True:
+            loop.call_soon_threadsafe(messages.put_nowait, inbox.get())
+
+    threading.Thread(target=read_inbox, daemon=True).start()
+
+    while True:
+        seq, kind, payload = await messages.get()
+        if kind == "updates":
+            # Updates are queued per chat and stored, then acknowledged, so a
+            # slow chat holds up neither other chats nor the next poll
+            await queue_updates(payload)
+            await chat_inbox.wait_for_room()
+        elif kind == "ring":
+            # Hand over chats that moved to another worker once their queued
+            # updates are applied; the flush below makes their latest state
+            # visible to the new owner
+            ring = HashRing(payload)
+            lost = [chat_id for chat_id in held_chats() if ring.owner(chat_id) != name]
+            await chat_inbox.wait_applied(lost)
+            for chat_id in lost:
+                drop_chat(chat_id)
+            share_global_rate(payload)
+        elif kind == "resume":
+            # Sent once every worker has dropped and committed the chats it
+            # lost, so the store has their latest deadlines and the updates
+            # still waiting for them, e.g. from a worker that crashed
+            resume_chats(lambda chat_id: ring.owner(chat_id) == name, loop)
+            queue_stored_updates(lambda chat_id: ring.owner(chat_id) == name)
+        elif kind == "stop":
+            await chat_inbox.wait_applied(list(chat_inbox.queues))
+            # Give queued messages a chance to go out before exiting
+            deadline = loop.time() + STOP_TIMEOUT
+            while outbox.senders and loop.time() < deadline:
+                await asyncio.sleep(0.1)
+
+        # Nothing is acknowledged until it is committed, so the front only
+        # confirms updates to Telegram once they are durably queued
+        await loop.run_in_executor(None, store.commit)
+        acks.put((name, seq))
+        if kind == "stop":
+            # Everything is committed; the key generator processes notice
+            # the exit and stop on their own
+            key_pool.stop()
+            acks.close()
+            acks.join_thread()
+            os._exit(0)
+
+
+def run_worker(name, workers, inbox, acks):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(serve(name, workers, inbox, acks))
+
+
+class WorkerFailed(Exception):
+    pass
+
+
+class ShardRouter:
+    """Routes updates to worker processes by chat.
+
+    Each chat hashes to one worker, so its state and the order of its
+    updates stay in one process, while separate chats are handled on
+    separate cores. A worker acknowledges a batch once it is stored in the
+    worker's per-chat queues, not once it is applied. Workers are told the
+    current membership whenever it changes, apply what they have queued for
+    the chats they no longer own and drop them; the new owner loads them
+    from the store, and picks up their deadlines, multisig watches and
+    stored updates once every worker has committed. Membership only changes
+    between batches.
+    """
+
+    def __init__(self):
+        self.context = multiprocessing.get_context("spawn")
+        self.acks = self.context.Queue()
+        self.workers = {}
+        self.ring = HashRing()
+        self.next_id = 0
+        self.seq = 0
+        self.pending = []
+
+    def request(self, change):
+        # Called from signal handlers; applied before the next batch
+        self.pending.append(change)
+
+    async def route(self, updates):
+        await self.apply_pending()
+
+        while True:
+            batches = {}
+            for data in updates:
+                if wanted_update(data):
+                    owner = self.ring.owner(update_chat_id(data))
+                    batches.setdefault(owner, []).append(data)
+            try:
+                await self.call(
+                    {name: ("updates", batch) for name, batch in batches.items()}
+                )
+                return
+            except WorkerFailed:
+                # Resend the whole batch; workers that already queued their
+                # part skip it by update id, and applied updates by each
+                # chat's last_update_id
+                await asyncio.sleep(ACK_POLL_INTERVAL)
+                try:
+                    await self.replace_dead()
+                except WorkerFailed:
+                    continue
+
+    async def call(self, messages):
+        # Sends one message per worker and waits until each has acknowledged
+        # it; acks left over from an earlier, failed call are ignored
+        self.seq += 1
+        for name, (kind, payload) in messages.items():
+            self.workers[name][1].put((self.seq, kind, payload))
+
+        loop = asyncio.get_running_loop()
+        waiting = set(messages)
+        while waiting:
+            try:
+                name, seq = await loop.run_in_executor(
+                    None, self.acks.get, True, ACK_POLL_INTERVAL
+                )
+            except queue.Empty:
+                if any(not self.workers[name][0].is_alive() for name in waiting):
+                    raise WorkerFailed()
+                continue
+            if seq == self.seq:
+                waiting.discard(name)
+
+    async def apply_pending(self):
+        while self.pending:
+            change = self.pending.pop(0)
+            if change == "add":
+                await self.add_worker()
+            elif change == "remove" and len(self.workers) > 1:
+                await self.remove_worker(max(self.workers, key=self.worker_id))
+        if any(not process.is_alive() for process, _ in self.workers.values()):
+            await self.replace_dead()
+
+    def worker_id(self, name):
+        return int(name.rsplit("-", 1)[1])
+
+    def start_worker(self):
+        name = f"worker-{self.next_id}"
+        self.next_id += 1
+        inbox = self.context.Queue()
+        process = self.context.Process(
+            target=run_worker,
+            args=(name, sorted([*self.workers, name]), inbox, self.acks),
+            name=name,
+        )
+        process.start()
+        self.workers[name] = (process, inbox)
+        self.ring.add(name)
+        return name
+
+    async def add_worker(self):
+        name = self.start_worker()
+        await self.broadcast_ring(exclude=name)
+        print(f"{name} joined, {len(self.workers)} workers")
+
+    async def remove_worker(self, name):
+        self.ring.remove(name)
+        process, inbox = self.workers[name]
+        await self.call({name: ("stop", None)})
+        process.join()
+        del self.workers[name]
+        await self.broadcast_ring()
+        print(f"{name} left, {len(self.workers)} workers")
+
+    async def replace_dead(self):
+        dead = [
+            name
+            for name, (process, _) in self.workers.items()
+            if not process.is_alive()
+        ]
+        for name in dead:
+            self.ring.remove(name)
+            del self.workers[name]
+            print(f"{name} exited unexpectedly")
+        for _ in dead:
+            self.start_worker()
+        await self.broadcast_ring()
+
+    async def broadcast_ring(self, exclude=None):
+        members = sorted(self.workers)
+        await self.call(
+            {name: ("ring", members) for name in members if name != exclude}
+        )
+        # Workers pick up the deadlines and watches of chats they gained
+        await self.call({name: ("resume", None) for name in members})
+
+    async def stop(self):
+        for name in list(self.workers):
+            process, inbox = self.workers.pop(name)
+            inbox.put((0, "stop", None))
+            process.join(STOP_TIMEOUT)
+
+
+async def main(workers):
+    router = ShardRouter()
+    for _ in range(workers):
+        router.start_worker()
+    # Updates stored but not applied before a restart go to their owners
+    await router.call({name: ("resume", None) for name in router.workers})
+
+    # SIGUSR1 adds a worker and SIGUSR2 removes one while the bot runs
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGUSR1, router.request, "add")
+    loop.add_signal_handler(signal.SIGUSR2, router.request, "remove")
+
+    try:
+        await poll(router.route)
+    finally:
+        await router.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the bot as a front process routing chats to worker processes"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=WORKERS, help="Worker processes to start"
+    )
+    args = parser.parse_args()
+
+    print(f"Bot is running with {args.workers} workers, front process {os.getpid()}")
+    asyncio.run(main(args.workers))
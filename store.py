@@ -0,0 +1,247 @@
+import atexit
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from nacl.secret import SecretBox
+from substrateinterface.utils.ss58 import ss58_decode
+from keys import Wallet
+
+# How long the writer waits for more writes to join a batch before committing
+COMMIT_INTERVAL = 0.05
+# Pause before the writer retries a failed commit, e.g. while another process
+# holds the database's write lock
+COMMIT_RETRY = 1
+
+# The batch writes are collected in, if any; see GroupStore.batch()
+current_batch = contextvars.ContextVar("current_batch", default=None)
+
+
+class Batch:
+    __slots__ = ("writes", "closed")
+
+    def __init__(self):
+        self.writes = {}
+        self.closed = False
+
+
+class GroupStore:
+    """SQLite-backed store for groups, wallets and bot state.
+
+    The database runs in WAL mode. put() only queues a write; a background
+    thread commits everything queued within COMMIT_INTERVAL in one
+    transaction, so a burst of votes shares a single fsync. Later writes to
+    the same record replace earlier ones that haven't been committed yet.
+    Records written with secret=True are encrypted with WALLET_STORE_KEY.
+    delete() is queued the same way. Writes made inside batch() are queued
+    together when it exits, so they are committed in the same transaction.
+    """
+
+    def __init__(self, path, key=None):
+        key = key or os.getenv("WALLET_STORE_KEY")
+        if not key:
+            raise RuntimeError(
+                "WALLET_STORE_KEY must be set to a 32-byte hex key to store wallets"
+            )
+        self.box = SecretBox(bytes.fromhex(key))
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS records "
+            "(kind TEXT, key TEXT, data BLOB, PRIMARY KEY (kind, key))"
+        )
+        self.db.commit()
+        self.db_lock = threading.Lock()
+
+        self.writes = {}
+        self.cond = threading.Condition()
+        threading.Thread(target=self.run, daemon=True).start()
+        atexit.register(self.flush)
+
+    def put(self, kind, key, value, secret=False):
+        data = json.dumps(value).encode()
+        if secret:
+            data = self.box.encrypt(data)
+        self.queue((kind, json.dumps(key)), data)
+
+    def delete(self, kind, key):
+        # Queued as a write of None, so it replaces earlier queued writes
+        self.queue((kind, json.dumps(key)), None)
+
+    def queue(self, record, data):
+        batch = current_batch.get()
+        with self.cond:
+            if batch and not batch.closed:
+                batch.writes[record] = data
+            else:
+                self.writes[record] = data
+                self.cond.notify()
+
+    @contextmanager
+    def batch(self):
+        # Collects writes from this context and copies of it, such as
+        # run_chain's executor threads. Tasks that outlive the block write
+        # straight to the queue again.
+        batch = Batch()
+        token = current_batch.set(batch)
+        try:
+            yield
+        finally:
+            current_batch.reset(token)
+            with self.cond:
+                batch.closed = True
+                if batch.writes:
+                    self.writes.update(batch.writes)
+                    self.cond.notify()
+
+    def load(self, kind, secret=False):
+        with self.db_lock:
+            rows = self.db.execute(
+                "SELECT key, data FROM records WHERE kind = ?", (kind,)
+            ).fetchall()
+
+        records = {}
+        for key, data in rows:
+            if secret:
+                data = self.box.decrypt(data)
+            records[json.loads(key)] = json.loads(data)
+        return records
+
+    def get(self, kind, key, secret=False):
+        key = json.dumps(key)
+        batch = current_batch.get()
+        with self.cond:
+            if batch and not batch.closed and (kind, key) in batch.writes:
+                writes = batch.writes
+            else:
+                writes = self.writes
+            queued = (kind, key) in writes
+            data = writes.get((kind, key))
+        if queued and data is None:
+            return None
+        if data is None:
+            with self.db_lock:
+                row = self.db.execute(
+                    "SELECT data FROM records WHERE kind = ? AND key = ?", (kind, key)
+                ).fetchone()
+            if row is None:
+                return None
+            data = row[0]
+
+        if secret:
+            data = self.box.decrypt(data)
+        return json.loads(data)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.writes:
+                    self.cond.wait()
+            # Let writes from concurrent handlers join this batch
+            time.sleep(COMMIT_INTERVAL)
+            self.commit()
+
+    def commit(self):
+        # Flushes until the writes are committed, e.g. for a caller that must
+        # not go on before they are. Blocks, so coroutines run it in an executor
+        while True:
+            try:
+                return self.flush()
+            except sqlite3.Error as e:
+                # The batch is queued again, so nothing is lost by waiting
+                print(f"Store commit failed, retrying: {e}")
+                time.sleep(COMMIT_RETRY)
+
+    def flush(self):
+        # db_lock is held from taking the batch until it is committed, so
+        # get() and other flushes wait for writes that are in flight rather
+        # than missing them
+        with self.db_lock:
+            with self.cond:
+                writes, self.writes = self.writes, {}
+            if not writes:
+                return
+
+            try:
+                with self.db:
+                    self.db.executemany(
+                        "INSERT OR REPLACE INTO records (kind, key, data) "
+                        "VALUES (?, ?, ?)",
+                        [
+                            (kind, key, data)
+                            for (kind, key), data in writes.items()
+                            if data is not None
+                        ],
+                    )
+                    self.db.executemany(
+                        "DELETE FROM records WHERE kind = ? AND key = ?",
+                        [
+                            (kind, key)
+                            for (kind, key), data in writes.items()
+                            if data is None
+                        ],
+                    )
+            except sqlite3.Error:
+                # Newer writes to the same records win over the failed batch
+                with self.cond:
+                    self.writes = {**writes, **self.writes}
+                raise
+
+
+# Fields of a group that only live in memory
+UNSAVED_FIELDS = ("wallets", "members", "signatories")
+
+
+def index_group(group):
+    # Derived lookups, rebuilt on load rather than stored: each member's bit
+    # in a proposal's tally, and the signatory addresses in the order the
+    # Multisig pallet expects, sorted by account id. Sorting the addresses
+    # themselves only agrees with that for some SS58 formats
+    group["members"] = {
+        username: index for index, username in enumerate(group["usernames"])
+    }
+    group["signatories"] = [
+        wallet.ss58_address
+        for wallet in sorted(
+            group["wallets"].values(), key=lambda wallet: wallet.public_key
+        )
+    ]
+    return group
+
+
+def other_signatories(group, address):
+    # ss58_decode gives the account id as fixed-width hex, which sorts as
+    # its bytes do
+    signatories = group["signatories"]
+    index = bisect_left(signatories, ss58_decode(address), key=ss58_decode)
+    return signatories[:index] + signatories[index + 1 :]
+
+
+def wallets_to_record(wallets, mnemonics):
+    return {
+        username: {
+            "mnemonic": mnemonic,
+            "seed": wallet.seed.hex(),
+            "public_key": wallet.public_key.hex(),
+        }
+        for (username, wallet), mnemonic in zip(wallets.items(), mnemonics)
+    }
+
+
+def wallets_from_record(record, ss58_format=42):
+    # Rebuilding from the seed skips the slow BIP39 derivation on recovery, and
+    # the stored public key skips deriving that too. Mnemonics are left in the
+    # store and read from it when a member asks for theirs.
+    return {
+        username: Wallet(
+            bytes.fromhex(wallet["seed"]),
+            bytes.fromhex(wallet["public_key"]) if "public_key" in wallet else None,
+            ss58_format,
+        )
+        for username, wallet in record.items()
+    }
@@ -0,0 +1,57 @@
+import os
+import sys
+import importlib
+import tempfile
+import time
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The bot and the wallet API open their stores on import, so point them at
+# a scratch directory before any test imports them
+STATE_DIR = tempfile.mkdtemp()
+os.environ.setdefault("TELEGRAM_API_KEY", "123456:test")
+os.environ.setdefault("WALLET_STORE_KEY", "11" * 32)
+os.environ["BOT_STORE_PATH"] = os.path.join(STATE_DIR, "bot.db")
+os.environ["WALLET_API_STORE_PATH"] = os.path.join(STATE_DIR, "wallet_api.db")
+
+
+@pytest.fixture(scope="session")
+def bot():
+    # all.py shadows the builtin all() if imported by name
+    return importlib.import_module("all")
+
+
+@pytest.fixture
+def sent(bot, monkeypatch):
+    # Captures what handlers post instead of calling Telegram
+    messages = []
+    monkeypatch.setattr(
+        bot.outbox, "send", lambda chat_id, text, **kwargs: messages.append(text)
+    )
+    monkeypatch.setattr(
+        bot.outbox, "reply", lambda message, text, **kwargs: messages.append(text)
+    )
+    monkeypatch.setattr(
+        bot.outbox,
+        "status",
+        lambda chat_id, key, text, pin=False: messages.append(text),
+    )
+    monkeypatch.setattr(bot.outbox, "end_status", lambda key: None)
+    return messages
+
+
+def make_message(chat_id, user_id, text, username=None):
+    return SimpleNamespace(
+        chat=SimpleNamespace(id=chat_id, type="group"),
+        from_user=SimpleNamespace(id=user_id, username=username or f"user{user_id}"),
+        text=text,
+    )
+
+
+def set_member_count(bot, chat_id, count):
+    # Seeds the member count cache, bot included, so no Telegram call is made
+    bot.member_counts[chat_id] = (count, time.monotonic() + bot.MEMBER_COUNT_TTL)
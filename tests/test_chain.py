@@ -0,0 +1,691 @@
+import asyncio
+import queue
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from hashlib import blake2b
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import web
+from substrateinterface import ExtrinsicReceipt, Keypair
+from substrateinterface.exceptions import SubstrateRequestException
+
+import chain
+from bench import fake_node
+from bench.harness import free_port, serve_in_thread
+from chain import (
+    TX_INCLUSION_BLOCKS,
+    BlockWatcher,
+    EventWatcher,
+    NonceManager,
+    TxTracker,
+    get_balances,
+    submit_signed,
+)
+
+
+def block_hash(number):
+    return f"0x{number:064x}"
+
+
+class FakeNode:
+    """Stands in for a SubstrateInterface connection to a node that produces
+    blocks on demand and, like a real transaction pool, only accepts the next
+    nonce for each account."""
+
+    def __init__(self):
+        self.head = 0
+        self.finalized = 0
+        self.nonces = {}
+        self.pool = []
+        self.blocks = {0: []}
+        self.events = {}
+        self.nonce_queries = 0
+        self.drop_submissions = False
+        self.signing_failures = 0
+        # Like a real pool, park future nonces instead of rejecting them
+        self.queue_future = False
+        self.future = []
+        self.free = {}
+        self.balance_queries = []
+        self.runtime_config = self.metadata = None
+
+    def get_account_nonce(self, address):
+        self.nonce_queries += 1
+        return self.nonces.get(address, 0)
+
+    def create_signed_extrinsic(self, call, keypair, nonce):
+        if self.signing_failures:
+            # Signing fetches the runtime, genesis hash and era from the node
+            self.signing_failures -= 1
+            raise ConnectionError("socket closed")
+        data = f"{keypair.ss58_address}:{nonce}:{call}".encode()
+        return SimpleNamespace(address=keypair.ss58_address, nonce=nonce, data=data)
+
+    def submit_extrinsic(self, extrinsic, wait_for_inclusion=False):
+        queued = sum(1 for queued in self.pool if queued.address == extrinsic.address)
+        expected = self.nonces.get(extrinsic.address, 0) + queued
+        if extrinsic.nonce < expected:
+            raise SubstrateRequestException({"message": "Transaction is outdated"})
+        if extrinsic.nonce > expected and self.queue_future:
+            self.future.append(extrinsic)
+        elif extrinsic.nonce > expected:
+            raise SubstrateRequestException({"message": "Transaction is future"})
+        elif not self.drop_submissions:
+            self.pool.append(extrinsic)
+        digest = blake2b(extrinsic.data, digest_size=32).hexdigest()
+        return SimpleNamespace(extrinsic_hash="0x" + digest)
+
+    def produce_block(self):
+        self.head += 1
+        self.blocks[self.head] = [
+            "0x" + extrinsic.data.hex() for extrinsic in self.pool
+        ]
+        for extrinsic in self.pool:
+            self.nonces[extrinsic.address] = extrinsic.nonce + 1
+        self.pool = []
+        return block_hash(self.head), self.head
+
+    def get_block_hash(self, number):
+        return block_hash(number)
+
+    def get_block_number(self, block_hash):
+        return int(block_hash, 16)
+
+    def get_chain_finalised_head(self):
+        return block_hash(self.finalized)
+
+    def rpc_request(self, method, params):
+        assert method == "chain_getBlock"
+        number = int(params[0], 16)
+        return {"result": {"block": {"extrinsics": self.blocks[number]}}}
+
+    def query(self, module, storage, block_hash=None):
+        events = self.events.get(int(block_hash, 16), [])
+        return [SimpleNamespace(value={"event": event}) for event in events]
+
+    def get_chain_head(self):
+        return block_hash(self.head)
+
+    def init_runtime(self, block_hash=None):
+        pass
+
+    def query_multi(self, storage_keys, block_hash=None):
+        self.balance_queries.append(sorted(key.params[0] for key in storage_keys))
+        return [
+            (key, {"data": self.account_data(key.params[0])}) for key in storage_keys
+        ]
+
+    def account_data(self, address):
+        data = {
+            "free": self.free.get(address, 0),
+            "reserved": 0,
+            "frozen": 0,
+            "flags": 0,
+        }
+        return {field: SimpleNamespace(value=value) for field, value in data.items()}
+
+
+class FakeStorageKey:
+    @staticmethod
+    def create_from_storage_function(pallet, storage_function, params, **kwargs):
+        return SimpleNamespace(params=params)
+
+
+class FakeReceipt:
+    # Inclusion results would otherwise be read from the block's events
+    def __init__(self, **kwargs):
+        self.is_success = True
+        self.error_message = None
+
+
+@pytest.fixture
+def node(monkeypatch):
+    monkeypatch.setattr(chain, "ExtrinsicReceipt", FakeReceipt)
+    return FakeNode()
+
+
+@pytest.fixture
+def pool():
+    pool = SimpleNamespace(
+        url="ws://fake", closed=False, nonces=NonceManager(), listeners=[]
+    )
+    pool.blocks = SimpleNamespace(add=pool.listeners.append)
+    pool.tracker = TxTracker(pool)
+    pool.events = EventWatcher(pool)
+    return pool
+
+
+def signer(address):
+    return SimpleNamespace(ss58_address=address)
+
+
+def advance(node, pool):
+    block_hash, number = node.produce_block()
+    for listener in pool.listeners:
+        listener(node, block_hash, number)
+
+
+def test_nonces_are_allocated_locally(node, pool):
+    alice = signer("alice")
+    for call in range(3):
+        submit_signed(pool, node, call, alice)
+
+    assert [extrinsic.nonce for extrinsic in node.pool] == [0, 1, 2]
+    assert node.nonce_queries == 1
+
+
+def test_stale_nonce_is_resynced_and_resubmitted(node, pool):
+    alice = signer("alice")
+    submit_signed(pool, node, "first", alice)
+    advance(node, pool)
+    # Another client spends the next nonce behind our back
+    node.nonces["alice"] += 1
+
+    submit_signed(pool, node, "second", alice)
+
+    assert [extrinsic.nonce for extrinsic in node.pool] == [2]
+    assert node.nonce_queries == 2
+
+
+def test_failed_signing_does_not_use_up_a_nonce(node, pool):
+    alice = signer("alice")
+    node.queue_future = True
+    node.signing_failures = 1
+    with pytest.raises(ConnectionError):
+        submit_signed(pool, node, "first", alice)
+
+    submit_signed(pool, node, "second", alice)
+
+    assert [extrinsic.nonce for extrinsic in node.pool] == [0]
+    assert not node.future
+
+
+def test_tracker_follows_an_extrinsic_to_finalization(node, pool):
+    done = []
+    tx_id = submit_signed(pool, node, "call", signer("alice"), done.append)
+    assert pool.tracker.get(tx_id)["status"] == "submitted"
+
+    advance(node, pool)
+    record = pool.tracker.get(tx_id)
+    assert record["status"] == "in_block"
+    assert record["block_number"] == 1
+    assert not done
+
+    node.finalized = 1
+    advance(node, pool)
+    assert record["status"] == "finalized"
+    assert done == [record]
+    assert not pool.tracker.busy()
+
+
+def test_dropped_extrinsic_resets_the_nonce(node, pool):
+    alice = signer("alice")
+    node.drop_submissions = True
+    done = []
+    tx_id = submit_signed(pool, node, "call", alice, done.append)
+    assert pool.nonces.next(node, "alice") == 1
+
+    for _ in range(TX_INCLUSION_BLOCKS + 1):
+        advance(node, pool)
+
+    assert pool.tracker.get(tx_id)["status"] == "dropped"
+    assert [record["id"] for record in done] == [tx_id]
+    # The next nonce comes from the node again
+    assert pool.nonces.next(node, "alice") == 0
+
+
+def test_events_are_dispatched_by_account(node, pool):
+    seen = []
+    pool.events.watch("multisig", "chat", seen.append)
+    transfer = {
+        "module_id": "Balances",
+        "event_id": "Transfer",
+        "attributes": {"from": "alice", "to": "multisig", "amount": 5},
+    }
+    other = {**transfer, "attributes": {**transfer["attributes"], "to": "bob"}}
+    node.events[1] = [transfer, other]
+
+    advance(node, pool)
+    assert seen == [{**transfer, "block_number": 1}]
+
+    pool.events.unwatch("multisig", "chat")
+    assert not pool.events.busy()
+
+
+class FlakySubscriptionNode(FakeNode):
+    # Each connection reports the given heads, then loses its socket
+    def __init__(self, sessions):
+        super().__init__()
+        self.sessions = sessions
+        self.closed = False
+
+    def subscribe_block_headers(self, handler):
+        heads = self.sessions.pop(0)
+        for number in heads:
+            if handler({"header": {"number": number}}, 0, "sub"):
+                return
+        raise ConnectionError("socket closed")
+
+    def close(self):
+        self.closed = True
+
+
+def test_block_watcher_replays_blocks_missed_while_reconnecting(monkeypatch):
+    monkeypatch.setattr(chain, "RECONNECT_BACKOFF", 0)
+    connections = []
+    sessions = [[1, 2], [5, 6]]
+
+    def connect():
+        connections.append(FlakySubscriptionNode(sessions))
+        return connections[-1]
+
+    pool = SimpleNamespace(closed=False, connect=connect)
+    watcher = BlockWatcher(pool)
+    seen = []
+
+    def listener(substrate, block_hash, block_number):
+        seen.append(block_number)
+        if block_number == 6:
+            pool.closed = True
+
+    watcher.listeners.append(listener)
+    watcher.watch()
+
+    assert seen == [1, 2, 3, 4, 5, 6]
+    # Every connection is closed once its subscription ends
+    assert [connection.closed for connection in connections] == [True, True]
+
+
+class ExclusiveConnection:
+    # Fails loudly if two threads ever use the same connection at once
+    def __init__(self, **kwargs):
+        self.lock = threading.Lock()
+        self.websocket = SimpleNamespace(connected=True)
+
+    def use(self):
+        assert self.lock.acquire(blocking=False), "connection shared"
+        time.sleep(0.001)
+        self.lock.release()
+
+    def close(self):
+        pass
+
+
+def test_pool_never_shares_a_connection(monkeypatch):
+    monkeypatch.setattr(chain, "CachedSubstrateInterface", ExclusiveConnection)
+    pool = chain.SubstratePool("ws://fake", size=4)
+    pool.keepalive = True
+    failures = []
+
+    def work():
+        try:
+            for _ in range(50):
+                with pool.connection() as substrate:
+                    substrate.use()
+        except AssertionError as e:
+            failures.append(e)
+
+    threads = [threading.Thread(target=work) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not failures
+    assert pool.open_count <= 4
+
+
+def test_evicted_pool_is_reopened_by_a_caller_holding_it(monkeypatch):
+    monkeypatch.setattr(chain, "CachedSubstrateInterface", ExclusiveConnection)
+    monkeypatch.setattr(chain, "MAX_CHAINS", 1)
+    monkeypatch.setattr(chain, "pools", OrderedDict())
+    monkeypatch.setattr(chain, "closed_pools", weakref.WeakValueDictionary())
+    held = chain.get_pool("ws://a")
+    held.keepalive = True
+
+    # Looking up another chain evicts the idle one before it is used
+    chain.get_pool("ws://b").keepalive = True
+    assert held.closed
+    assert list(chain.pools) == [("ws://b", 42, None)]
+
+    with held.connection() as substrate:
+        substrate.use()
+
+    assert not held.closed
+    assert held.open_count == 1
+    assert chain.get_pool("ws://a") is held
+    assert list(chain.pools) == [("ws://a", 42, None)]
+
+
+def test_decoded_metadata_is_shared_once_the_runtime_is_ready(monkeypatch):
+    monkeypatch.setattr(chain, "decoded_metadata", {})
+    seen_while_loading = []
+
+    def init_runtime(self, block_hash=None, block_id=None):
+        # Stands in for SubstrateInterface storing what it decoded, then
+        # registering the metadata's types
+        self.cache_region.set("METADATA_1", "metadata")
+        seen_while_loading.append(self.cache_region.get("METADATA_1"))
+
+    monkeypatch.setattr(chain.SubstrateInterface, "init_runtime", init_runtime)
+    substrate = object.__new__(chain.CachedSubstrateInterface)
+    substrate.cache_region = chain.MetadataRegion("0xgenesis")
+    substrate.init_runtime()
+
+    assert seen_while_loading == [None]
+    assert chain.decoded_metadata == {("0xgenesis", "METADATA_1"): "metadata"}
+
+
+def test_concurrent_cold_starts_both_cache_the_metadata(monkeypatch, tmp_path):
+    cache_dir = tmp_path / "metadata"
+    monkeypatch.setattr(chain, "METADATA_CACHE_DIR", str(cache_dir))
+    raw = b"\x6d\x65\x74\x61"
+    monkeypatch.setattr(
+        chain.SubstrateInterface,
+        "get_block_metadata",
+        lambda self, block_hash=None, decode=True: {"result": "0x" + raw.hex()},
+    )
+    # Both connections have downloaded the runtime before either renames it
+    barrier = threading.Barrier(2, timeout=5)
+    replace = chain.os.replace
+
+    def replace_together(source, target):
+        barrier.wait()
+        replace(source, target)
+
+    monkeypatch.setattr(chain.os, "replace", replace_together)
+
+    class Metadata:
+        def __init__(self, data):
+            self.data = bytes(data.data)
+
+        def decode(self):
+            pass
+
+    def connection():
+        substrate = object.__new__(chain.CachedSubstrateInterface)
+        substrate.genesis_hash = "0xgenesis"
+        substrate.runtime_version = 1
+        substrate.runtime_config = SimpleNamespace(
+            create_scale_object=lambda type_string, data: Metadata(data)
+        )
+        return substrate
+
+    loaded = []
+    failures = []
+
+    def cold_start():
+        try:
+            loaded.append(connection().get_block_metadata().data)
+        except Exception as e:
+            failures.append(e)
+
+    threads = [threading.Thread(target=cold_start) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not failures
+    assert loaded == [raw, raw]
+    assert [path.name for path in cache_dir.iterdir()] == ["0xgenesis-1.scale"]
+    assert (cache_dir / "0xgenesis-1.scale").read_bytes() == raw
+
+
+def test_pipelined_extrinsics_land_in_one_block(node, pool):
+    alice = signer("alice")
+    tx_ids = [submit_signed(pool, node, call, alice) for call in range(3)]
+
+    advance(node, pool)
+
+    assert [pool.tracker.get(tx_id)["block_number"] for tx_id in tx_ids] == [1, 1, 1]
+    assert node.nonces["alice"] == 3
+
+
+def test_future_nonce_is_resynced_and_resubmitted(node, pool):
+    alice = signer("alice")
+    submit_signed(pool, node, "first", alice)
+    # The node lost the first extrinsic, so our next nonce is from the future
+    node.pool.clear()
+
+    submit_signed(pool, node, "second", alice)
+
+    assert [extrinsic.nonce for extrinsic in node.pool] == [0]
+
+
+@pytest.fixture
+def balances_pool(node, monkeypatch):
+    monkeypatch.setattr(chain, "StorageKey", FakeStorageKey)
+
+    @contextmanager
+    def connection():
+        pool.checkouts += 1
+        yield node
+
+    pool = SimpleNamespace(
+        connection=connection,
+        checkouts=0,
+        lock=threading.Lock(),
+        balances_block=None,
+        balances={},
+        watching_balances=False,
+        listeners=[],
+    )
+    pool.blocks = SimpleNamespace(add=pool.listeners.append)
+    return pool
+
+
+def free(balances):
+    return {address: balance["free"] for address, balance in balances.items()}
+
+
+def test_balances_are_queried_together_and_cached_per_block(node, balances_pool):
+    node.free = {"alice": 10, "bob": 20}
+
+    assert free(get_balances(balances_pool, ["alice", "bob", "alice"])) == {
+        "alice": 10,
+        "bob": 20,
+    }
+    assert node.balance_queries == [["alice", "bob"]]
+
+    assert balances_pool.checkouts == 1
+    assert len(balances_pool.listeners) == 1
+
+    # Within the block hits make no RPC and only new accounts are queried
+    get_balances(balances_pool, ["bob"])
+    assert balances_pool.checkouts == 1
+    get_balances(balances_pool, ["bob", "carol"])
+    assert node.balance_queries == [["alice", "bob"], ["carol"]]
+
+    node.free["alice"] = 15
+    advance(node, balances_pool)
+    assert free(get_balances(balances_pool, ["alice"])) == {"alice": 15}
+    assert node.balance_queries[-1] == ["alice"]
+    assert balances_pool.balances_block == block_hash(1)
+    assert len(balances_pool.listeners) == 1
+
+
+class DroppingNode(fake_node.FakeNode):
+    # The websocket fake node, able to hang up on its next request, dropping
+    # every open socket, and to refuse the next few handshakes
+    def __init__(self):
+        super().__init__(block_time=3600)
+        self.transports = []
+        self.hang_up = False
+        self.refusals = 0
+        self.refused = 0
+
+    async def handle(self, request):
+        if self.refusals:
+            self.refusals -= 1
+            self.refused += 1
+            return web.Response(status=503)
+        self.transports.append(request.transport)
+        return await super().handle(request)
+
+    async def respond(self, socket, payload):
+        if not self.hang_up:
+            return await super().respond(socket, payload)
+        # The request was sent, so only the missing answer shows the drop
+        self.hang_up = False
+        for transport in self.transports:
+            transport.close()
+        self.transports = []
+
+
+@pytest.fixture(scope="module")
+def live_node():
+    node = DroppingNode()
+    port = free_port()
+    node.loop = loop = serve_in_thread(node, port)
+    yield node, f"ws://127.0.0.1:{port}"
+
+    async def stop_producing():
+        node.producer.cancel()
+        await asyncio.gather(node.producer, return_exceptions=True)
+
+    asyncio.run_coroutine_threadsafe(stop_producing(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+
+
+@pytest.fixture
+def live_pool(live_node, monkeypatch, tmp_path):
+    monkeypatch.setattr(chain, "METADATA_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(chain, "RECONNECT_BACKOFF", 0.01)
+    node, url = live_node
+    node.hang_up = False
+    node.refusals = node.refused = 0
+    pool = chain.SubstratePool(url, 42, "westend", size=1)
+    yield pool
+    pool.close()
+
+
+def test_pool_reconnects_a_closed_socket_with_backoff(live_node, live_pool):
+    node, _ = live_node
+    live_pool.keepalive = True
+    with live_pool.connection() as substrate:
+        first = substrate.websocket
+    first.close()
+    # The node is briefly unavailable, so the first attempts fail
+    node.refusals = 2
+
+    with live_pool.connection() as substrate:
+        assert substrate.websocket is not first
+        assert substrate.get_block_hash(0)
+
+    assert node.refused == 2
+    assert live_pool.open_count == 1
+
+
+def test_pool_gives_up_after_its_reconnect_attempts(live_node, live_pool):
+    node, _ = live_node
+    live_pool.keepalive = True
+    with live_pool.connection() as substrate:
+        substrate.websocket.close()
+    node.refusals = chain.RECONNECT_ATTEMPTS
+
+    with pytest.raises(chain.CONNECTION_ERRORS):
+        live_pool.acquire()
+
+    assert node.refused == chain.RECONNECT_ATTEMPTS
+    # The dead connection was discarded, so the next caller opens a new one
+    assert live_pool.open_count == 0
+    with live_pool.connection() as substrate:
+        assert substrate.get_block_hash(0)
+
+
+def test_waiting_caller_opens_a_connection_when_the_held_one_drops(
+    live_node, live_pool
+):
+    node, _ = live_node
+    live_pool.keepalive = True
+    waiter_hashes = []
+
+    def wait_for_a_connection():
+        with live_pool.connection() as substrate:
+            waiter_hashes.append(substrate.get_block_hash(0))
+
+    with pytest.raises(chain.CONNECTION_ERRORS):
+        with live_pool.connection() as substrate:
+            waiter = threading.Thread(target=wait_for_a_connection, daemon=True)
+            waiter.start()
+            # Let the waiter block on the full pool
+            time.sleep(0.2)
+            node.hang_up = True
+            substrate.get_block_hash(0)
+
+    waiter.join(timeout=5)
+    assert not waiter.is_alive()
+    assert len(waiter_hashes) == 1
+    assert live_pool.open_count == 1
+
+
+def test_keepalive_reconnects_a_socket_the_node_dropped(
+    live_node, live_pool, monkeypatch
+):
+    node, _ = live_node
+    monkeypatch.setattr(chain, "KEEPALIVE_INTERVAL", 0.05)
+    released = queue.Queue()
+    release = live_pool.release
+
+    def recording_release(substrate):
+        released.put(substrate.websocket)
+        release(substrate)
+
+    monkeypatch.setattr(live_pool, "release", recording_release)
+    with live_pool.connection() as substrate:
+        first = substrate.websocket
+        # The next keepalive ping goes unanswered
+        node.hang_up = True
+    assert released.get(timeout=5) is first
+
+    # The keepalive returns the connection to the pool already reconnected
+    websocket = released.get(timeout=5)
+    assert websocket is not first
+    assert websocket.connected
+    with live_pool.connection() as checked_out:
+        assert checked_out is substrate
+        assert checked_out.get_block_hash(0)
+
+
+def test_node_rejects_signatories_out_of_order(live_node, live_pool):
+    node, _ = live_node
+    live_pool.keepalive = True
+    signers = sorted(
+        (Keypair.create_from_seed(bytes([seed]) * 32) for seed in range(1, 4)),
+        key=lambda keypair: keypair.public_key,
+    )
+    sender, others = signers[0], [keypair.ss58_address for keypair in signers[1:]]
+
+    async def produce():
+        # On the node's loop, between the requests it answers
+        return node.produce_block()
+
+    def approve(other_signatories):
+        with live_pool.connection() as substrate:
+            call = substrate.compose_call(
+                call_module="Multisig",
+                call_function="approve_as_multi",
+                call_params={
+                    "threshold": 2,
+                    "other_signatories": other_signatories,
+                    "maybe_timepoint": None,
+                    "call_hash": "0x" + "11" * 32,
+                    "max_weight": chain.MULTISIG_MAX_WEIGHT,
+                },
+            )
+            extrinsic = substrate.create_signed_extrinsic(call=call, keypair=sender)
+            receipt = substrate.submit_extrinsic(extrinsic)
+            block = asyncio.run_coroutine_threadsafe(produce(), node.loop).result(5)
+            return ExtrinsicReceipt(
+                substrate, receipt.extrinsic_hash, block_hash=block["hash"]
+            )
+
+    rejected = approve(others[::-1])
+    assert not rejected.is_success
+    assert rejected.error_message["name"] == "SignatoriesOutOfOrder"
+    assert approve(others).is_success
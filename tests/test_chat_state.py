@@ -0,0 +1,50 @@
+import asyncio
+import tracemalloc
+
+from conftest import make_message, set_member_count
+
+CHATS = 10_000
+FIRST_CHAT = 100_000
+
+
+def test_chats_have_independent_state(bot, sent):
+    first, second = bot.get_chat_state(5001), bot.get_chat_state(5002)
+    assert first is bot.get_chat_state(5001)
+    assert first is not second
+    assert first["lock"] is not second["lock"]
+
+
+def test_10k_chats_at_once(bot, sent):
+    chat_ids = range(FIRST_CHAT, FIRST_CHAT + CHATS)
+    for chat_id in chat_ids:
+        set_member_count(bot, chat_id, 4)
+
+    async def main():
+        # Two commands per chat, all in flight together; each chat must
+        # apply its own in order
+        await asyncio.gather(
+            *(
+                bot.commands["threshold"](make_message(chat_id, 1, f"/threshold {n}"))
+                for chat_id in chat_ids
+                for n in (2, 3)
+            )
+        )
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    try:
+        asyncio.run(main())
+        per_chat = (tracemalloc.get_traced_memory()[0] - before) / CHATS
+    finally:
+        tracemalloc.stop()
+
+    try:
+        assert all(bot.chats[chat_id]["threshold"] == 3 for chat_id in chat_ids)
+        assert len(sent) == 2 * CHATS
+        print(f"{per_chat:.0f} bytes of state per chat")
+        # Chat state, its lock, queued store writes and the metrics for it
+        assert per_chat < 8_000
+    finally:
+        for chat_id in chat_ids:
+            bot.chats.pop(chat_id, None)
+            bot.member_counts.pop(chat_id, None)
@@ -0,0 +1,99 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from substrateinterface.utils.ss58 import ss58_encode
+
+from keys import Wallet
+
+from conftest import make_message, set_member_count
+
+
+def run_command(bot, message):
+    command = bot.commands[bot.command_name(message.text)]
+    asyncio.run(asyncio.wait_for(command(message), 5))
+
+
+def test_command_runs_through_dispatch_table(bot, sent):
+    set_member_count(bot, 1001, 3)
+    run_command(bot, make_message(1001, 1, "/threshold 2"))
+
+    assert bot.chats[1001]["threshold"] == 2
+    assert sent == ["Transactions will need 2 approvals."]
+    assert bot.HANDLER_SECONDS.series["threshold"][-1] > 0
+
+
+def test_command_aliases_share_a_handler(bot):
+    assert bot.commands["start"] is bot.commands["hello"]
+
+
+@pytest.fixture
+def group_on_westend(bot, monkeypatch):
+    # A group with one member, watched through a pool that talks to no node
+    events = SimpleNamespace(watch=lambda *args: None, unwatch=lambda *args: None)
+    monkeypatch.setattr(bot, "chain_pool", lambda chain: SimpleNamespace(events=events))
+    monkeypatch.setattr(bot, "check_chain", lambda chain: None)
+    wallet = Wallet(bytes(32))
+    bot.groups[1002] = bot.index_group(
+        {
+            "usernames": ["alice"],
+            "wallets": {"alice": wallet},
+            "multisig_address": ss58_encode(bytes(32), 42),
+            "threshold": 1,
+            "chain": bot.DEFAULT_CHAIN,
+            "pending_tx": None,
+        }
+    )
+    yield bot.groups[1002]
+    bot.groups.pop(1002)
+    bot.watched.pop(1002, None)
+
+
+def test_switch_chain_uses_the_chains_address_format(
+    bot, sent, group_on_westend, monkeypatch
+):
+    formats = {"ws://polkadot": 0}
+    monkeypatch.setattr(bot, "chain_ss58_format", lambda url, preset: formats[url])
+
+    run_command(bot, make_message(1002, 1, "/switch_chain ws://polkadot polkadot"))
+
+    public_key = group_on_westend["wallets"]["alice"].public_key
+    assert group_on_westend["chain"]["ss58_format"] == 0
+    assert group_on_westend["wallets"]["alice"].ss58_address == ss58_encode(
+        public_key, 0
+    )
+    assert group_on_westend["signatories"] == [ss58_encode(public_key, 0)]
+    assert group_on_westend["multisig_address"] == ss58_encode(bytes(32), 0)
+    assert bot.store.get("groups", 1002)["chain"]["ss58_format"] == 0
+    assert "SS58 format: 0" in sent[-1]
+
+
+def test_switch_chain_takes_an_explicit_address_format(bot, sent, group_on_westend):
+    run_command(bot, make_message(1002, 1, "/switch_chain ws://kusama kusama 2"))
+
+    assert group_on_westend["chain"] == {
+        "url": "ws://kusama",
+        "ss58_format": 2,
+        "type_registry_preset": "kusama",
+    }
+    assert group_on_westend["multisig_address"] == ss58_encode(bytes(32), 2)
+
+    run_command(bot, make_message(1002, 1, "/switch_chain ws://kusama kusama two"))
+    assert "optionally its SS58 address format" in sent[-1]
+
+
+def test_create_reports_bad_amounts_and_chain_errors(bot, sent, monkeypatch):
+    bot.get_chat_state(1003)["group_initialized"] = True
+
+    def create_tx(group_id, proposer, destination, amount):
+        raise ValueError("Invalid SS58 address")
+
+    monkeypatch.setattr(bot, "create_tx", create_tx)
+
+    run_command(bot, make_message(1003, 1, "/create 5Grw ten"))
+    assert sent[-1] == "Usage: /create_tx <destination> <amount>"
+
+    run_command(bot, make_message(1003, 1, "/create 5Grw 10"))
+    assert sent[-1] == "Could not create the transaction: Invalid SS58 address"
+    assert not bot.chats[1003]["active"]
+    bot.chats.pop(1003)
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from conftest import make_message
+
+
+class ImmediateLoop:
+    def call_soon_threadsafe(self, callback, *args):
+        callback(*args)
+
+
+@pytest.fixture
+def voting(bot):
+    # A two-member group where member 1 has proposed and member 2 votes last
+    state = bot.get_chat_state(6001)
+    state.update(group_initialized=True, active=True, members={"1"})
+    bot.groups[6001] = {
+        "members": {"1": 0, "2": 1},
+        "threshold": 2,
+        "pending_tx": {"calls": ["transfer"], "signed": 0b01},
+    }
+    bot.prepared_calls[6001] = object()
+    yield state
+    bot.groups.pop(6001)
+    bot.chats.pop(6001)
+
+
+def vote(bot, user_id):
+    asyncio.run(bot.commands["yes"](make_message(6001, user_id, "/yes")))
+
+
+def test_last_vote_submits_and_confirms(bot, sent, voting, monkeypatch):
+    submitted = []
+
+    def confirm_tx(chat_id, on_done):
+        submitted.append(chat_id)
+        bot.groups[chat_id]["pending_tx"] = None
+        return {"message": "Submitted transaction", "tx_id": "tx-1"}
+
+    monkeypatch.setattr(bot, "confirm_tx", confirm_tx)
+    vote(bot, 2)
+
+    assert submitted == [6001]
+    assert not voting["active"]
+    assert sent[-1].startswith("Threshold has been reached and the transaction")
+
+
+def test_failed_submission_is_reported_and_cancelled(bot, sent, voting, monkeypatch):
+    def confirm_tx(chat_id, on_done):
+        raise ConnectionError("Connection refused")
+
+    monkeypatch.setattr(bot, "confirm_tx", confirm_tx)
+    vote(bot, 2)
+
+    assert "could not be submitted: Connection refused" in sent[-1]
+    assert not any("has been confirmed" in text for text in sent)
+    # The next /create starts a new batch instead of adding to this one
+    assert bot.groups[6001]["pending_tx"] is None
+    assert 6001 not in bot.prepared_calls
+    assert not voting["active"]
+    assert voting["expires_at"] is None
+
+
+def test_rejected_confirmation_is_reported(bot, sent, voting, monkeypatch):
+    monkeypatch.setattr(
+        bot, "confirm_tx", lambda chat_id, on_done: {"error": "Group not found"}
+    )
+    vote(bot, 2)
+
+    assert "could not be submitted: Group not found" in sent[-1]
+    assert bot.groups[6001]["pending_tx"] is None
+
+
+def test_receipt_is_posted_to_the_chat(bot, sent):
+    on_done = bot.post_receipt(1001, ImmediateLoop())
+    record = {
+        "extrinsic_hash": "0xabc",
+        "block_number": 7,
+        "block_hash": "0x07",
+        "success": True,
+        "error": None,
+    }
+
+    on_done({**record, "status": "finalized"})
+    on_done({**record, "status": "failed", "success": False, "error": "BadOrigin"})
+    on_done({**record, "status": "dropped"})
+
+    assert sent == [
+        "Transaction finalized in block #7 (0x07).",
+        "Transaction failed in block #7: BadOrigin",
+        "Transaction 0xabc was dropped before inclusion.",
+    ]
@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+from timers import TimerWheel
+
+from conftest import make_message, set_member_count
+
+
+def test_registration_round_expires(bot, sent):
+    state = bot.get_chat_state(4001)
+    state["user_ids"] = ["1", "2"]
+    state["expires_at"] = time.time() - 1
+
+    asyncio.run(bot.expire_chat(4001))
+
+    assert state["user_ids"] == []
+    assert state["expires_at"] is None
+    assert "Registration expired" in sent[-1]
+    assert bot.store.get("chats", 4001)["user_ids"] == []
+
+
+def test_proposal_expires_and_frees_its_state(bot, sent):
+    state = bot.get_chat_state(4002)
+    state.update(group_initialized=True, active=True, members={"1"})
+    bot.groups[4002] = {"pending_tx": {"calls": [], "signed": 1}}
+    bot.prepared_calls[4002] = object()
+    state["expires_at"] = time.time() - 1
+
+    try:
+        asyncio.run(bot.expire_chat(4002))
+    finally:
+        group = bot.groups.pop(4002)
+
+    assert not state["active"]
+    assert state["members"] == set()
+    assert group["pending_tx"] is None
+    assert 4002 not in bot.prepared_calls
+    assert "expired" in sent[-1]
+
+
+def test_deadline_fired_early_is_rescheduled(bot, sent):
+    state = bot.get_chat_state(4003)
+    state["user_ids"] = ["1"]
+    bot.set_deadline(4003, 60)
+    # As if the wheel fired it, which takes it off the wheel
+    bot.deadlines.cancel(4003)
+
+    asyncio.run(bot.expire_chat(4003))
+
+    assert state["user_ids"] == ["1"]
+    assert sent == []
+    assert 4003 in bot.deadlines.timers
+    bot.set_deadline(4003, None)
+    assert 4003 not in bot.deadlines.timers
+
+
+def test_first_registration_starts_the_deadline(bot, sent):
+    set_member_count(bot, 4004, 3)
+    message = make_message(4004, 1, "/hi")
+
+    asyncio.run(bot.commands["hi"](message))
+
+    assert bot.chats[4004]["expires_at"] > time.time()
+    assert 4004 in bot.deadlines.timers
+    bot.set_deadline(4004, None)
+
+
+def test_registration_deadline_set_mid_tick_expires(bot, sent, monkeypatch):
+    monkeypatch.setattr(bot, "deadlines", TimerWheel(tick=0.2))
+    state = bot.get_chat_state(4005)
+
+    async def main():
+        bot.deadlines.start()
+        # Partway through a tick, so the wheel's clock is ahead of its count
+        await asyncio.sleep(0.3)
+        state["user_ids"] = ["1"]
+        bot.set_deadline(4005, 0.4)
+        for _ in range(100):
+            if not state["user_ids"]:
+                break
+            await asyncio.sleep(0.05)
+        bot.deadlines.task.cancel()
+
+    asyncio.run(main())
+
+    assert state["user_ids"] == []
+    assert state["expires_at"] is None
+    assert "Registration expired" in sent[-1]
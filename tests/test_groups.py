@@ -0,0 +1,65 @@
+import os
+
+import pytest
+from substrateinterface.utils.ss58 import ss58_decode
+
+from chain import MAX_SIGNATORIES
+from keys import Wallet
+from store import index_group, other_signatories
+
+
+@pytest.fixture(scope="module")
+def group():
+    usernames = [str(user_id) for user_id in range(MAX_SIGNATORIES)]
+    wallets = {username: Wallet(os.urandom(32)) for username in usernames}
+    return index_group({"usernames": usernames, "wallets": wallets, "threshold": 67})
+
+
+def test_members_are_indexed_in_registration_order(group):
+    assert len(group["members"]) == MAX_SIGNATORIES
+    assert [group["members"][username] for username in group["usernames"]] == list(
+        range(MAX_SIGNATORIES)
+    )
+    assert group["signatories"] == sorted(
+        (wallet.ss58_address for wallet in group["wallets"].values()),
+        key=ss58_decode,
+    )
+
+
+def test_other_signatories_leave_out_only_the_signer(group):
+    for wallet in group["wallets"].values():
+        others = other_signatories(group, wallet.ss58_address)
+        assert len(others) == MAX_SIGNATORIES - 1
+        assert wallet.ss58_address not in others
+        assert others == sorted(others, key=ss58_decode)
+
+
+def test_signatories_are_sorted_by_account_id_in_any_format():
+    # On Polkadot's format 0 address order often differs from key order
+    wallets = {
+        str(index): Wallet(bytes([index]) * 32, ss58_format=0) for index in range(20)
+    }
+    group = index_group({"usernames": list(wallets), "wallets": wallets})
+    keys = [ss58_decode(address) for address in group["signatories"]]
+
+    assert keys == sorted(keys)
+    assert group["signatories"] != sorted(group["signatories"])
+    for wallet in wallets.values():
+        others = other_signatories(group, wallet.ss58_address)
+        assert [ss58_decode(address) for address in others] == sorted(
+            set(keys) - {wallet.public_key.hex()}
+        )
+
+
+def test_votes_are_tallied_in_a_bitset(bot, group):
+    bot.groups["g100"] = {**group, "pending_tx": {"signed": 1 << 0}}
+    try:
+        for index, username in enumerate(group["usernames"][1:], start=2):
+            assert bot.sign_tx("g100", username)["signed"] == index
+
+        signed = bot.groups["g100"]["pending_tx"]["signed"]
+        assert signed == (1 << MAX_SIGNATORIES) - 1
+        assert bot.sign_tx("g100", "0") == {"error": "User already signed"}
+        assert bot.sign_tx("g100", "stranger") == {"error": "User not in group"}
+    finally:
+        del bot.groups["g100"]
@@ -0,0 +1,124 @@
+import json
+import os
+import sys
+import time
+from concurrent.futures import Future
+
+from substrateinterface import Keypair
+
+from keys import KeyPool, Wallet, generate_key, live_keypair
+from store import wallets_from_record, wallets_to_record
+
+
+def test_wallet_matches_the_keypair_from_its_mnemonic():
+    mnemonic, seed = generate_key()
+    wallet = Wallet(bytes.fromhex(seed))
+    keypair = Keypair.create_from_mnemonic(mnemonic)
+
+    assert wallet.ss58_address == keypair.ss58_address
+    assert wallet.public_key == keypair.public_key
+    assert wallet.keypair.public_key == keypair.public_key
+    # Wallets hold no per-instance dict
+    assert not hasattr(wallet, "__dict__")
+
+
+def test_live_keypairs_are_cached():
+    wallet = Wallet(os.urandom(32))
+    live_keypair.cache_clear()
+
+    assert wallet.keypair is wallet.keypair
+    assert live_keypair.cache_info().hits == 1
+
+
+def test_wallets_round_trip_through_their_record():
+    wallets = {username: Wallet(os.urandom(32)) for username in ("alice", "bob")}
+    record = wallets_to_record(wallets, ["alice words", "bob words"])
+    assert record["bob"]["mnemonic"] == "bob words"
+    # Records written before public keys were stored still load
+    del record["alice"]["public_key"]
+
+    loaded = wallets_from_record(record)
+
+    assert {name: wallet.ss58_address for name, wallet in loaded.items()} == {
+        name: wallet.ss58_address for name, wallet in wallets.items()
+    }
+
+
+def assert_valid_and_distinct(mnemonics, wallets, count):
+    assert len(mnemonics) == len(wallets) == count
+    for mnemonic, wallet in zip(mnemonics, wallets):
+        assert wallet.ss58_address == Keypair.create_from_mnemonic(mnemonic).ss58_address
+    assert len({wallet.ss58_address for wallet in wallets}) == count
+
+
+def wait_until_full(pool):
+    deadline = time.monotonic() + 60
+    while len(pool.keys) < pool.size and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert len(pool.keys) == pool.size
+    assert pool.in_flight == 0
+
+
+def test_pool_hands_out_generated_keys_and_refills():
+    pool = KeyPool(size=4, workers=2)
+    try:
+        pool.start()
+        # Every missing key is either waiting or being generated
+        assert len(pool.keys) + pool.in_flight == 4
+        wait_until_full(pool)
+
+        mnemonics, wallets = pool.take(3)
+
+        assert_valid_and_distinct(mnemonics, wallets, 3)
+        assert len(pool.keys) + pool.in_flight == 4
+        wait_until_full(pool)
+    finally:
+        pool.stop()
+
+
+def test_empty_pool_generates_keys_on_the_spot():
+    pool = KeyPool(size=2, workers=2)
+    try:
+        # Never started, so nothing is waiting
+        mnemonics, wallets = pool.take(3)
+
+        assert_valid_and_distinct(mnemonics, wallets, 3)
+        # Drawing started the pool, which now fills up behind the draw
+        wait_until_full(pool)
+        more_mnemonics, more_wallets = pool.take(2)
+        assert_valid_and_distinct(mnemonics + more_mnemonics, wallets + more_wallets, 5)
+    finally:
+        pool.stop()
+
+
+def test_failed_generation_frees_its_slot():
+    pool = KeyPool(size=1)
+    pool.in_flight = 1
+    failed = Future()
+    failed.set_exception(RuntimeError("worker died"))
+
+    pool.add(failed)
+
+    assert pool.in_flight == 0
+    assert not pool.keys
+
+
+def test_bulk_mode_writes_one_key_per_line(tmp_path, monkeypatch):
+    from wallet import new_wallet
+
+    out = tmp_path / "keys.jsonl"
+    monkeypatch.setattr(
+        sys, "argv", ["new_wallet.py", "--count", "5", "--out", str(out)]
+    )
+
+    new_wallet.main()
+
+    lines = out.read_text().splitlines()
+    assert len(lines) == 5
+    addresses = set()
+    for line in lines:
+        keys = json.loads(line)
+        keypair = Keypair.create_from_private_key(keys["private_key"], ss58_format=42)
+        assert keypair.ss58_address == keys["public_key"]
+        addresses.add(keys["public_key"])
+    assert len(addresses) == 5
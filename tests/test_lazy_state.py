@@ -0,0 +1,75 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+
+class FakeEvents:
+    def __init__(self):
+        self.accounts = {}
+
+    def watch(self, address, key, callback):
+        self.accounts[key] = address
+
+    def unwatch(self, address, key):
+        assert self.accounts.pop(key) == address
+
+
+@pytest.fixture
+def lazy(bot, monkeypatch):
+    # A sharded worker that owns 7001 but not 7003 and has loaded neither
+    events = FakeEvents()
+    pool = SimpleNamespace(events=events)
+    monkeypatch.setattr(bot, "LAZY_STATE", True)
+    monkeypatch.setattr(bot, "chain_pool", lambda chain: pool)
+    record = {
+        "group_initialized": False,
+        "user_ids": ["1"],
+        "active": False,
+        "members": [],
+        "expires_at": time.time() - 1,
+    }
+    for chat_id in (7001, 7003):
+        bot.store.put("chats", chat_id, record)
+        bot.store.put(
+            "groups",
+            chat_id,
+            {"usernames": [], "multisig_address": f"multisig{chat_id}"},
+        )
+    bot.store.flush()
+    yield events
+    for chat_id in (7001, 7003):
+        bot.drop_chat(chat_id)
+        bot.deadlines.cancel(chat_id)
+        bot.store.delete("chats", chat_id)
+        bot.store.delete("groups", chat_id)
+    bot.store.flush()
+
+
+def test_owned_chats_are_resumed_from_the_store(bot, sent, lazy):
+    async def main():
+        bot.resume_chats(lambda chat_id: chat_id == 7001, asyncio.get_running_loop())
+
+    asyncio.run(main())
+
+    assert 7001 not in bot.chats
+    assert 7001 in bot.deadlines.timers
+    assert lazy.accounts[7001] == "multisig7001"
+    assert 7003 not in bot.deadlines.timers
+    assert 7003 not in lazy.accounts
+    assert bot.held_chats() >= {7001}
+
+    bot.drop_chat(7001)
+    assert 7001 not in lazy.accounts
+
+
+def test_deadline_of_an_unloaded_chat_expires(bot, sent, lazy):
+    bot.store.put("wallets", 7001, {}, secret=True)
+
+    asyncio.run(bot.expire_chat(7001))
+
+    assert bot.chats[7001]["user_ids"] == []
+    assert 7001 not in bot.deadlines.timers
+    assert "Registration expired" in sent[-1]
+    bot.store.delete("wallets", 7001)
@@ -0,0 +1,67 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.fixture
+def telegram(bot, monkeypatch):
+    # Counts get_chat_member_count calls; every chat has 5 members
+    asked = []
+
+    async def get_chat_member_count(chat_id):
+        asked.append(chat_id)
+        return 5
+
+    monkeypatch.setattr(bot.bot, "get_chat_member_count", get_chat_member_count)
+    yield asked
+    for chat_id in (9501, 9502, 9503):
+        bot.member_counts.pop(chat_id, None)
+
+
+def member_update(chat_id, old_status, new_status, is_member=False):
+    return SimpleNamespace(
+        chat=SimpleNamespace(id=chat_id),
+        old_chat_member=SimpleNamespace(status=old_status, is_member=is_member),
+        new_chat_member=SimpleNamespace(status=new_status, is_member=is_member),
+    )
+
+
+def test_member_count_is_cached_until_it_expires(bot, telegram):
+    hits = bot.member_count_stats["hits"]
+
+    async def main():
+        return [await bot.get_member_count(9501) for _ in range(3)]
+
+    assert asyncio.run(main()) == [5, 5, 5]
+    assert telegram == [9501]
+    assert bot.member_count_stats["hits"] == hits + 2
+
+    count, _ = bot.member_counts[9501]
+    bot.member_counts[9501] = (count, time.monotonic() - 1)
+    assert asyncio.run(bot.get_member_count(9501)) == 5
+    assert telegram == [9501, 9501]
+
+
+def test_joins_and_leaves_adjust_the_cached_count(bot, telegram):
+    asyncio.run(bot.get_member_count(9502))
+
+    asyncio.run(bot.track_member_count(member_update(9502, "left", "member")))
+    asyncio.run(bot.track_member_count(member_update(9502, "left", "administrator")))
+    asyncio.run(bot.track_member_count(member_update(9502, "member", "kicked")))
+    # Promotions and restrictions that keep membership don't change the count
+    asyncio.run(bot.track_member_count(member_update(9502, "member", "administrator")))
+    asyncio.run(
+        bot.track_member_count(member_update(9502, "member", "restricted", True))
+    )
+
+    assert asyncio.run(bot.get_member_count(9502)) == 6
+    assert telegram == [9502]
+
+
+def test_changes_to_uncached_chats_are_ignored(bot, telegram):
+    asyncio.run(bot.track_member_count(member_update(9503, "left", "member")))
+
+    assert 9503 not in bot.member_counts
+    assert asyncio.run(bot.get_member_count(9503)) == 5
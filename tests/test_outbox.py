@@ -0,0 +1,155 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from telebot.asyncio_helper import ApiTelegramException
+
+import outbox as outbox_module
+from outbox import Outbox
+
+
+class FakeBot:
+    # Records each call with when it was made; `limited` sends fail with 429
+    def __init__(self):
+        self.calls = []
+        self.limited = 0
+        self.message_ids = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.limited:
+            self.limited -= 1
+            raise ApiTelegramException(
+                "sendMessage",
+                None,
+                {
+                    "error_code": 429,
+                    "description": "Too Many Requests",
+                    "parameters": {"retry_after": 0.2},
+                },
+            )
+        self.message_ids += 1
+        self.calls.append(("send", chat_id, text, time.monotonic()))
+        return SimpleNamespace(message_id=self.message_ids)
+
+    async def edit_message_text(self, text, chat_id, message_id):
+        self.calls.append(("edit", chat_id, text, message_id))
+
+    async def pin_chat_message(self, chat_id, message_id, disable_notification=False):
+        self.calls.append(("pin", chat_id, message_id))
+
+    async def unpin_chat_message(self, chat_id, message_id):
+        self.calls.append(("unpin", chat_id, message_id))
+
+
+@pytest.fixture
+def outbox(monkeypatch):
+    # Two messages at once per chat, then one every 50ms
+    monkeypatch.setattr(outbox_module, "CHAT_RATE", 20)
+    monkeypatch.setattr(outbox_module, "CHAT_BURST", 2)
+    return Outbox(FakeBot())
+
+
+async def drained(outbox):
+    while outbox.senders:
+        await asyncio.gather(*outbox.senders.values())
+
+
+def test_messages_are_paced_by_the_chat_bucket(outbox):
+    async def main():
+        start = time.monotonic()
+        for number in range(4):
+            outbox.send(1, f"message {number}")
+        await drained(outbox)
+        return start
+
+    start = asyncio.run(main())
+
+    sent_at = [call[3] - start for call in outbox.bot.calls]
+    assert [call[2] for call in outbox.bot.calls] == [
+        f"message {number}" for number in range(4)
+    ]
+    # The burst goes out at once; the rest wait for the bucket to refill
+    assert sent_at[1] < 0.04
+    assert sent_at[3] >= 0.09
+
+
+def test_status_updates_coalesce_then_edit_in_place(outbox):
+    async def main():
+        for votes in range(3):
+            outbox.status(1, ("tally", 1), f"{votes} votes")
+        await drained(outbox)
+        outbox.status(1, ("tally", 1), "3 votes")
+        await drained(outbox)
+
+    asyncio.run(main())
+
+    assert [call[:3] for call in outbox.bot.calls] == [
+        ("send", 1, "2 votes"),
+        ("edit", 1, "3 votes"),
+    ]
+    assert outbox.bot.calls[1][3] == 1
+    assert outbox.stats["coalesced"] == 2
+
+
+def test_rate_limited_message_is_retried_after_retry_after(outbox):
+    outbox.bot.limited = 1
+
+    async def main():
+        start = time.monotonic()
+        outbox.send(1, "hello")
+        await drained(outbox)
+        return start
+
+    start = asyncio.run(main())
+
+    assert [call[2] for call in outbox.bot.calls] == ["hello"]
+    assert outbox.bot.calls[0][3] - start >= 0.2
+    assert outbox.stats["retries"] == 1
+    assert outbox.stats["rate_limited"] == 1
+
+
+def test_idle_chats_are_pruned(outbox):
+    outbox.bot.limited = 1
+
+    async def main():
+        outbox.send(1, "hello")
+        outbox.send(2, "hello")
+        await drained(outbox)
+        assert outbox.buckets
+        # Long enough for the buckets to refill and the pause to pass
+        await asyncio.sleep(0.3)
+
+    asyncio.run(main())
+
+    assert outbox.buckets == {}
+    assert outbox.paused_until == {}
+    assert outbox.queues == {}
+
+
+def test_ended_status_is_unpinned(outbox):
+    async def main():
+        outbox.status(1, ("tally", 1), "1 vote", pin=True)
+        await drained(outbox)
+        outbox.end_status(("tally", 1))
+        await drained(outbox)
+
+    asyncio.run(main())
+
+    assert [call[0] for call in outbox.bot.calls] == ["send", "pin", "unpin"]
+    assert outbox.bot.calls[2] == ("unpin", 1, 1)
+    assert outbox.status_messages == {}
+    assert (outbox.stats["pins"], outbox.stats["unpins"]) == (1, 1)
+
+
+def test_ended_status_is_not_sent(outbox):
+    async def main():
+        outbox.status(1, ("registration", 1), "Waiting for 2 more members")
+        outbox.end_status(("registration", 1))
+        await drained(outbox)
+
+    asyncio.run(main())
+
+    assert outbox.bot.calls == []
+    assert outbox.status_messages == {}
+    assert outbox.stats["depth"] == 0
@@ -0,0 +1,292 @@
+import asyncio
+import threading
+
+import pytest
+from telebot.asyncio_helper import ApiTelegramException
+
+from inbox import Inbox
+
+
+class Stop(BaseException):
+    # poll() retries on Exception, so this gets past it
+    pass
+
+
+def message_update(update_id, chat_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "group"},
+            "from": {"id": 1, "is_bot": False, "first_name": "a"},
+            "text": text,
+        },
+    }
+
+
+@pytest.fixture
+def applied(bot, monkeypatch):
+    # Records what the inbox applies instead of running the handlers; a chat
+    # listed in `held` waits until its event is set
+    seen = []
+    held = {}
+
+    async def apply(chat_id, data):
+        if chat_id in held:
+            await held[chat_id].wait()
+        seen.append((chat_id, data["update_id"]))
+
+    monkeypatch.setattr(bot, "inbox", Inbox(bot.store, apply))
+    return seen, held
+
+
+@pytest.fixture
+def fake_updates(bot, monkeypatch):
+    # Serves the given batches, then checks what was committed before the
+    # call that would confirm the last one
+    batches = []
+    committed = []
+
+    async def get_updates(token, offset=None, **kwargs):
+        # Gives queued updates a chance to be applied between polls
+        await asyncio.sleep(0.05)
+        committed.append(bot.store.writes.copy())
+        if not batches:
+            raise Stop()
+        return batches.pop(0)
+
+    monkeypatch.setattr(bot.asyncio_helper, "get_updates", get_updates)
+    return batches, committed
+
+
+async def drained(inbox):
+    while inbox.drains:
+        await asyncio.gather(*inbox.drains.values())
+
+
+def test_batch_is_committed_before_it_is_confirmed(bot, fake_updates):
+    batches, committed = fake_updates
+    batches.append([message_update(9001, 3001, "/start")])
+    handled = []
+
+    async def handle(updates):
+        handled.extend(updates)
+        bot.store.put("chats", 3001, {"handled": True})
+
+    with pytest.raises(Stop):
+        asyncio.run(bot.poll(handle))
+
+    assert [update["update_id"] for update in handled] == [9001]
+    # Nothing was left queued when Telegram was asked for the next batch
+    assert committed[-1] == {}
+    assert bot.store.get("polling", "offset") == 9002
+    assert bot.store.get("chats", 3001) == {"handled": True}
+
+
+def test_chatter_is_dropped_and_chats_keep_their_order(bot, applied):
+    seen, _ = applied
+
+    async def main():
+        await bot.queue_updates(
+            [
+                message_update(9101, 3101, "/start"),
+                message_update(9102, 3102, "hello there"),
+                message_update(9103, 3101, "/hello"),
+            ]
+        )
+        await drained(bot.inbox)
+
+    asyncio.run(main())
+
+    assert seen == [(3101, 9101), (3101, 9103)]
+
+
+def test_slow_chat_does_not_hold_up_polling(bot, applied, fake_updates):
+    seen, held = applied
+    batches, committed = fake_updates
+    held[3201] = asyncio.Event()
+    batches.append(
+        [message_update(9201, 3201, "/start"), message_update(9202, 3202, "/start")]
+    )
+    batches.append([message_update(9203, 3202, "/start")])
+
+    with pytest.raises(Stop):
+        asyncio.run(bot.poll())
+
+    # The second batch was fetched and applied while the first chat waited
+    assert seen == [(3202, 9202), (3202, 9203)]
+    # The offset stays at the update still outstanding, which is kept in the
+    # store because Telegram has already been told it arrived
+    assert committed[-1] == {}
+    assert bot.store.get("polling", "offset") == 9201
+    assert bot.store.get("updates", 9201)["update_id"] == 9201
+    assert bot.store.get("updates", 9203) is None
+    bot.store.delete("updates", 9201)
+
+
+def test_stored_updates_are_applied_after_a_restart(bot, applied):
+    seen, _ = applied
+    bot.store.put("updates", 9302, message_update(9302, 3301, "/hello"))
+    bot.store.put("updates", 9301, message_update(9301, 3301, "/start"))
+    bot.store.flush()
+
+    async def main():
+        bot.queue_stored_updates()
+        await drained(bot.inbox)
+
+    asyncio.run(main())
+
+    assert seen == [(3301, 9301), (3301, 9302)]
+    bot.store.flush()
+    assert bot.store.load("updates") == {}
+
+
+def test_workers_only_pick_up_stored_updates_for_their_chats(bot, applied):
+    seen, _ = applied
+    bot.store.put("updates", 9401, message_update(9401, 3401, "/start"))
+    bot.store.put("updates", 9402, message_update(9402, 3402, "/start"))
+    bot.store.flush()
+
+    async def main():
+        bot.queue_stored_updates(lambda chat_id: chat_id == 3401)
+        await drained(bot.inbox)
+
+    asyncio.run(main())
+
+    assert seen == [(3401, 9401)]
+    bot.store.flush()
+    assert list(bot.store.load("updates")) == [9402]
+    bot.store.delete("updates", 9402)
+
+
+def test_handing_over_a_chat_waits_for_its_queued_updates(bot, applied):
+    seen, held = applied
+    held[3501] = asyncio.Event()
+    # A shard worker queues without touching the front's polling offset
+    bot.inbox.save_offset = False
+    bot.store.put("polling", "offset", 1)
+
+    async def main():
+        await bot.queue_updates(
+            [message_update(9501, 3501, "/start"), message_update(9502, 3502, "/start")]
+        )
+        assert {3501, 3502} <= bot.held_chats()
+
+        handover = asyncio.create_task(bot.inbox.wait_applied([3501]))
+        await asyncio.sleep(0.05)
+        assert seen == [(3502, 9502)]
+        assert not handover.done()
+
+        held[3501].set()
+        await handover
+
+    asyncio.run(main())
+
+    assert seen == [(3502, 9502), (3501, 9501)]
+    bot.store.flush()
+    assert bot.store.get("polling", "offset") == 1
+    assert bot.store.load("updates") == {}
+
+
+def test_rate_limited_polls_are_counted(bot, monkeypatch):
+    monkeypatch.setattr(bot, "POLL_RETRY", 0)
+    monkeypatch.setattr(bot, "polling_stats", dict.fromkeys(bot.polling_stats, 0))
+    polls = []
+
+    async def get_updates(token, offset=None, **kwargs):
+        polls.append(offset)
+        if len(polls) > 1:
+            raise Stop()
+        raise ApiTelegramException(
+            "getUpdates",
+            None,
+            {"error_code": 429, "description": "Too Many Requests"},
+        )
+
+    monkeypatch.setattr(bot.asyncio_helper, "get_updates", get_updates)
+
+    with pytest.raises(Stop):
+        asyncio.run(bot.poll())
+
+    assert bot.polling_stats == {"requests": 2, "failures": 1, "rate_limited": 1}
+    assert 'telegram_rate_limited_total 1' in bot.render()
+
+
+def test_failed_updates_are_counted(bot, monkeypatch):
+    async def apply(chat_id, data):
+        if data["update_id"] == 9802:
+            raise ValueError("bad update")
+
+    monkeypatch.setattr(bot, "inbox", Inbox(bot.store, apply))
+
+    async def main():
+        await bot.queue_updates(
+            [message_update(update_id, 3801, "/start") for update_id in (9801, 9802)]
+        )
+        await bot.inbox.wait_applied([3801])
+
+    asyncio.run(main())
+
+    metrics = bot.render()
+    assert "bot_inbox_queued_total 2" in metrics
+    assert "bot_inbox_applied_total 1" in metrics
+    assert "bot_inbox_failed_total 1" in metrics
+    bot.store.flush()
+
+
+def test_poll_commits_off_the_event_loop(bot, monkeypatch):
+    commits = []
+    commit = bot.store.commit
+
+    def recording_commit():
+        commits.append(threading.current_thread() is threading.main_thread())
+        return commit()
+
+    async def get_updates(token, offset=None, **kwargs):
+        if commits:
+            raise Stop()
+        return [message_update(9701, 3701, "/start")]
+
+    async def handle(updates):
+        pass
+
+    monkeypatch.setattr(bot.store, "commit", recording_commit)
+    monkeypatch.setattr(bot.asyncio_helper, "get_updates", get_updates)
+    with pytest.raises(Stop):
+        asyncio.run(bot.poll(handle))
+
+    # The loop, on the main thread, never waits on SQLite itself
+    assert commits == [False]
+    assert bot.store.get("polling", "offset") == 9702
+
+
+def test_update_effects_are_committed_with_its_update_id(bot, sent, monkeypatch):
+    chat_id = 3601
+    bot.get_chat_state(chat_id)["group_initialized"] = True
+    bot.groups[chat_id] = {"pending_tx": None}
+    committed_early = []
+
+    def create_tx(group_id, proposer, destination, amount):
+        bot.groups[group_id]["pending_tx"] = {"calls": ["transfer"]}
+        bot.save_group(group_id)
+        # The store's writer commits while the handler is still running
+        bot.store.flush()
+        committed_early.append(bot.store.load("groups").get(group_id))
+        return {"message": "Created transaction", "queued": 1}
+
+    monkeypatch.setattr(bot, "create_tx", create_tx)
+    asyncio.run(
+        bot.apply_update(chat_id, message_update(9601, chat_id, "/create dest 10"))
+    )
+
+    assert committed_early == [None]
+    bot.store.flush()
+    assert bot.store.get("groups", chat_id) == {"pending_tx": {"calls": ["transfer"]}}
+    assert bot.store.get("chats", chat_id)["last_update_id"] == 9601
+
+    bot.deadlines.cancel(chat_id)
+    bot.groups.pop(chat_id)
+    bot.chats.pop(chat_id)
+    bot.store.delete("groups", chat_id)
+    bot.store.delete("chats", chat_id)
@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from conftest import make_message, set_member_count
+
+
+@pytest.fixture
+def fake_init(bot, monkeypatch):
+    # Stands in for key generation and the chain, keeping init_group's checks
+    calls = []
+
+    def init_group(group_id, usernames, threshold, chain):
+        calls.append(threshold)
+        if not 2 <= threshold <= len(usernames):
+            return {"error": f"Threshold must be between 2 and {len(usernames)}"}
+        return {"message": f"Initialized group {group_id}"}
+
+    monkeypatch.setattr(bot, "init_group", init_group)
+    monkeypatch.setattr(bot, "watch_group", lambda chat_id, loop: None)
+    return calls
+
+
+def run(bot, chat_id, user_id, text):
+    message = make_message(chat_id, user_id, text)
+    asyncio.run(bot.commands[bot.command_name(text)](message))
+
+
+def test_threshold_above_member_count_is_rejected(bot, sent):
+    set_member_count(bot, 2001, 3)
+    run(bot, 2001, 1, "/threshold 5")
+
+    assert bot.chats[2001]["threshold"] is None
+    assert "between 2 and 2" in sent[-1]
+
+
+def test_threshold_below_two_is_rejected(bot, sent):
+    # approve_as_multi rejects thresholds below 2
+    set_member_count(bot, 2006, 4)
+    run(bot, 2006, 1, "/threshold 1")
+    assert bot.chats[2006]["threshold"] is None
+    assert "between 2 and 3" in sent[-1]
+
+    # With one member no threshold works
+    set_member_count(bot, 2007, 2)
+    run(bot, 2007, 1, "/threshold 1")
+    assert bot.chats[2007]["threshold"] is None
+    assert sent[-1] == "A multisig needs at least 2 members."
+
+
+def test_groups_need_two_members_and_a_threshold_of_two(bot):
+    assert bot.init_group("g2008", ["alice"], 1) == {
+        "error": "Groups need at least 2 members"
+    }
+    assert bot.init_group("g2008", ["alice", "bob"], 1) == {
+        "error": "Threshold must be between 2 and 2"
+    }
+    assert "g2008" not in bot.groups
+
+
+def test_group_initializes_once_everyone_registers(bot, sent, fake_init):
+    set_member_count(bot, 2002, 3)
+    run(bot, 2002, 1, "/hi")
+    assert not bot.chats[2002]["group_initialized"]
+    run(bot, 2002, 2, "/hi")
+
+    assert bot.chats[2002]["group_initialized"]
+    assert fake_init == [2]
+
+
+def test_failed_setup_is_retried_after_threshold_fix(bot, sent, fake_init):
+    # The chat shrank after the threshold was set, so setup fails
+    set_member_count(bot, 2003, 4)
+    run(bot, 2003, 1, "/threshold 3")
+    set_member_count(bot, 2003, 3)
+    run(bot, 2003, 1, "/hi")
+    run(bot, 2003, 2, "/hi")
+
+    state = bot.chats[2003]
+    assert not state["group_initialized"]
+    assert state["user_ids"] == ["1", "2"]
+    assert "Could not initialize the group" in sent[-1]
+
+    run(bot, 2003, 1, "/threshold 2")
+    assert state["group_initialized"]
+    assert fake_init == [3, 2]
+
+
+def test_registered_member_can_retry_failed_setup(bot, sent, fake_init, monkeypatch):
+    set_member_count(bot, 2004, 3)
+    monkeypatch.setattr(
+        bot, "init_group", lambda *args: {"error": "Connection refused"}
+    )
+    run(bot, 2004, 1, "/hi")
+    run(bot, 2004, 2, "/hi")
+    assert not bot.chats[2004]["group_initialized"]
+
+    monkeypatch.setattr(bot, "init_group", lambda *args: {"message": "ok"})
+    run(bot, 2004, 2, "/hi")
+    assert bot.chats[2004]["group_initialized"]
+
+
+def test_setup_that_raises_is_reported(bot, sent, fake_init, monkeypatch):
+    set_member_count(bot, 2005, 2)
+
+    def init_group(*args):
+        raise ConnectionError("Connection refused")
+
+    monkeypatch.setattr(bot, "init_group", init_group)
+    run(bot, 2005, 1, "/hi")
+
+    assert not bot.chats[2005]["group_initialized"]
+    assert bot.chats[2005]["user_ids"] == ["1"]
+    assert "Could not initialize the group: Connection refused" in sent[-1]
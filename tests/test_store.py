@@ -0,0 +1,170 @@
+import asyncio
+import contextvars
+import sqlite3
+import threading
+
+import pytest
+
+import store as store_module
+from store import GroupStore
+
+
+class PausedDB:
+    """Wraps the store's connection so a test can hold a commit mid-way or
+    make it fail."""
+
+    def __init__(self, db):
+        self.db = db
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.failures = 0
+
+    def __enter__(self):
+        return self.db.__enter__()
+
+    def __exit__(self, *exc):
+        return self.db.__exit__(*exc)
+
+    def execute(self, *args):
+        return self.db.execute(*args)
+
+    def executemany(self, *args):
+        self.entered.set()
+        self.release.wait(5)
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return self.db.executemany(*args)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return GroupStore(str(tmp_path / "store.db"), key="22" * 32)
+
+
+@pytest.fixture
+def idle_writer(monkeypatch):
+    # Keeps the background writer from committing while a test drives flush()
+    monkeypatch.setattr(store_module, "COMMIT_INTERVAL", 10)
+
+
+def test_put_is_visible_before_and_after_commit(store):
+    store.put("chats", 1, {"active": True})
+    assert store.get("chats", 1) == {"active": True}
+
+    store.flush()
+    assert store.get("chats", 1) == {"active": True}
+    assert store.load("chats") == {1: {"active": True}}
+
+
+def test_secret_records_are_encrypted(store):
+    store.put("wallets", 1, {"alice": {"seed": "00"}}, secret=True)
+    store.flush()
+
+    row = store.db.execute("SELECT data FROM records").fetchone()
+    assert b"alice" not in row[0]
+    assert store.get("wallets", 1, secret=True) == {"alice": {"seed": "00"}}
+
+
+def test_get_waits_for_a_commit_in_flight(store, idle_writer):
+    store.db = db = PausedDB(store.db)
+    store.put("chats", 1, {"active": True})
+    flushing = threading.Thread(target=store.flush)
+    flushing.start()
+    assert db.entered.wait(5)
+
+    result = []
+    reading = threading.Thread(target=lambda: result.append(store.get("chats", 1)))
+    reading.start()
+    reading.join(0.2)
+    assert reading.is_alive()
+
+    db.release.set()
+    flushing.join(5)
+    reading.join(5)
+    assert result == [{"active": True}]
+
+
+def test_failed_commit_keeps_its_writes(store, idle_writer):
+    store.db = db = PausedDB(store.db)
+    db.release.set()
+    db.failures = 1
+    store.put("chats", 1, {"active": True})
+    store.put("chats", 2, {"active": True})
+
+    with pytest.raises(sqlite3.OperationalError):
+        store.flush()
+    # A newer write to the same record replaces the failed one
+    store.put("chats", 2, {"active": False})
+    store.flush()
+
+    assert store.load("chats") == {1: {"active": True}, 2: {"active": False}}
+
+
+def test_commit_retries_until_the_writes_are_committed(
+    store, idle_writer, monkeypatch
+):
+    monkeypatch.setattr(store_module, "COMMIT_RETRY", 0)
+    store.db = db = PausedDB(store.db)
+    db.release.set()
+    db.failures = 2
+    store.put("chats", 1, {"active": True})
+
+    store.commit()
+
+    assert db.failures == 0
+    assert store.load("chats") == {1: {"active": True}}
+
+
+def test_delete_hides_the_record_before_and_after_commit(store):
+    store.put("updates", 1, {"update_id": 1})
+    store.flush()
+
+    store.delete("updates", 1)
+    assert store.get("updates", 1) is None
+
+    store.flush()
+    assert store.get("updates", 1) is None
+    assert store.load("updates") == {}
+
+
+def test_batched_writes_are_committed_together(store, idle_writer):
+    store.put("chats", 1, {"last_update_id": 0})
+    store.flush()
+
+    with store.batch():
+        # A group saved from another thread with a copy of the context, as
+        # run_chain does, joins the batch too
+        context = contextvars.copy_context()
+        saving = threading.Thread(
+            target=context.run, args=(store.put, "groups", 1, {"pending_tx": "a"})
+        )
+        saving.start()
+        saving.join()
+        assert store.get("groups", 1) == {"pending_tx": "a"}
+
+        # A commit in between holds none of the batch
+        store.flush()
+        assert store.load("groups") == {}
+        store.put("chats", 1, {"last_update_id": 1})
+
+    store.flush()
+    assert store.load("groups") == {1: {"pending_tx": "a"}}
+    assert store.load("chats") == {1: {"last_update_id": 1}}
+
+
+def test_tasks_outliving_a_batch_write_directly(store, idle_writer):
+    async def write_later():
+        await asyncio.sleep(0.01)
+        store.put("chats", 2, {"late": True})
+
+    async def main():
+        # The task's copy of the context still names the batch once it closes
+        with store.batch():
+            task = asyncio.get_running_loop().create_task(write_later())
+        await task
+
+    asyncio.run(main())
+
+    store.flush()
+    assert store.load("chats") == {2: {"late": True}}
@@ -0,0 +1,114 @@
+import asyncio
+import random
+import time
+
+from timers import TimerWheel
+
+
+async def drive(wheel, ticks):
+    # Advances the wheel by hand and lets the fired callbacks run
+    for _ in range(ticks):
+        wheel.advance()
+        await asyncio.sleep(0)
+
+
+def test_timers_fire_on_their_tick():
+    wheel = TimerWheel(slots=8)
+    fired = []
+
+    async def callback(key):
+        fired.append((key, wheel.current))
+
+    async def main():
+        wheel.schedule("a", 3, callback)
+        # Further out than one turn of the wheel
+        wheel.schedule("b", 20, callback)
+        await drive(wheel, 25)
+
+    asyncio.run(main())
+    assert fired == [("a", 3), ("b", 20)]
+    assert len(wheel) == 0
+
+
+def test_cancel_and_reschedule():
+    wheel = TimerWheel(slots=8)
+    fired = []
+
+    async def callback(key):
+        fired.append((key, wheel.current))
+
+    async def main():
+        wheel.schedule("a", 2, callback)
+        wheel.schedule("b", 2, callback)
+        wheel.cancel("a")
+        # Scheduling a key again replaces its timer
+        wheel.schedule("b", 5, callback)
+        await drive(wheel, 6)
+
+    asyncio.run(main())
+    assert fired == [("b", 5)]
+
+
+def test_100k_pending_deadlines():
+    wheel = TimerWheel(slots=512)
+    rng = random.Random(7)
+    due = {key: rng.randint(1, 2000) for key in range(100_000)}
+    cancelled = set(rng.sample(range(100_000), 10_000))
+    fired = {}
+
+    async def callback(key):
+        fired[key] = wheel.current
+
+    async def main():
+        started = time.perf_counter()
+        for key, ticks in due.items():
+            wheel.schedule(key, ticks, callback)
+        for key in cancelled:
+            wheel.cancel(key)
+        scheduling = time.perf_counter() - started
+        assert len(wheel) == 90_000
+        # Inserting and cancelling are dict operations, not a sorted insert
+        assert scheduling < 2
+
+        await drive(wheel, 2000)
+
+    asyncio.run(main())
+    assert fired == {key: ticks for key, ticks in due.items() if key not in cancelled}
+
+
+def test_wheel_task_fires_in_real_time():
+    async def main():
+        wheel = TimerWheel(tick=0.01)
+        done = asyncio.Event()
+
+        async def callback(key):
+            done.set()
+
+        wheel.start()
+        wheel.schedule("a", 0.05, callback)
+        await asyncio.wait_for(done.wait(), 2)
+        wheel.task.cancel()
+
+    asyncio.run(main())
+
+
+def test_timer_set_mid_tick_never_fires_early():
+    async def main():
+        loop = asyncio.get_running_loop()
+        wheel = TimerWheel(tick=0.2)
+        fired = {}
+
+        async def callback(key):
+            fired[key] = loop.time()
+
+        wheel.start()
+        # Partway through the second tick
+        await asyncio.sleep(0.3)
+        scheduled = loop.time()
+        wheel.schedule("a", 0.4, callback)
+        while "a" not in fired:
+            await asyncio.sleep(0.01)
+        wheel.task.cancel()
+        return fired["a"] - scheduled
+
+    assert asyncio.run(main()) >= 0.4
@@ -0,0 +1,198 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import chain
+from inbox import Inbox
+
+
+@pytest.fixture(scope="module")
+def api():
+    import wallet.main as api
+
+    return api
+
+
+@pytest.fixture
+def client(api, monkeypatch):
+    # No key generation processes are needed here
+    monkeypatch.setattr(api.key_pool, "start", lambda: None)
+    with TestClient(api.app, raise_server_exceptions=False) as client:
+        yield client
+
+
+@pytest.fixture
+def group(api):
+    pending_tx = {
+        "calls": [],
+        "call_data": "0x00",
+        "call_hash": "0x00",
+        "multisig_call": "0x00",
+        "proposer": "alice",
+        "signed": 0b11,
+    }
+    api.groups["g"] = {
+        "usernames": ["alice", "bob"],
+        "members": {"alice": 0, "bob": 1},
+        "wallets": {},
+        "signatories": [],
+        "multisig_address": "5Multisig",
+        "threshold": 2,
+        "chain": api.DEFAULT_CHAIN,
+        "pending_tx": pending_tx,
+    }
+    yield api.groups["g"]
+    api.groups.pop("g", None)
+
+
+def wait_for_submission(api, group_id):
+    deadline = time.monotonic() + 5
+    while group_id in api.submissions and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_timed_out_submission_is_not_submitted_twice(api, client, group, monkeypatch):
+    release = threading.Event()
+    submitted = []
+
+    def submit_pending(group, pending_tx, multisig_call):
+        submitted.append(pending_tx)
+        release.wait(5)
+        return "tx-1"
+
+    monkeypatch.setattr(api, "submit_pending", submit_pending)
+    monkeypatch.setattr(api, "CHAIN_TIMEOUT", 0.1)
+
+    assert client.post("/confirm_tx", params={"group_id": "g"}).status_code == 504
+    assert client.post("/confirm_tx", params={"group_id": "g"}).status_code == 409
+
+    release.set()
+    wait_for_submission(api, "g")
+    assert len(submitted) == 1
+    assert group["pending_tx"] is None
+    # Once it has finished there is nothing left to confirm
+    assert client.post("/confirm_tx", params={"group_id": "g"}).status_code == 400
+
+
+def test_failed_submission_restores_the_batch(api, client, group, monkeypatch):
+    pending_tx = group["pending_tx"]
+
+    def submit_pending(group, pending_tx, multisig_call):
+        raise RuntimeError("Priority is too low")
+
+    monkeypatch.setattr(api, "submit_pending", submit_pending)
+
+    assert client.post("/confirm_tx", params={"group_id": "g"}).status_code == 500
+    wait_for_submission(api, "g")
+    assert group["pending_tx"] is pending_tx
+
+
+def test_sign_tx_sets_the_member_bit(api, client, group):
+    group["pending_tx"]["signed"] = 0b01
+
+    response = client.post("/sign_tx", json={"group_id": "g", "username": "bob"})
+    assert response.json() == {"message": "Signed transaction", "signed": 2}
+    assert group["pending_tx"]["signed"] == 0b11
+
+    response = client.post("/sign_tx", json={"group_id": "g", "username": "bob"})
+    assert response.status_code == 400
+    response = client.post("/sign_tx", json={"group_id": "g", "username": "carol"})
+    assert response.status_code == 403
+
+
+def test_tx_status_is_looked_up_across_pools(api, client, monkeypatch):
+    record = {"id": "tx-1", "status": "in_block", "block_number": 7}
+    tracker = SimpleNamespace(get={"tx-1": record}.get)
+    monkeypatch.setitem(
+        chain.pools, ("ws://fake", 42, None), SimpleNamespace(tracker=tracker)
+    )
+
+    response = client.get("/tx/tx-1")
+    assert response.status_code == 200
+    assert response.json() == record
+    assert client.get("/tx/tx-2").status_code == 404
+
+
+def test_webhook_updates_are_committed_then_applied_in_order(
+    api, bot, client, monkeypatch
+):
+    assert client.post("/telegram/webhook", json={}).status_code == 404
+
+    release = threading.Event()
+    applied = []
+
+    async def apply(chat_id, data):
+        while not release.is_set():
+            await asyncio.sleep(0.01)
+        applied.append((chat_id, data["update_id"]))
+
+    monkeypatch.setattr(api, "telegram", bot)
+    monkeypatch.setattr(bot, "inbox", Inbox(bot.store, apply))
+    for update_id, text in [(9401, "/start"), (9402, "hello"), (9403, "/hello")]:
+        update = {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": 0,
+                "chat": {"id": 8001, "type": "group"},
+                "from": {"id": 1, "is_bot": False, "first_name": "a"},
+                "text": text,
+            },
+        }
+        assert client.post("/telegram/webhook", json=update).json() == {"ok": True}
+
+    # Acknowledged updates are in the store before they are applied
+    assert sorted(bot.store.load("updates")) == [9401, 9403]
+    release.set()
+    deadline = time.monotonic() + 5
+    while len(applied) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert applied == [(8001, 9401), (8001, 9403)]
+
+
+def test_balances_are_looked_up_once_per_chain(api, client, group, monkeypatch):
+    kusama = {"url": "ws://kusama", "ss58_format": 2, "type_registry_preset": None}
+    api.groups["h"] = {**group, "multisig_address": "5Other"}
+    api.groups["k"] = {**group, "multisig_address": "HKusama", "chain": kusama}
+    lookups = []
+
+    def get_balances(pool, addresses):
+        lookups.append((pool, sorted(addresses)))
+        return {address: {"free": len(address)} for address in addresses}
+
+    monkeypatch.setattr(api, "chain_pool", lambda chain: chain["url"])
+    monkeypatch.setattr(api, "get_balances", get_balances)
+    try:
+        response = client.get("/balances", params={"group_ids": "g,k,h"})
+    finally:
+        api.groups.pop("h")
+        api.groups.pop("k")
+
+    assert response.status_code == 200
+    assert response.json()["balances"]["k"] == {
+        "balance": {"free": 7},
+        "address": "HKusama",
+    }
+    assert len(lookups) == 2
+    assert dict(lookups) == {
+        api.DEFAULT_CHAIN["url"]: ["5Multisig", "5Other"],
+        "ws://kusama": ["HKusama"],
+    }
+    assert client.get("/balances", params={"group_ids": "g,x"}).status_code == 404
+
+
+def test_groups_the_multisig_pallet_rejects_are_refused(client):
+    def init(usernames, threshold):
+        response = client.post(
+            "/init_group",
+            json={"group_id": "new", "usernames": usernames, "threshold": threshold},
+        )
+        assert response.status_code == 400
+        return response.json()["detail"]
+
+    assert init(["alice"], 1) == "Groups need at least 2 members"
+    assert init(["alice", "bob"], 1) == "Threshold must be between 2 and 2"
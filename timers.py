@@ -0,0 +1,79 @@
+import asyncio
+import math
+
+TIMER_TICK = 1
+TIMER_SLOTS = 3600
+
+
+class TimerWheel:
+    """Keyed deadlines on a hashed timing wheel, driven by one task.
+
+    A timer goes into the slot its due tick hashes to, so scheduling and
+    cancelling are a couple of dict operations however many timers exist.
+    Each tick looks at a single slot and fires the timers in it that are due,
+    leaving those that are one or more turns of the wheel away. Callbacks
+    are coroutine functions; each due one is called with its key and runs
+    as a task.
+    """
+
+    def __init__(self, tick=TIMER_TICK, slots=TIMER_SLOTS):
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)]
+        self.timers = {}
+        self.current = 0
+        # Loop time of tick 0, once the wheel is running
+        self.started = None
+        self.task = None
+        self.running = set()
+
+    def schedule(self, key, delay, callback):
+        # Replaces any timer already set for the key
+        self.cancel(key)
+        if self.started is None:
+            due = self.current + math.ceil(delay / self.tick)
+        else:
+            # Counted from the wheel's clock rather than the current tick,
+            # which may be partway over, so a timer never fires early
+            elapsed = asyncio.get_running_loop().time() - self.started
+            due = math.ceil((elapsed + delay) / self.tick)
+        due = max(due, self.current + 1)
+        slot = due % len(self.slots)
+        self.slots[slot][key] = (due, callback)
+        self.timers[key] = slot
+
+    def cancel(self, key):
+        slot = self.timers.pop(key, None)
+        if slot is not None:
+            del self.slots[slot][key]
+
+    def __len__(self):
+        return len(self.timers)
+
+    def start(self):
+        if not self.task:
+            loop = asyncio.get_running_loop()
+            self.started = loop.time() - self.current * self.tick
+            self.task = loop.create_task(self.run())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Ticks are timed from the start, so slow ticks don't add up
+            next_tick = self.started + (self.current + 1) * self.tick
+            await asyncio.sleep(max(next_tick - loop.time(), 0))
+            self.advance()
+
+    def advance(self):
+        self.current += 1
+        slot = self.slots[self.current % len(self.slots)]
+        due = [
+            (key, callback)
+            for key, (tick, callback) in slot.items()
+            if tick <= self.current
+        ]
+        for key, callback in due:
+            del slot[key]
+            del self.timers[key]
+            task = asyncio.get_running_loop().create_task(callback(key))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
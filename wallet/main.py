@@ -1,23 +1,183 @@
-from fastapi import FastAPI, HTTPException
+import os
+import asyncio
+import importlib
+import time
+from functools import partial
+import orjson
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from substrateinterface import SubstrateInterface, Keypair
-from hashlib import blake2b
+from chain import (
+    CHAIN_TIMEOUT,
+    DEFAULT_CHAIN,
+    MAX_SIGNATORIES,
+    MIN_THRESHOLD,
+    chain_pool,
+    decode_call,
+    find_tx,
+    get_balances,
+    prepare_proposal,
+    run_chain,
+    submit_signed,
+)
+from keys import KeyPool
+from metrics import Histogram, collector, render
+from store import (
+    UNSAVED_FIELDS,
+    GroupStore,
+    index_group,
+    other_signatories,
+    wallets_from_record,
+    wallets_to_record,
+)
 
 app = FastAPI()
 
-# Connect to Westend testnet
-substrate = SubstrateInterface(
-    url="wss://westend-rpc.polkadot.io", ss58_format=42, type_registry_preset="westend"
-)
+API_SECONDS = Histogram("api_request_seconds", "Wallet API request latency", "route")
+
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Labelled by route template, so /balance/{group_id} is one series
+    route = request.scope.get("route")
+    if route:
+        API_SECONDS.observe(route.path, time.perf_counter() - start)
+    return response
+
+
+# Keypairs are generated ahead of time so /init_group only draws from the pool
+key_pool = KeyPool()
+
+
+# Webhook mode: Telegram posts bot updates to this app instead of the bot
+# polling for them, so one process serves both the REST API and the bot
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+# The bot, its store and its workers are only loaded in webhook mode; all.py
+# shadows the builtin all() if imported by name
+telegram = importlib.import_module("all") if TELEGRAM_WEBHOOK_URL else None
+
+
+@app.on_event("startup")
+async def start_key_pool():
+    key_pool.start()
+
+
+@app.on_event("startup")
+async def set_telegram_webhook():
+    if telegram is None:
+        return
+
+    telegram.key_pool.start()
+    telegram.start_deadlines()
+    telegram.watch_groups(asyncio.get_running_loop())
+    # Updates acknowledged before a restart but not yet applied
+    telegram.queue_stored_updates()
+    await telegram.bot.set_webhook(
+        url=TELEGRAM_WEBHOOK_URL,
+        secret_token=TELEGRAM_WEBHOOK_SECRET,
+        allowed_updates=telegram.ALLOWED_UPDATES,
+    )
+
+
+@app.post("/telegram/webhook")
+async def telegram_webhook(request: Request):
+    if telegram is None:
+        raise HTTPException(status_code=404, detail="Webhook mode is off")
+    secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
+    if TELEGRAM_WEBHOOK_SECRET and secret != TELEGRAM_WEBHOOK_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid secret token")
+
+    # Queued on the bot's per-chat inbox like polled updates, so each chat
+    # applies them in order and records its last_update_id. Telegram forgets
+    # an update once it is acknowledged, so it is committed first.
+    await telegram.queue_updates([orjson.loads(await request.body())])
+    await asyncio.get_running_loop().run_in_executor(None, telegram.store.flush)
+
+    return {"ok": True}
+
+
+# Groups and their encrypted wallets are persisted across restarts
+store = GroupStore(os.getenv("WALLET_API_STORE_PATH", "wallet_api.db"))
+
+
+def save_group(group_id):
+    group = groups[group_id]
+    store.put(
+        "groups",
+        group_id,
+        {key: value for key, value in group.items() if key not in UNSAVED_FIELDS},
+    )
+
+
+def load_groups():
+    wallets = store.load("wallets", secret=True)
+    groups = {}
+    for group_id, record in store.load("groups").items():
+        chain = record.setdefault("chain", DEFAULT_CHAIN)
+        groups[group_id] = index_group(
+            {
+                **record,
+                "wallets": wallets_from_record(wallets[group_id], chain["ss58_format"]),
+            }
+        )
+    return groups
+
 
 # In-memory storage for group and wallet info
-groups = {}
+groups = load_groups()
+# Multisig calls prepared at proposal time, ready to sign, keyed by group_id
+prepared_calls = {}
+# Batches being submitted, keyed by group_id. A submission keeps running after
+# its request times out, so it stays here until it has actually finished.
+submissions = {}
+
+
+@collector
+def api_metrics():
+    return {
+        "api_groups": len(groups),
+        "api_pending_proposals": sum(
+            1 for group in groups.values() if group["pending_tx"]
+        ),
+    }
+
+
+class ChainConfig(BaseModel):
+    url: str = DEFAULT_CHAIN["url"]
+    ss58_format: int = DEFAULT_CHAIN["ss58_format"]
+    type_registry_preset: str | None = DEFAULT_CHAIN["type_registry_preset"]
 
 
 class InitGroupRequest(BaseModel):
     group_id: str
     usernames: list[str]
     threshold: int
+    chain: ChainConfig = ChainConfig()
+
+
+async def chain_call(func, *args):
+    # Chain work runs on the bounded chain executor so a slow RPC never blocks
+    # the event loop; a request that outlives its timeout gets a 504
+    try:
+        return await run_chain(func, *args)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Chain request timed out")
+
+
+def create_wallets(usernames, threshold, chain):
+    # Initialize wallets for each user
+    mnemonics, keys = key_pool.take(len(usernames), chain["ss58_format"])
+    group = index_group({"usernames": usernames, "wallets": dict(zip(usernames, keys))})
+
+    # Generate multisig address
+    with chain_pool(chain).connection() as substrate:
+        multisig_account_id = substrate.generate_multisig_account(
+            signatories=group["signatories"], threshold=threshold
+        )
+    return group, mnemonics, multisig_account_id.ss58_address
 
 
 @app.post("/init_group")
@@ -25,27 +185,48 @@ async def init_group(req: InitGroupRequest):
     if req.group_id in groups:
         raise HTTPException(status_code=400, detail="Group already exists")
 
-    # Initialize wallets for each user
-    wallets = {
-        username: Keypair.create_from_mnemonic(Keypair.generate_mnemonic())
-        for username in req.usernames
-    }
-
-    # Generate multisig address
-    sorted_addresses = sorted([wallet.ss58_address for wallet in wallets.values()])
-    multisig_account_id = substrate.generate_multisig_account(
-        signatories=sorted_addresses, threshold=req.threshold
+    if len(req.usernames) > MAX_SIGNATORIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Groups can have at most {MAX_SIGNATORIES} members",
+        )
+
+    if len(set(req.usernames)) != len(req.usernames):
+        raise HTTPException(status_code=400, detail="Usernames must be unique")
+
+    if len(req.usernames) < MIN_THRESHOLD:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Groups need at least {MIN_THRESHOLD} members",
+        )
+
+    members = len(req.usernames)
+    if not MIN_THRESHOLD <= req.threshold <= members:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Threshold must be between {MIN_THRESHOLD} and {members}",
+        )
+
+    chain = req.chain.model_dump()
+    group, mnemonics, multisig_address = await chain_call(
+        create_wallets, req.usernames, req.threshold, chain
     )
-    multisig_address = multisig_account_id.ss58_address
+    if req.group_id in groups:
+        raise HTTPException(status_code=400, detail="Group already exists")
 
     # Initialize group with usernames, threshold, wallets, and multisig address
+    wallets = group["wallets"]
     groups[req.group_id] = {
-        "usernames": req.usernames,
-        "wallets": wallets,
+        **group,
         "multisig_address": multisig_address,
         "threshold": req.threshold,
+        "chain": chain,
         "pending_tx": None,
     }
+    store.put(
+        "wallets", req.group_id, wallets_to_record(wallets, mnemonics), secret=True
+    )
+    save_group(req.group_id)
 
     return {
         "message": f"Initialized group {req.group_id}",
@@ -63,25 +244,66 @@ class CreateTxRequest(BaseModel):
     amount: int
 
 
+def prepare_transfer(group, calls, proposer, destination, amount):
+    with chain_pool(group["chain"]).connection() as substrate:
+        call = substrate.compose_call(
+            call_module="Balances",
+            call_function="transfer_allow_death",
+            call_params={"dest": destination, "value": amount},
+        )
+        calls = calls + [call.value]
+        # Encode and hash the whole batch now rather than after the last vote
+        # The proposer submits the approval, so everyone else is the other side
+        return calls, *prepare_proposal(
+            substrate,
+            calls,
+            group["threshold"],
+            other_signatories(group, group["wallets"][proposer].ss58_address),
+        )
+
+
 @app.post("/create_tx")
 async def create_tx(req: CreateTxRequest):
     group = groups.get(req.group_id)
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
 
-    if req.proposer not in group["usernames"]:
+    if req.proposer not in group["members"]:
         raise HTTPException(status_code=403, detail="Proposer not in group")
 
-    # Create unsigned transaction
-    call = substrate.compose_call(
-        call_module="Balances",
-        call_function="transfer_allow_death",
-        call_params={"dest": req.destination, "value": req.amount},
+    pending_tx = group["pending_tx"]
+    calls, call_data, call_hash, multisig_call = await chain_call(
+        prepare_transfer,
+        group,
+        pending_tx["calls"] if pending_tx else [],
+        req.proposer,
+        req.destination,
+        req.amount,
     )
+    if group["pending_tx"] is not pending_tx:
+        raise HTTPException(
+            status_code=409, detail="Pending transaction changed, please retry"
+        )
+
+    # Proposals queue up and settle together in one batched multisig call.
+    # Adding one changes what is being approved, so signatures start over.
+    group["pending_tx"] = {
+        "calls": calls,
+        "call_data": call_data,
+        "call_hash": call_hash,
+        "multisig_call": multisig_call.data.to_hex(),
+        "proposer": req.proposer,
+        # One bit per member, by their index in the group
+        "signed": 1 << group["members"][req.proposer],
+    }
+    prepared_calls[req.group_id] = multisig_call
+    save_group(req.group_id)
 
-    group["pending_tx"] = {"call": call, "signers": [req.proposer]}
-
-    return {"message": "Created transaction"}
+    return {
+        "message": "Created transaction",
+        "queued": len(calls),
+        "call_hash": call_hash,
+    }
 
 
 class SignTxRequest(BaseModel):
@@ -95,23 +317,31 @@ async def sign_tx(req: SignTxRequest):
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
 
-    if not group["pending_tx"]:
+    pending_tx = group["pending_tx"]
+    if not pending_tx:
         raise HTTPException(status_code=400, detail="No pending transaction")
 
-    if req.username not in group["usernames"]:
+    index = group["members"].get(req.username)
+    if index is None:
         raise HTTPException(status_code=403, detail="User not in group")
 
-    if req.username in group["pending_tx"]["signers"]:
+    if pending_tx["signed"] >> index & 1:
         raise HTTPException(status_code=400, detail="User already signed")
 
-    # Sign the pending transaction with user's wallet
-    wallet = group["wallets"].get(req.username)
-    if not wallet:
-        raise HTTPException(status_code=404, detail="Wallet not found for user")
+    pending_tx["signed"] |= 1 << index
+    save_group(req.group_id)
 
-    group["pending_tx"]["signers"].append(req.username)
+    return {"message": "Signed transaction", "signed": pending_tx["signed"].bit_count()}
 
-    return {"message": "Signed transaction"}
+
+def submit_pending(group, pending_tx, multisig_call):
+    wallet = group["wallets"][pending_tx["proposer"]]
+    pool = chain_pool(group["chain"])
+    with pool.connection() as substrate:
+        multisig_call = multisig_call or decode_call(
+            substrate, pending_tx["multisig_call"]
+        )
+        return submit_signed(pool, substrate, multisig_call, wallet.keypair)
 
 
 @app.post("/confirm_tx")
@@ -120,53 +350,58 @@ async def confirm_tx(group_id: str):
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
 
+    if group_id in submissions:
+        raise HTTPException(
+            status_code=409, detail="Transaction is already being submitted"
+        )
+
     if not group["pending_tx"]:
         raise HTTPException(status_code=400, detail="No pending transaction")
 
-    signers = len(group["pending_tx"]["signers"])
-    if signers < group["threshold"]:
+    if group["pending_tx"]["signed"].bit_count() < group["threshold"]:
         raise HTTPException(status_code=400, detail="Not enough signatures")
 
-    other_signatories = [
-        wallet.ss58_address
-        for user, wallet in group["wallets"].items()
-        if user in group["pending_tx"]["signers"][1:]
-    ]
-
-    call = group["pending_tx"]["call"]
-
-    # Compose the call hash
-    call_data = substrate.compose_call(
-        call_module=call.call_module,
-        call_function=call.call_function,
-        call_params=call.call_args,
-    ).data
-
-    call_hash = blake2b(call_data, digest_size=32).digest()
-
-    multi_sig_call = substrate.compose_call(
-        call_module="Multisig",
-        call_function="approve_as_multi",
-        call_params={
-            "threshold": group["threshold"],
-            "other_signatories": other_signatories,
-            "maybe_timepoint": None,
-            "call_hash": call_hash,
-            "store_call": True,
-            "max_weight": {
-                "proof_size": 0,
-                "ref_time": 1000000000,
-            },
-        },
+    # Take the batch off the group while it is submitted so a concurrent
+    # confirm can't submit it twice
+    pending_tx = group["pending_tx"]
+    group["pending_tx"] = None
+    multisig_call = prepared_calls.pop(group_id, None)
+    submission = asyncio.ensure_future(
+        run_chain(submit_pending, group, pending_tx, multisig_call, timeout=None)
     )
+    submissions[group_id] = submission
+    submission.add_done_callback(partial(finish_submission, group_id, pending_tx))
 
-    wallet = group["wallets"][group["pending_tx"]["signers"][0]]
-    extrinsic = substrate.create_signed_extrinsic(call=multi_sig_call, keypair=wallet)
-    receipt = substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True)
+    # Timing out only stops waiting; the batch stays in flight, so a retry
+    # can't submit it again
+    try:
+        tx_id = await asyncio.wait_for(asyncio.shield(submission), CHAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=504,
+            detail="Chain request timed out; the transaction is still being submitted",
+        )
+
+    return {"message": "Submitted transaction", "tx_id": tx_id}
+
+
+def finish_submission(group_id, pending_tx, submission):
+    del submissions[group_id]
+    group = groups[group_id]
+    # Only a submission that failed puts the batch back
+    if submission.cancelled() or submission.exception():
+        if group["pending_tx"] is None:
+            group["pending_tx"] = pending_tx
+    save_group(group_id)
 
-    group["pending_tx"] = None
 
-    return {"message": "Confirmed transaction", "receipt": receipt}
+@app.get("/tx/{tx_id}")
+async def get_tx(tx_id: str):
+    record = find_tx(tx_id)
+    if not record:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+
+    return record
 
 
 @app.get("/balance/{group_id}")
@@ -176,15 +411,43 @@ async def get_multisig_balance(group_id: str):
         raise HTTPException(status_code=404, detail="Group not found")
 
     multisig_address = group["multisig_address"]
-    balance_info = substrate.query("System", "Account", [multisig_address])
+    pool = chain_pool(group["chain"])
+    balances = await chain_call(get_balances, pool, [multisig_address])
+    balance_data = balances[multisig_address]
 
-    data = balance_info["data"]
+    return {"balance": balance_data}
 
-    balance_data = {
-        "free": int(data["free"].value),
-        "reserved": int(data["reserved"].value),
-        "frozen": int(data["frozen"].value),
-        "flags": int(data["flags"].value),
-    }
 
-    return {"balance": balance_data}
+@app.get("/balances")
+async def get_multisig_balances(group_ids: str):
+    requested = group_ids.split(",")
+    missing = [group_id for group_id in requested if group_id not in groups]
+    if missing:
+        raise HTTPException(
+            status_code=404, detail=f"Groups not found: {', '.join(missing)}"
+        )
+
+    # One storage query per chain the requested groups live on
+    by_chain = {}
+    for group_id in requested:
+        group = groups[group_id]
+        chain, addresses = by_chain.setdefault(
+            tuple(group["chain"].values()), (group["chain"], {})
+        )
+        addresses[group_id] = group["multisig_address"]
+
+    result = {}
+    for chain, addresses in by_chain.values():
+        balances = await chain_call(
+            get_balances, chain_pool(chain), list(addresses.values())
+        )
+        for group_id, address in addresses.items():
+            result[group_id] = {"balance": balances[address], "address": address}
+
+    return {"balances": result}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Includes the bot's metrics when it is served from this app by webhook
+    return render()
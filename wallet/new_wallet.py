@@ -1,19 +1,43 @@
-from substrateinterface import SubstrateInterface, Keypair
+from substrateinterface import Keypair
+from concurrent.futures import ProcessPoolExecutor
+import argparse
 import json
 
-# Connect to the Westend testnet
-substrate = SubstrateInterface(
-    url="wss://westend-rpc.polkadot.io", ss58_format=42, type_registry_preset="westend"
-)
 
-# Generate a new keypair
-keypair = Keypair.create_from_mnemonic(Keypair.generate_mnemonic())
+def generate_keys(_=None):
+    keypair = Keypair.create_from_mnemonic(Keypair.generate_mnemonic())
+    return {
+        "public_key": keypair.ss58_address,
+        "private_key": keypair.private_key.hex(),
+    }
 
-# Save the public and private keys to a file
-keys = {"public_key": keypair.ss58_address, "private_key": keypair.private_key.hex()}
 
-with open("westend_wallet_keys.json", "w") as key_file:
-    json.dump(keys, key_file)
+def main():
+    parser = argparse.ArgumentParser(description="Generate Westend wallet keys")
+    parser.add_argument(
+        "--count", type=int, help="generate this many keys in parallel as JSONL"
+    )
+    parser.add_argument("--out", default="westend_wallet_keys.jsonl")
+    args = parser.parse_args()
 
-print(f"Public key: {keypair.ss58_address}")
-print(f"Private key: {keypair.private_key.hex()}")
+    if args.count:
+        # Bulk mode: derive keys across all cores and stream them to disk
+        with ProcessPoolExecutor() as executor, open(args.out, "w") as key_file:
+            for keys in executor.map(generate_keys, range(args.count), chunksize=64):
+                key_file.write(json.dumps(keys) + "\n")
+        print(f"Wrote {args.count} keys to {args.out}")
+        return
+
+    # Generate a new keypair
+    keys = generate_keys()
+
+    # Save the public and private keys to a file
+    with open("westend_wallet_keys.json", "w") as key_file:
+        json.dump(keys, key_file)
+
+    print(f"Public key: {keys['public_key']}")
+    print(f"Private key: {keys['private_key']}")
+
+
+if __name__ == "__main__":
+    main()